@@ -2,15 +2,34 @@ import sys
 import argparse
 import os
 import logging
-from cli_backup.functions import get_image_hashes, find_duplicates, delete_duplicates
+import multiprocessing
+import cProfile
+import time
+from cli_backup.actions import ACTIONS, undo_journal
+from cli_backup.backends import HASH_BACKENDS, HASH_METHODS, VERIFY_METHODS, get_hash_function
+from cli_backup.multihash import MULTI_HASH_METHODS
+from cli_backup.report import REPORT_FORMATS
+from cli_backup.scanner import FileEntry
+from cli_backup.shards import check_shard_headers, parse_shard_spec, read_shard_file, write_shard_file
 from cli_backup.variables import Variables
 from cli_backup.logger import loggerSetup
 
+# Modules that import NumPy, Pillow or imagehash are imported by the functions
+# that need them, so that --help, argument errors and the GUI window do not
+# wait for them.
+
 def find_and_group_duplicates(var):
     """
     Finds and groups duplicate images without prompting for deletion.
     This function is designed to be called by the GUI.
+
+    The hashes of the scan are kept in var.image_hashes, for
+    prepare_threshold_sweep.
     """
+    from cli_backup.cascade import verify_groups
+    from cli_backup.functions import ScanCancelled, get_image_hashes
+    from cli_backup.search_index import DuplicateIndex
+
     logger = logging.getLogger(__name__)
 
     # Verify that the provided path is a valid directory
@@ -21,14 +40,25 @@ def find_and_group_duplicates(var):
     # Step 1: Get all image hashes
     try:
         logger.info(f"Scanning '{var.target_directory}' with threshold {var.threshold} and strategy '{var.strategy}'...")
-        hashes_map = get_image_hashes(var)
+        index = DuplicateIndex(var.threshold)
+        var.image_hashes = var.threshold_sweep = None
+        with var.metrics.stage('scan'):
+            get_image_hashes(var, var.hash_size, var.hash_method, index=index)
+    except ScanCancelled:
+        logger.info("Scan cancelled.")
+        return []
     except Exception as e:
         logger.error(f"An unexpected error occurred during hashing: {e}")
         return []
 
-    # Step 2: Find duplicate groups using the corrected function
+    # Step 2: Collect the duplicate groups, which were built while hashing
     try:
-        duplicate_groups = find_duplicates(hashes_map, threshold=var.threshold)
+        with var.metrics.stage('group'):
+            var.image_hashes = index.store
+            duplicate_groups = index.groups(var.metrics)
+        if var.verify_method:
+            with var.metrics.stage('verify'):
+                duplicate_groups = verify_groups(var, duplicate_groups)
         logger.info(f"Successfully found {len(duplicate_groups)} groups of duplicates.")
     except Exception as e:
         logger.error(f"An unexpected error occurred while finding duplicates: {e}")
@@ -36,62 +66,364 @@ def find_and_group_duplicates(var):
 
     return duplicate_groups
 
+def prepare_threshold_sweep(var, max_threshold):
+    """
+    Finds the pairs of hashes of the last scan within max_threshold of each
+    other, in var.threshold_sweep, so that regroup_duplicates can then
+    regroup its files at any threshold up to max_threshold. This function is
+    designed to be called by the GUI, the first time the threshold changes.
+    """
+    from cli_backup.search_index import ThresholdSweep
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Finding the pairs of the last scan within {max_threshold} bits...")
+    with var.metrics.stage('sweep'):
+        var.threshold_sweep = ThresholdSweep(var.image_hashes, max_threshold, var.metrics)
+    logger.info(f"Found {len(var.threshold_sweep)} pairs.")
+
+def regroup_duplicates(var):
+    """
+    Regroups the files of the last scan at var.threshold, which must not
+    exceed the max_threshold given to prepare_threshold_sweep, without
+    rescanning. This function is designed to be called by the GUI.
+    """
+    from cli_backup.cascade import verify_groups
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Regrouping the {len(var.image_hashes)} files of the last scan with threshold {var.threshold}...")
+    try:
+        with var.metrics.stage('group'):
+            duplicate_groups = var.threshold_sweep.groups(var.threshold)
+        if var.verify_method:
+            with var.metrics.stage('verify'):
+                duplicate_groups = verify_groups(var, duplicate_groups)
+        logger.info(f"Successfully found {len(duplicate_groups)} groups of duplicates.")
+    except Exception as e:
+        logger.error(f"An unexpected error occurred while finding duplicates: {e}")
+        return []
+
+    return duplicate_groups
+
+def write_metrics(var):
+    """
+    Logs the stage timings and writes the metrics files that were requested.
+    """
+    logger = logging.getLogger(__name__)
+    var.metrics.log_summary()
+    try:
+        if var.metrics_json_path:
+            var.metrics.write_json(var.metrics_json_path)
+        if var.metrics_prometheus_path:
+            var.metrics.write_prometheus(var.metrics_prometheus_path)
+    except OSError as e:
+        logger.error(f"Could not write metrics: {e}")
+
 def main(var):
     """
     The main function to run the duplicate image detection and deletion tool.
     This is for command-line execution and is not used by the GUI.
     """
+    from cli_backup.functions import get_image_hashes
+    from cli_backup.search_index import DuplicateIndex
+    from cli_backup.watch import watch_directory
+
     logger.info("\n***************")
     logger.info("Starting Script")
     logger.info("***************\n")
     
+    # Undoing only needs the journal, whose paths are absolute.
+    if var.undo_journal_path:
+        undo_journal(var.undo_journal_path)
+        return
+
     if not os.path.isdir(var.target_directory):
         logger.error(f"Error: The provided path '{var.target_directory}' is not a valid directory.")
         sys.exit(1)
 
+    if var.shard is not None:
+        scan_shard(var)
+        return
+
+    if var.watch:
+        # Watch mode only reports duplicates; it never deletes anything.
+        watch_directory(var, var.hash_size, var.hash_method)
+        return
+
+    if var.sweep_thresholds:
+        sweep_thresholds(var)
+        return
+
+    # Profiles the hot path: hashing and grouping.
+    profiler = cProfile.Profile() if var.profile_path else None
+    if profiler is not None:
+        profiler.enable()
+
     try:
         logger.info(f"Scanning '{var.target_directory}' with threshold {var.threshold} and strategy '{var.strategy}'...")
-        hashes_map = get_image_hashes(var)
+        index = DuplicateIndex(var.threshold)
+        with var.metrics.stage('scan'):
+            get_image_hashes(var, var.hash_size, var.hash_method, index=index)
     except Exception as e:
         logger.info(f"An unexpected error occurred during hashing: {e}")
         sys.exit(1)
+    var.image_hashes = index.store
     
+    finish_run(var, index, profiler)
+
+def sweep_thresholds(var):
+    """
+    Scans the target directory once and reports the number of duplicate
+    groups at every threshold in var.sweep_thresholds. Nothing is deleted.
+    """
+    from cli_backup.functions import get_image_hashes
+    from cli_backup.search_index import ThresholdSweep
+    from cli_backup.store import ImageStore
+
+    logger.info(f"Scanning '{var.target_directory}' for a sweep of thresholds {', '.join(map(str, var.sweep_thresholds))}...")
+    store = ImageStore()
+    try:
+        with var.metrics.stage('scan'):
+            get_image_hashes(var, var.hash_size, var.hash_method, index=store)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during hashing: {e}")
+        sys.exit(1)
+    var.image_hashes = store
+
+    with var.metrics.stage('group'):
+        sweep = ThresholdSweep(store, max(var.sweep_thresholds), var.metrics)
+        logger.info(f"{len(store)} files, {store.num_hashes} distinct hashes, {len(sweep)} pairs within {sweep.max_threshold} bits:")
+        for threshold in var.sweep_thresholds:
+            groups, duplicates = sweep.counts(threshold)
+            logger.info(f"  Threshold {threshold:>3}: {groups} groups, {duplicates} duplicates")
+
+    write_metrics(var)
+
+def scan_shard(var):
+    """
+    Hashes this process's shard of the tree and writes the hashes to a shard
+    file, to be combined later with the merge command.
+    """
+    from cli_backup.functions import get_image_hashes
+
+    index, count = var.shard
+    shard_path = var.shard_output or f"shard-{index}-of-{count}.jsonl.gz"
+    logger.info(f"Scanning shard {index}/{count} (by {var.shard_by}) of '{var.target_directory}'...")
+
+    entries = {}
+    try:
+        with var.metrics.stage('scan'):
+            hashes_map = get_image_hashes(var, var.hash_size, var.hash_method, entries=entries)
+        write_shard_file(shard_path, var, var.hash_method, var.hash_size, hashes_map, entries)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred while scanning the shard: {e}")
+        sys.exit(1)
+
+    write_metrics(var)
+
+def merge_main(var, shard_paths):
+    """
+    Combines the shard files of a sharded scan, then groups and acts on the
+    duplicates across all of them as a normal run would.
+    """
+    from cli_backup.search_index import DuplicateIndex
+
+    logger.info(f"Merging {len(shard_paths)} shard files...")
+    index = DuplicateIndex(var.threshold)
+    try:
+        with var.metrics.stage('merge'):
+            shards = {shard_path: read_shard_file(shard_path) for shard_path in shard_paths}
+            check_shard_headers({shard_path: header for shard_path, (header, _) in shards.items()})
+            # Shard paths are relative to the scanned directory.
+            for header, rows in shards.values():
+                for file_path, size, image_hash in rows:
+                    index.add(image_hash, os.path.join(header['target_directory'], file_path), size)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not merge shards: {e}")
+        sys.exit(1)
+
+    # Settings of the scan that produced the shards.
+    header = next(iter(shards.values()))[0]
+    var.target_directory = header['target_directory']
+    var.hash_method = header['hash_method']
+    var.hash_size = header['hash_size']
+    var.decode_mode = header['decode_mode']
+    logger.info(f"Merged {len(index.store)} files from {len(shards)} shards of '{var.target_directory}'.")
+
+    finish_run(var, index)
+
+def build_index_main(var):
+    """
+    Scans the target directory and writes its hashes to a persistent index,
+    for the index query command. Nothing is grouped or deleted.
+    """
+    from cli_backup.functions import get_image_hashes
+    from cli_backup.index_file import write_index_file
+    from cli_backup.store import ImageStore
+
+    if not os.path.isdir(var.target_directory):
+        logger.error(f"Error: The provided path '{var.target_directory}' is not a valid directory.")
+        sys.exit(1)
+
+    # Indexed paths are absolute, so the index can be queried from anywhere.
+    var.target_directory = os.path.abspath(var.target_directory)
+    logger.info(f"Building an index of '{var.target_directory}'...")
+    store = ImageStore()
+    try:
+        with var.metrics.stage('scan'):
+            get_image_hashes(var, var.hash_size, var.hash_method, index=store)
+        with var.metrics.stage('index'):
+            write_index_file(var.index_path, store, var.target_directory, var.hash_method, var.hash_size, var.decode_mode)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred while building the index: {e}")
+        sys.exit(1)
+
+    write_metrics(var)
+
+def query_index_main(var, file_paths):
+    """
+    Hashes the given images with the settings of the index and lists the
+    indexed images within var.threshold of each of them. With
+    var.orientation_invariant, every orientation of the images is looked up
+    and each indexed image is listed at its closest distance.
+
+    Returns:
+        int: The exit status: 0 if any image matched, 1 if none did, 2 if an
+             image or the index could not be read.
+    """
+    from cli_backup.functions import hash_file_entries
+    from cli_backup.index_file import IndexFile
+
+    start = time.perf_counter()
     try:
-        var.duplicate_groups = find_duplicates(hashes_map, threshold=var.threshold)
+        index_file = IndexFile(var.index_path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not open the index: {e}")
+        return 2
+
+    status = 1
+    with index_file:
+        header = index_file.header
+        dihedral = var.orientation_invariant
+        if dihedral and header['hash_method'] not in MULTI_HASH_METHODS:
+            logger.error(f"Orientation-invariant queries do not support {header['hash_method']} indexes.")
+            return 2
+        entries = []
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError as e:
+                logger.error(f"Could not process file {file_path}: {e}")
+                status = 2
+                continue
+            entries.append(FileEntry(file_path, stat.st_size, stat.st_mtime_ns))
+
+        for entry, image_hash, error in hash_file_entries(
+            entries, header['hash_size'], header['hash_method'], header['decode_mode'], workers=1, dihedral=dihedral
+        ):
+            if error is not None:
+                logger.error(f"Could not process file {entry.path}: {error}")
+                status = 2
+                continue
+            if dihedral:
+                closest = {}
+                for variant in image_hash:
+                    for file_path, distance, size in index_file.query(variant, var.threshold):
+                        if file_path not in closest or distance < closest[file_path][1]:
+                            closest[file_path] = (file_path, distance, size)
+                matches = sorted(closest.values(), key=lambda match: (match[1], match[0]))
+            else:
+                matches = index_file.query(image_hash, var.threshold)
+            logger.info(f"{entry.path}: {len(matches)} matches")
+            for file_path, distance, _ in matches:
+                logger.info(f"  - {file_path} (distance {distance})")
+            if matches and status == 1:
+                status = 0
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"Checked {len(entries)} images against {len(index_file)} indexed files in {elapsed_ms:.1f} ms.")
+    return status
+
+def serve_main(var, host, port, batch_size, batch_window):
+    """
+    Runs the HTTP service on the target directory until interrupted.
+    """
+    from cli_backup.service import serve
+
+    if not os.path.isdir(var.target_directory):
+        logger.error(f"Error: The provided path '{var.target_directory}' is not a valid directory.")
+        sys.exit(1)
+    serve(var, host, port, batch_size, batch_window)
+
+def finish_run(var, index, profiler=None):
+    """
+    Groups the hashes collected in the index, optionally verifies the groups,
+    writes the report, and deletes (or otherwise handles) the duplicates.
+    """
+    from cli_backup.cascade import verify_groups
+    from cli_backup.functions import delete_duplicates, plan_deletions
+    from cli_backup.report import write_report
+
+    try:
+        with var.metrics.stage('group'):
+            var.duplicate_groups = index.groups(var.metrics)
+        if var.verify_method:
+            with var.metrics.stage('verify'):
+                var.duplicate_groups = verify_groups(var, var.duplicate_groups)
+        var.metrics.count('duplicate_groups_total', len(var.duplicate_groups))
         logger.info(f"Successfully found duplicate groups")
     except Exception as e:
         logger.error(f"An unexpected error occurred while finding duplicates: {e}")
         sys.exit(1)
 
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(var.profile_path)
+        logger.info(f"Profile written to {var.profile_path}")
+
+    deletion_plan = plan_deletions(var, var.strategy)
+    if var.output_path:
+        # The report is complete before anything is changed on disk.
+        try:
+            with var.metrics.stage('report'):
+                write_report(var, deletion_plan)
+        except OSError as e:
+            logger.error(f"Could not write the report: {e}")
+            sys.exit(1)
+
     try:
-        delete_duplicates(var, deletion_strategy=var.strategy)
+        with var.metrics.stage('delete'):
+            delete_duplicates(var, deletion_strategy=var.strategy, deletion_plan=deletion_plan)
     except Exception as e:
         logger.error(f"An unexpected error occurred during deletion: {e}")
         sys.exit(1)
+
+    write_metrics(var)
         
     logger.info("\n************")
     logger.info("Script Ended")
     logger.info("************")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="A tool to detect and delete duplicate and near-duplicate images based on their content."
-    )
-    
-    parser.add_argument(
-        "directory",
-        type=str,
-        help="The path to the directory to scan for duplicate images."
-    )
+    multiprocessing.freeze_support()
+
+    # Options shared by a normal run and the merge command.
+    common = argparse.ArgumentParser(add_help=False)
+    # Options of every command that hashes images: a normal run, the merge
+    # command (for verification) and building an index.
+    hashing = argparse.ArgumentParser(add_help=False)
+    # Options that choose the hash, for the commands that scan a directory.
+    hash_choice = argparse.ArgumentParser(add_help=False)
+    # Options that only apply to a normal run.
+    scan_options = argparse.ArgumentParser(add_help=False)
     
-    parser.add_argument(
+    common.add_argument(
         "--threshold",
         type=int,
         default=10,
         help="The maximum Hamming distance for two images to be considered near-duplicates. (default: 10)"
     )
     
-    parser.add_argument(
+    common.add_argument(
         "--strategy",
         type=str,
         default='keep_first',
@@ -99,28 +431,539 @@ if __name__ == "__main__":
         help="The strategy to use for deletion: 'keep_first' or 'keep_smallest'. (default: 'keep_first')"
     )
     
-    parser.add_argument(
+    common.add_argument(
         "--dry_run",
         type=str,
         default='yes',
         help="Do you want to delete the files? Yes or No. (default: no)"
     )
 
+    common.add_argument(
+        "--action",
+        type=str,
+        default='delete',
+        choices=list(ACTIONS),
+        help="What to do with duplicates: delete them, replace them with hardlinks or symlinks to the kept file, or move them to --quarantine_dir. (default: 'delete')"
+    )
+
+    common.add_argument(
+        "--quarantine_dir",
+        type=str,
+        default=None,
+        help="Directory duplicates are moved to with --action quarantine. With hardlink or symlink, the replaced files are moved there so the run can be undone."
+    )
+
+    common.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="Record every completed action in this file. An interrupted run given the same journal resumes where it stopped."
+    )
+
+    common.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Write the duplicate groups, with the kept file and the hash, distance and size of every file, to this report instead of logging them. It is written before any file is changed, so with --dry_run yes it can be handed to other tools."
+    )
+
+    common.add_argument(
+        "--output_format",
+        type=str,
+        default=None,
+        choices=REPORT_FORMATS,
+        help="The report format. (default: 'csv' for .csv files, 'jsonl' otherwise)"
+    )
+
+    scan_options.add_argument(
+        "--undo",
+        type=str,
+        default=None,
+        metavar="JOURNAL",
+        help="Move the files quarantined by the run recorded in JOURNAL back into place, then exit. No directory is needed."
+    )
+
+    common.add_argument(
+        "--io_workers",
+        type=int,
+        default=16,
+        help="Number of threads used to delete, link or move files. (default: 16)"
+    )
+
+    hash_choice.add_argument(
+        "--hash_method",
+        type=str,
+        default='dhash',
+        choices=list(HASH_METHODS),
+        help="The perceptual hash used to compare images. (default: 'dhash')"
+    )
+
+    hash_choice.add_argument(
+        "--hash_size",
+        type=int,
+        default=8,
+        help="The hash size. Hashes have hash_size * hash_size bits; whash needs a power of 2. (default: 8)"
+    )
+
+    common.add_argument(
+        "--verify_method",
+        type=str,
+        default=None,
+        choices=list(VERIFY_METHODS),
+        help="Confirm the groups found with --hash_method using this stronger hash, computed only for files in a candidate group. Not used in watch mode. (default: no verification)"
+    )
+
+    common.add_argument(
+        "--verify_size",
+        type=int,
+        default=16,
+        help="The hash size of the verification hash. (default: 16)"
+    )
+
+    common.add_argument(
+        "--verify_threshold",
+        type=int,
+        default=None,
+        help="The maximum Hamming distance between verification hashes. (default: --threshold scaled to the verification hash size)"
+    )
+
+    hashing.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used for hashing images. Use 0 for one per CPU core. (default: 1)"
+    )
+
+    hashing.add_argument(
+        "--hash_backend",
+        type=str,
+        default='auto',
+        choices=['auto'] + list(HASH_BACKENDS),
+        help="The implementation of the hashes. 'numpy' computes dhash and ahash with Pillow and NumPy only; 'imagehash' supports every hash. All backends give the same hashes. 'auto' uses 'numpy' where it can. (default: 'auto')"
+    )
+
+    hashing.add_argument(
+        "--read_ahead_threads",
+        type=int,
+        default=0,
+        help="Read files on this many I/O threads ahead of decoding, so slow (e.g. network) storage and the CPU are busy at the same time. Use 0 to disable. (default: 0)"
+    )
+
+    hashing.add_argument(
+        "--read_ahead_mb",
+        type=int,
+        default=64,
+        help="The maximum amount of file data, in MB, read ahead and not yet decoded. (default: 64)"
+    )
+
+    hashing.add_argument(
+        "--decode",
+        type=str,
+        default='full',
+        choices=['full', 'fast'],
+        help="How images are decoded before hashing. 'fast' decodes JPEGs at reduced size straight to grayscale. (default: 'full')"
+    )
+
+    hashing.add_argument(
+        "--max_pixels",
+        type=int,
+        default=None,
+        help="Skip images larger than this many pixels (width x height) without decoding them. (default: no limit beyond Pillow's decompression bomb check)"
+    )
+
+    hashing.add_argument(
+        "--max_file_mb",
+        type=float,
+        default=None,
+        help="Skip files larger than this many MB without reading them. (default: no limit)"
+    )
+
+    hashing.add_argument(
+        "--decode_timeout",
+        type=float,
+        default=None,
+        help="Skip files whose decoding and hashing take longer than this many seconds. Files are then hashed one at a time in worker processes, and the worker of a file that overruns is killed and replaced. (default: no limit)"
+    )
+
+    hashing.add_argument(
+        "--skip_list",
+        type=str,
+        default=None,
+        help="Write the files skipped for exceeding a limit to this JSON lines file, with the reason."
+    )
+
+    hash_choice.add_argument(
+        "--no_exact_prefilter",
+        action="store_true",
+        help="Decode and hash every file, instead of matching byte-identical copies by size and content hash first."
+    )
+
+    scan_options.add_argument(
+        "--orientation_invariant",
+        action="store_true",
+        help="Also match images that are rotated by a multiple of 90 degrees or mirrored. The hashes of all 8 orientations are computed from one decode. Only for ahash, dhash and phash (and phash verification); not with --watch or --shard."
+    )
+
+    scan_options.add_argument(
+        "--thresholds",
+        type=str,
+        default=None,
+        metavar="T1,T2,...",
+        help="Scan once and report the number of duplicate groups at each of these comma-separated thresholds, e.g. 4,6,8,10, instead of grouping at --threshold. Nothing is deleted. Not with --watch, --shard or --verify_method."
+    )
+
+    scan_options.add_argument(
+        "--scan_archives",
+        action="store_true",
+        help="Also hash the images inside zip and tar archives (also .tar.gz, .tar.bz2 and .tar.xz), without extracting them. Members are listed as archive.zip!/path/in/archive.jpg and are never deleted, linked or moved. Not with --watch."
+    )
+
+    scan_options.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running after the initial scan and report new duplicates as files change. Nothing is deleted in this mode."
+    )
+
+    scan_options.add_argument(
+        "--watch_backend",
+        type=str,
+        default='auto',
+        choices=['auto', 'inotify', 'poll'],
+        help="How changes are detected in watch mode. 'auto' uses inotify where available and polls directory mtimes otherwise. (default: 'auto')"
+    )
+
+    scan_options.add_argument(
+        "--poll_interval",
+        type=float,
+        default=5.0,
+        help="Seconds between directory checks when polling in watch mode. (default: 5)"
+    )
+
+    hashing.add_argument(
+        "--metrics_json",
+        type=str,
+        default=None,
+        help="Write per-stage timings, counters and the decode time histogram to this JSON file."
+    )
+
+    hashing.add_argument(
+        "--metrics_prometheus",
+        type=str,
+        default=None,
+        help="Write the same metrics in Prometheus text format, e.g. into the node exporter's textfile collector directory (use a .prom extension)."
+    )
+
+    common.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Dump cProfile stats of hashing and grouping to this file. Decoding in worker processes is only included with --workers 1."
+    )
+
+    hashing.add_argument(
+        "--cache_file",
+        type=str,
+        default=None,
+        help="Path of a persistent hash cache. Unchanged images are not re-hashed on later scans. (default: no cache)"
+    )
+
+    hashing.add_argument(
+        "--invalidate_cache",
+        action="store_true",
+        help="Discard every entry in the hash cache before scanning."
+    )
+
+    scan_options.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        metavar="I/N",
+        help="Only hash shard I of N (0 <= I < N) and write the hashes to a shard file instead of grouping them. Combine the shard files with the merge command."
+    )
+
+    scan_options.add_argument(
+        "--shard_by",
+        type=str,
+        default='path',
+        choices=['path', 'directory'],
+        help="Split the tree between shards by the hash of each file path, or by top-level directory. (default: 'path')"
+    )
+
+    scan_options.add_argument(
+        "--shard_output",
+        type=str,
+        default=None,
+        help="The shard file to write. A .gz name is compressed. (default: shard-I-of-N.jsonl.gz)"
+    )
+
+    parser = argparse.ArgumentParser(
+        description="A tool to detect and delete duplicate and near-duplicate images based on their content.",
+        epilog="Run '%(prog)s merge --help' to combine the shard files of a sharded scan, "
+               "'%(prog)s index --help' to build and query a persistent index, and "
+               "'%(prog)s serve --help' to run the HTTP service.",
+        parents=[common, hashing, hash_choice, scan_options],
+    )
+
+    parser.add_argument(
+        "directory",
+        type=str,
+        nargs='?',
+        help="The path to the directory to scan for duplicate images. Not needed with --undo."
+    )
+
+    merge_parser = argparse.ArgumentParser(
+        prog=f"{parser.prog} merge",
+        description="Combines the shard files written by --shard runs and finds the duplicates across all of them.",
+        parents=[common, hashing],
+    )
+
+    merge_parser.add_argument(
+        "shards",
+        nargs='+',
+        help="The shard files, one for every shard of the scan."
+    )
+
+    index_parser = argparse.ArgumentParser(
+        prog=f"{parser.prog} index",
+        description="Builds a persistent, memory-mapped index of a library, and checks new images against it without rescanning.",
+    )
+    index_commands = index_parser.add_subparsers(dest='index_command', metavar='{build,query}')
+    index_commands.required = True
+
+    build_parser = index_commands.add_parser(
+        "build",
+        help="Scan a directory and write its hashes to an index.",
+        description="Scans a directory and writes its hashes to an index. Nothing is grouped or deleted.",
+        parents=[hashing, hash_choice],
+    )
+
+    build_parser.add_argument(
+        "directory",
+        type=str,
+        help="The path to the directory to index."
+    )
+
+    build_parser.add_argument(
+        "--scan_archives",
+        action="store_true",
+        help="Also index the images inside zip and tar archives, without extracting them. Members are listed as archive.zip!/path/in/archive.jpg."
+    )
+
+    query_parser = index_commands.add_parser(
+        "query",
+        help="Find the indexed images that match the given images.",
+        description="Hashes only the given images, with the hash settings of the index, and lists the indexed images within the threshold. "
+                    "Exits with 0 if any image matched, 1 if none did and 2 on errors.",
+    )
+
+    query_parser.add_argument(
+        "--threshold",
+        type=int,
+        default=10,
+        help="The maximum Hamming distance for an indexed image to match. (default: 10)"
+    )
+
+    query_parser.add_argument(
+        "--orientation_invariant",
+        action="store_true",
+        help="Also match indexed images that are rotated or mirrored copies of the given images. Only for indexes of ahash, dhash or phash hashes."
+    )
+
+    query_parser.add_argument(
+        "files",
+        nargs='+',
+        help="The images to look up."
+    )
+
+    for index_command in (build_parser, query_parser):
+        index_command.add_argument(
+            "--index",
+            type=str,
+            default='duplicate_index.bin',
+            help="The index file. (default: 'duplicate_index.bin')"
+        )
+
+    serve_parser = argparse.ArgumentParser(
+        prog=f"{parser.prog} serve",
+        description="Scans a directory once, keeps its hashes in memory, and serves an HTTP API to submit images, "
+                    "query near-duplicates and rescan the directory without restarting.",
+        parents=[hashing, hash_choice],
+    )
+
+    serve_parser.add_argument(
+        "directory",
+        type=str,
+        help="The path to the directory to keep indexed."
+    )
+
+    serve_parser.add_argument(
+        "--threshold",
+        type=int,
+        default=10,
+        help="The maximum Hamming distance for near-duplicates, and the widest a query may ask for. (default: 10)"
+    )
+
+    serve_parser.add_argument(
+        "--host",
+        type=str,
+        default='127.0.0.1',
+        help="The address to listen on. Use 0.0.0.0 inside a container. (default: 127.0.0.1)"
+    )
+
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="The port to listen on. (default: 8000)"
+    )
+
+    serve_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=256,
+        help="The most files hashed in one batch. (default: 256)"
+    )
+
+    serve_parser.add_argument(
+        "--batch_window_ms",
+        type=float,
+        default=10.0,
+        help="How long, in milliseconds, a batch waits for more requests to join it before hashing starts. (default: 10)"
+    )
+
     logger = loggerSetup()
     logger = logging.getLogger(__name__)
 
+    command = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in ('merge', 'index', 'serve') else None
     try:
-        args = parser.parse_args()
+        if command == 'merge':
+            parser = merge_parser
+            args = parser.parse_args(sys.argv[2:])
+        elif command == 'index':
+            parser = index_parser
+            args = parser.parse_args(sys.argv[2:])
+        elif command == 'serve':
+            parser = serve_parser
+            args = parser.parse_args(sys.argv[2:])
+        else:
+            args = parser.parse_args()
     except Exception as e:        
         logger.info(f"Error parsing arguments: {e}", file=sys.stderr)
         sys.exit(1)
-        
-    
+
     var = Variables()
-    var.target_directory = args.directory
+
+    if command == 'index' and args.index_command == 'query':
+        var.index_path = args.index
+        var.threshold = args.threshold
+        var.orientation_invariant = args.orientation_invariant
+        sys.exit(query_index_main(var, args.files))
+
+    hash_sizes = []
+    if command not in ('index', 'serve'):
+        if args.action == 'quarantine' and not args.quarantine_dir:
+            parser.error("--action quarantine needs --quarantine_dir.")
+        hash_sizes.append((args.verify_method, args.verify_size))
+    if command != 'merge':
+        hash_sizes.append((args.hash_method, args.hash_size))
+    for method, size in hash_sizes:
+        if size < 2 or (method == 'whash' and size & (size - 1)):
+            parser.error(f"Invalid hash size {size} for {method}.")
+        if method is not None:
+            try:
+                get_hash_function(method, args.hash_backend)
+            except ValueError as e:
+                parser.error(str(e))
+
+    for name in ('max_pixels', 'max_file_mb', 'decode_timeout'):
+        if getattr(args, name) is not None and getattr(args, name) <= 0:
+            parser.error(f"--{name} must be positive.")
+
+    var.workers = args.workers
+    var.hash_backend = args.hash_backend
+    var.read_ahead_threads = args.read_ahead_threads
+    var.read_ahead_bytes = args.read_ahead_mb * 1024 * 1024
+    var.decode_mode = args.decode
+    var.max_image_pixels = args.max_pixels
+    var.max_file_bytes = int(args.max_file_mb * 1024 * 1024) if args.max_file_mb is not None else None
+    var.decode_timeout = args.decode_timeout
+    var.skip_list_path = args.skip_list
+    var.cache_path = args.cache_file
+    var.invalidate_cache = args.invalidate_cache
+    var.metrics_json_path = args.metrics_json
+    var.metrics_prometheus_path = args.metrics_prometheus
+
+    if command == 'index':
+        var.target_directory = args.directory
+        var.index_path = args.index
+        var.hash_method = args.hash_method
+        var.hash_size = args.hash_size
+        var.exact_prefilter = not args.no_exact_prefilter
+        var.scan_archives = args.scan_archives
+        build_index_main(var)
+        sys.exit(0)
+
+    if command == 'serve':
+        var.target_directory = args.directory
+        var.threshold = args.threshold
+        var.hash_method = args.hash_method
+        var.hash_size = args.hash_size
+        var.exact_prefilter = not args.no_exact_prefilter
+        serve_main(var, args.host, args.port, args.batch_size, args.batch_window_ms / 1000.0)
+        sys.exit(0)
+
     var.threshold = args.threshold
     var.strategy = args.strategy
     var.dry_run = True if args.dry_run.lower() == 'yes' else False
-    
+    var.action = args.action
+    var.quarantine_dir = args.quarantine_dir
+    var.journal_path = args.journal
+    var.output_path = args.output
+    var.output_format = args.output_format
+    var.io_workers = args.io_workers
+    var.verify_method = args.verify_method
+    var.verify_size = args.verify_size
+    var.verify_threshold = args.verify_threshold
+    var.profile_path = args.profile
+
+    if command == 'merge':
+        merge_main(var, args.shards)
+        sys.exit(0)
+
+    if args.directory is None and not args.undo:
+        parser.error("the following arguments are required: directory")
+    var.target_directory = args.directory
+    var.undo_journal_path = args.undo
+    var.hash_method = args.hash_method
+    var.hash_size = args.hash_size
+    var.exact_prefilter = not args.no_exact_prefilter
+    var.orientation_invariant = args.orientation_invariant
+    if var.orientation_invariant:
+        if args.watch or args.shard:
+            parser.error("--orientation_invariant cannot be combined with --watch or --shard.")
+        if args.hash_method not in MULTI_HASH_METHODS or args.verify_method not in (None,) + MULTI_HASH_METHODS:
+            parser.error(f"--orientation_invariant only supports {', '.join(MULTI_HASH_METHODS)} hashes.")
+    if args.thresholds:
+        try:
+            var.sweep_thresholds = sorted({int(value) for value in args.thresholds.split(',')})
+        except ValueError:
+            parser.error("--thresholds must be a comma-separated list of integers.")
+        if var.sweep_thresholds[0] < 0:
+            parser.error("--thresholds must not be negative.")
+        if args.watch or args.shard or args.verify_method:
+            parser.error("--thresholds cannot be combined with --watch, --shard or --verify_method.")
+    var.scan_archives = args.scan_archives
+    if var.scan_archives and args.watch:
+        parser.error("--scan_archives cannot be combined with --watch.")
+    var.watch = args.watch
+    var.watch_backend = args.watch_backend
+    var.poll_interval = args.poll_interval
+    if args.shard:
+        try:
+            var.shard = parse_shard_spec(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    var.shard_by = args.shard_by
+    var.shard_output = args.shard_output
 
-    main(var)
\ No newline at end of file
+    main(var)
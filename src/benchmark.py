@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from collections import Counter
+
+from cli_backup.corpus import CORPUS_SCALES, load_corpus
+from cli_backup.functions import HASH_METHODS, get_image_hashes, find_duplicates
+from cli_backup.metrics import Metrics
+from cli_backup.prefetch import ThrottledReader
+from cli_backup.variables import Variables
+from cli_backup.logger import loggerSetup
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_bytes():
+    """
+    The peak is a high-water mark over the whole run so far, not over the
+    last stage: a stage that follows a hungrier one reports the earlier peak.
+
+    Returns:
+        int or None: The peak resident set size of this process and its
+                     finished worker processes, or None where unavailable.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    ) * unit
+
+
+def _pairs(count):
+    return count * (count - 1) // 2
+
+
+def score_groups(duplicate_groups, ground_truth):
+    """
+    Compares duplicate groups with the ground truth, pair by pair: two files
+    are a true pair if they were generated from the same original.
+
+    Args:
+        duplicate_groups (list): Groups of file paths relative to the corpus.
+        ground_truth (dict): The index of the original of every file.
+
+    Returns:
+        dict: Predicted, true and correct pair counts with precision and recall.
+    """
+    true_pairs = sum(_pairs(count) for count in Counter(ground_truth.values()).values())
+    predicted_pairs = 0
+    correct_pairs = 0
+    for group in duplicate_groups:
+        predicted_pairs += _pairs(len(group))
+        sources = Counter(ground_truth[file_path] for file_path in group)
+        correct_pairs += sum(_pairs(count) for count in sources.values())
+
+    return {
+        'predicted_pairs': predicted_pairs,
+        'true_pairs': true_pairs,
+        'correct_pairs': correct_pairs,
+        'precision': correct_pairs / predicted_pairs if predicted_pairs else 1.0,
+        'recall': correct_pairs / true_pairs if true_pairs else 1.0,
+    }
+
+
+def benchmark_hashing(var, hash_method, hash_size):
+    """
+    Times get_image_hashes over the corpus.
+
+    Returns:
+        tuple: (hashes_map, results dictionary).
+    """
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    hashes_map = get_image_hashes(var, hash_size, hash_method)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    num_files = sum(len(paths) for paths in hashes_map.values())
+    return hashes_map, {
+        'files': num_files,
+        'distinct_hashes': len(hashes_map),
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'files_per_second': num_files / wall if wall else None,
+        'cumulative_peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def benchmark_grouping(hashes_map, threshold, corpus_dir, ground_truth):
+    """
+    Times find_duplicates at one threshold and scores its groups.
+
+    Returns:
+        dict: The timing and accuracy results.
+    """
+    metrics = Metrics()
+    wall_start = time.perf_counter()
+    duplicate_groups = find_duplicates(hashes_map, threshold, metrics)
+    wall = time.perf_counter() - wall_start
+
+    # The hash pairs whose distance was actually computed: the candidates
+    # of the multi-index search, or all pairs when it falls back to brute
+    # force.
+    comparisons = metrics.counters['comparisons_total']
+    relative_groups = [
+        [os.path.relpath(file_path, corpus_dir).replace(os.sep, '/') for file_path in group]
+        for group in duplicate_groups
+    ]
+    return {
+        'threshold': threshold,
+        'groups': len(duplicate_groups),
+        'wall_seconds': wall,
+        'comparisons': comparisons,
+        'pairs_per_second': comparisons / wall if wall else None,
+        'cumulative_peak_rss_bytes': peak_rss_bytes(),
+        'accuracy': score_groups(relative_groups, ground_truth),
+    }
+
+
+def git_revision():
+    """
+    Returns:
+        str or None: The commit the benchmark was run on, if known.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(corpus_dir, num_images, seed, hash_methods, hash_size, thresholds, workers, decode_mode,
+                   read_ahead_threads=0, read_latency_ms=0):
+    """
+    Generates (or reuses) a corpus and benchmarks every hash method on it at
+    every threshold. A read latency simulates a network filesystem; every
+    file read by the decoder or the read-ahead stage is delayed by it.
+
+    Returns:
+        dict: The JSON-serializable benchmark report.
+    """
+    wall_start = time.perf_counter()
+    manifest = load_corpus(corpus_dir, num_images, seed)
+    corpus_seconds = time.perf_counter() - wall_start
+
+    var = Variables()
+    var.target_directory = corpus_dir
+    var.workers = workers
+    var.decode_mode = decode_mode
+    var.read_ahead_threads = read_ahead_threads
+    if read_latency_ms:
+        var.read_file = ThrottledReader(latency=read_latency_ms / 1000.0)
+        if not read_ahead_threads:
+            # The throttled reader is only used by the read-ahead stage; with
+            # no byte budget it reads one file at a time, only once the
+            # previous one was decoded, like the decoder reading it itself.
+            var.read_ahead_threads = 1
+            var.read_ahead_bytes = 0
+
+    results = []
+    for hash_method in hash_methods:
+        logger.info(f"Benchmarking {hash_method} (hash size {hash_size})...")
+        hashes_map, hashing = benchmark_hashing(var, hash_method, hash_size)
+        logger.info(f"  hashing: {hashing['files_per_second']:.1f} files/s")
+
+        for threshold in thresholds:
+            grouping = benchmark_grouping(hashes_map, threshold, corpus_dir, manifest['files'])
+            accuracy = grouping['accuracy']
+            logger.info(
+                f"  threshold {threshold}: {grouping['wall_seconds']:.3f}s, "
+                f"precision {accuracy['precision']:.3f}, recall {accuracy['recall']:.3f}"
+            )
+            results.append({
+                'hash_method': hash_method,
+                'hash_size': hash_size,
+                'hashing': hashing,
+                'grouping': grouping,
+            })
+
+    return {
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            'workers': workers,
+            'decode_mode': decode_mode,
+            'read_ahead_threads': read_ahead_threads,
+            'read_latency_ms': read_latency_ms,
+        },
+        'corpus': {
+            'directory': corpus_dir,
+            'seed': seed,
+            'originals': manifest['num_images'],
+            'files': len(manifest['files']),
+            'variants': manifest['variants'],
+            'setup_seconds': corpus_seconds,
+        },
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks hashing and grouping on a synthetic corpus of near-duplicate images."
+    )
+
+    parser.add_argument(
+        "--scale",
+        type=str,
+        default='1k',
+        choices=list(CORPUS_SCALES),
+        help="Number of original images in the corpus; each gets 0-3 variants. (default: '1k')"
+    )
+
+    parser.add_argument(
+        "--corpus_dir",
+        type=str,
+        default=None,
+        help="Where the corpus is generated, or reused from if it already exists. (default: benchmark_corpus_<scale>)"
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed of the corpus generator. (default: 0)"
+    )
+
+    parser.add_argument(
+        "--hash_methods",
+        type=str,
+        default='dhash,phash,ahash',
+        help="Comma-separated hash methods to benchmark. (default: 'dhash,phash,ahash')"
+    )
+
+    parser.add_argument(
+        "--hash_size",
+        type=int,
+        default=8,
+        help="The hash size. (default: 8)"
+    )
+
+    parser.add_argument(
+        "--thresholds",
+        type=str,
+        default='4,6,8,10',
+        help="Comma-separated Hamming distance thresholds. (default: '4,6,8,10')"
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used for hashing. Use 0 for one per CPU core. (default: 1)"
+    )
+
+    parser.add_argument(
+        "--decode",
+        type=str,
+        default='full',
+        choices=['full', 'fast'],
+        help="How images are decoded before hashing. (default: 'full')"
+    )
+
+    parser.add_argument(
+        "--read_ahead_threads",
+        type=int,
+        default=0,
+        help="Number of I/O threads reading files ahead of decoding. Use 0 to disable. (default: 0)"
+    )
+
+    parser.add_argument(
+        "--read_latency_ms",
+        type=float,
+        default=0,
+        help="Simulated latency of every file read, in milliseconds, as on a network mount. (default: 0)"
+    )
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default='benchmark_results.json',
+        help="Path of the JSON report. (default: 'benchmark_results.json')"
+    )
+
+    args = parser.parse_args()
+
+    loggerSetup()
+
+    hash_methods = [method.strip() for method in args.hash_methods.split(',') if method.strip()]
+    for method in hash_methods:
+        if method not in HASH_METHODS:
+            parser.error(f"Unsupported hash method: {method}")
+    thresholds = [int(value) for value in args.thresholds.split(',')]
+
+    report = run_benchmarks(
+        args.corpus_dir or f"benchmark_corpus_{args.scale}",
+        CORPUS_SCALES[args.scale],
+        args.seed,
+        hash_methods,
+        args.hash_size,
+        thresholds,
+        args.workers,
+        args.decode,
+        args.read_ahead_threads,
+        args.read_latency_ms,
+    )
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
@@ -0,0 +1,264 @@
+import os
+import json
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cli_backup.archives import is_archive_member
+
+logger = logging.getLogger(__name__)
+
+# What can be done with the duplicates of a group.
+ACTIONS = ('delete', 'hardlink', 'symlink', 'quarantine')
+
+# Groups queued per I/O thread, to bound memory on very large plans.
+GROUPS_PER_THREAD = 4
+
+_JOURNAL_VERSION = 1
+
+
+class ActionJournal:
+    """
+    An append-only record of completed actions, one JSON line per file.
+
+    The first line describes the run (action and quarantine directory). Each
+    following line is [duplicate, kept, quarantined_path], where
+    quarantined_path is where the original duplicate was moved, or null if it
+    was not quarantined. All paths are absolute, so the journal can be undone
+    from any working directory. Reopening an existing journal for the same action
+    resumes the run: files already recorded are skipped.
+    """
+
+    def __init__(self, journal_path, action, quarantine_dir):
+        self.journal_path = journal_path
+        self.done = set()
+        self._lock = threading.Lock()
+
+        header = {'version': _JOURNAL_VERSION, 'action': action, 'quarantine_dir': quarantine_dir}
+        if os.path.exists(journal_path):
+            existing, entries = read_journal(journal_path)
+            if (existing['action'], existing['quarantine_dir']) != (action, quarantine_dir):
+                raise ValueError(
+                    f"Journal {journal_path} belongs to a '{existing['action']}' run; use another journal file."
+                )
+            self.done.update(os.path.abspath(duplicate) for duplicate, _, _ in entries)
+            logger.info(f"Resuming from {journal_path}: {len(self.done)} files were already done.")
+            self._file = open(journal_path, 'a', encoding='utf-8')
+        else:
+            self._file = open(journal_path, 'w', encoding='utf-8')
+            self._write(header)
+
+    def record(self, duplicate, kept, quarantined_path):
+        duplicate = os.path.abspath(duplicate)
+        kept = os.path.abspath(kept)
+        if quarantined_path is not None:
+            quarantined_path = os.path.abspath(quarantined_path)
+        with self._lock:
+            self._write([duplicate, kept, quarantined_path])
+
+    def close(self):
+        self._file.close()
+
+    def _write(self, item):
+        # One flushed line per entry, so a crash loses at most the entry
+        # being written.
+        self._file.write(json.dumps(item, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+
+def read_journal(journal_path):
+    """
+    Reads a journal written by ActionJournal. A truncated last line, left by
+    an interrupted run, is ignored.
+
+    Returns:
+        tuple: (header dictionary, list of [duplicate, kept, quarantined_path]).
+    """
+    entries = []
+    with open(journal_path, encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Ignoring a truncated entry at the end of {journal_path}")
+    return header, entries
+
+
+def quarantine_path(file_path, target_directory, quarantine_dir):
+    """
+    Where a file is moved in the quarantine directory. The layout below the
+    scanned directory is preserved, so names cannot collide.
+    """
+    relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(target_directory))
+    if relative.startswith(os.pardir):
+        # Not below the scanned directory; keep the whole path instead.
+        relative = os.path.splitdrive(os.path.abspath(file_path))[1].lstrip(os.sep)
+    return os.path.join(quarantine_dir, relative)
+
+
+def _replace_with_link(duplicate, kept, action):
+    # The link is created under a temporary name and renamed over the
+    # duplicate, so the duplicate is never missing.
+    temp_path = f"{duplicate}.dupelink.tmp"
+    if action == 'hardlink':
+        os.link(kept, temp_path)
+    else:
+        os.symlink(os.path.abspath(kept), temp_path)
+    try:
+        os.replace(temp_path, duplicate)
+    except OSError:
+        os.remove(temp_path)
+        raise
+
+
+def _apply_to_group(kept, duplicates, action, target_directory, quarantine_dir, journal):
+    """
+    Applies the action to the duplicates of one group.
+
+    Returns:
+        tuple: (number of files done, list of (file_path, error message)).
+    """
+    # Files inside archives are reported, but never changed.
+    duplicates = [duplicate for duplicate in duplicates if not is_archive_member(duplicate)]
+    real_kept = None
+    if is_archive_member(kept):
+        if action in ('hardlink', 'symlink'):
+            return 0, [(duplicate, f"the kept file {kept} is inside an archive") for duplicate in duplicates]
+    else:
+        if os.path.islink(kept):
+            # A link is never kept, since the file it points to may be one of
+            # the duplicates. Its target is kept if it is in the group, else
+            # the first file that is not a link.
+            files = [duplicate for duplicate in duplicates if not os.path.islink(duplicate)]
+            if not files:
+                return 0, [(duplicate, f"the kept file {kept} is a link") for duplicate in duplicates]
+            real_path = os.path.realpath(kept)
+            new_kept = next((f for f in files if os.path.realpath(f) == real_path), files[0])
+            duplicates = [kept] + [duplicate for duplicate in duplicates if duplicate != new_kept]
+            kept = new_kept
+        if not os.path.exists(kept):
+            return 0, [(duplicate, f"the kept file {kept} no longer exists") for duplicate in duplicates]
+        real_kept = os.path.realpath(kept)
+
+    done = 0
+    errors = []
+    for duplicate in duplicates:
+        if journal is not None and os.path.abspath(duplicate) in journal.done:
+            continue
+        if real_kept is not None and os.path.realpath(duplicate) == real_kept:
+            # A link to the kept file (or the kept file under another path),
+            # which would take the only copy with it.
+            continue
+        try:
+            moved_to = None
+            if quarantine_dir is not None:
+                moved_to = quarantine_path(duplicate, target_directory, quarantine_dir)
+                if not os.path.lexists(duplicate) and os.path.lexists(moved_to):
+                    # Moved by an interrupted run that did not record it.
+                    pass
+                else:
+                    os.makedirs(os.path.dirname(moved_to), exist_ok=True)
+                    os.rename(duplicate, moved_to)
+
+            if action == 'delete':
+                os.remove(duplicate)
+            elif action in ('hardlink', 'symlink'):
+                _replace_with_link(duplicate, kept, action)
+        except FileNotFoundError:
+            if action != 'delete' or moved_to is not None:
+                errors.append((duplicate, "the file no longer exists"))
+                continue
+            # Already deleted, e.g. by an interrupted run.
+        except OSError as e:
+            errors.append((duplicate, str(e)))
+            continue
+
+        if journal is not None:
+            journal.record(duplicate, kept, moved_to)
+        done += 1
+    return done, errors
+
+
+def apply_plan(var, plan):
+    """
+    Applies var.action to every duplicate in a plan, using a bounded pool of
+    I/O threads so that slow (e.g. network) storage is kept busy.
+
+    Args:
+        var (Variables): The variables object with the action settings
+                         (action, quarantine_dir, journal_path, io_workers).
+        plan (list): (kept, duplicates) tuples.
+
+    Returns:
+        int: The number of files the action was applied to.
+    """
+    action = var.action
+    quarantine_dir = os.path.abspath(var.quarantine_dir) if var.quarantine_dir else None
+    if action == 'quarantine' and quarantine_dir is None:
+        raise ValueError("The quarantine action needs a quarantine directory.")
+    if action == 'delete' and quarantine_dir is not None:
+        logger.warning("Files are deleted, so the quarantine directory is not used.")
+        quarantine_dir = None
+
+    journal = ActionJournal(var.journal_path, action, quarantine_dir) if var.journal_path else None
+    workers = max(1, var.io_workers)
+
+    done = 0
+    failed = 0
+
+    def collect(future):
+        nonlocal done, failed
+        group_done, errors = future.result()
+        done += group_done
+        for file_path, error in errors:
+            failed += 1
+            logger.error(f"Could not {action} {file_path}: {error}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            for kept, duplicates in plan:
+                in_flight.append(executor.submit(
+                    _apply_to_group, kept, duplicates, action, var.target_directory, quarantine_dir, journal
+                ))
+                if len(in_flight) >= workers * GROUPS_PER_THREAD:
+                    collect(in_flight.popleft())
+            while in_flight:
+                collect(in_flight.popleft())
+    finally:
+        if journal is not None:
+            journal.close()
+
+    var.metrics.count('actions_completed_total', done)
+    var.metrics.count('actions_failed_total', failed)
+    return done
+
+
+def undo_journal(journal_path):
+    """
+    Reverts the actions recorded in a journal, newest first. Files that were
+    quarantined are moved back (replacing the link, for link actions). Files
+    that were deleted without a quarantine directory cannot be restored.
+
+    Returns:
+        int: The number of files restored.
+    """
+    header, entries = read_journal(journal_path)
+    restored = 0
+    for duplicate, kept, moved_to in reversed(entries):
+        if moved_to is None:
+            logger.warning(f"Cannot restore {duplicate}: it was not quarantined.")
+            continue
+        try:
+            if header['action'] in ('hardlink', 'symlink') and os.path.lexists(duplicate):
+                os.remove(duplicate)
+            os.makedirs(os.path.dirname(duplicate), exist_ok=True)
+            os.rename(moved_to, duplicate)
+            restored += 1
+        except OSError as e:
+            logger.error(f"Could not restore {duplicate}: {e}")
+
+    logger.info(f"Restored {restored} of {len(entries)} files from {journal_path}.")
+    return restored
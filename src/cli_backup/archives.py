@@ -0,0 +1,205 @@
+"""
+Images inside zip and tar archives, scanned without extracting them.
+
+A member of an archive is addressed as `archive.zip!/path/in/archive.jpg`.
+Members are read into memory while their archive is listed, and decoded from
+there, so nothing is written to disk.
+
+The FileEntry of a member holds its uncompressed size and, in place of a
+modification time, a stamp that changes when its content does: the CRC-32 of
+zip members, which the archive records for every member, and the
+modification time of the archive itself for tar members, which carry no
+checksum. Members are cached and compared by it like files by their
+modification time.
+
+zipfile and tarfile are imported on first use, as this module is imported by
+the command line at start-up.
+"""
+
+import os
+import logging
+
+from cli_backup.scanner import IMAGE_EXTENSIONS, FileEntry
+
+logger = logging.getLogger(__name__)
+
+# Extensions of the archives that are scanned; compressed tar archives are
+# decompressed on the fly.
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Separates the path of an archive from the name of a member.
+MEMBER_SEPARATOR = '!/'
+
+
+def is_archive(file_path):
+    return file_path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def member_path(archive_path, member_name):
+    """
+    Returns:
+        str: The path addressing a member of an archive.
+    """
+    return f"{archive_path}{MEMBER_SEPARATOR}{member_name}"
+
+
+def split_member_path(file_path):
+    """
+    Returns:
+        tuple: (archive path, member name) if file_path addresses a member of
+               an archive, else None.
+    """
+    start = file_path.find(MEMBER_SEPARATOR)
+    while start != -1:
+        if is_archive(file_path[:start]):
+            return file_path[:start], file_path[start + len(MEMBER_SEPARATOR):]
+        start = file_path.find(MEMBER_SEPARATOR, start + 1)
+    return None
+
+
+def is_archive_member(file_path):
+    return split_member_path(file_path) is not None
+
+
+def iter_archive_members(archive_path, archive_mtime_ns, extensions=IMAGE_EXTENSIONS):
+    """
+    Lists the images in an archive, in the order they are stored.
+
+    Tar archives are read as a stream, front to back, so a member can only be
+    read before the next one is listed. An archive that cannot be read, or
+    is truncated, is reported and the members found so far are kept.
+
+    Args:
+        archive_path (str): The zip or tar archive.
+        archive_mtime_ns (int): Its modification time, the stamp of tar
+                                members.
+        extensions (tuple): Lower-case extensions of the members to list.
+
+    Yields:
+        tuple: (FileEntry, read), where read() returns the content of the
+               member and must be called before the next member is listed.
+    """
+    import tarfile
+    import zipfile
+
+    try:
+        if archive_path.lower().endswith('.zip'):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(extensions):
+                        continue
+                    entry = FileEntry(member_path(archive_path, info.filename), info.file_size, info.CRC)
+                    yield entry, lambda info=info: archive.read(info)
+        else:
+            with tarfile.open(archive_path, 'r|*') as archive:
+                for member in archive:
+                    if not member.isfile() or not member.name.lower().endswith(extensions):
+                        continue
+                    entry = FileEntry(member_path(archive_path, member.name), member.size, archive_mtime_ns)
+                    yield entry, lambda member=member: archive.extractfile(member).read()
+    except Exception as e:
+        logger.error(f"Could not read archive {archive_path}: {e}")
+
+
+def load_members(file_paths):
+    """
+    Reads given archive members, opening every archive once.
+
+    Args:
+        file_paths (iterable): Paths of archive members.
+
+    Returns:
+        dict: (FileEntry, content) of every member that could be read, keyed
+              by path.
+    """
+    by_archive = {}
+    for file_path in file_paths:
+        archive_path, _ = split_member_path(file_path)
+        by_archive.setdefault(archive_path, set()).add(file_path)
+
+    members = {}
+    for archive_path, wanted in by_archive.items():
+        try:
+            archive_mtime_ns = os.stat(archive_path).st_mtime_ns
+        except OSError as e:
+            logger.error(f"Could not read archive {archive_path}: {e}")
+            continue
+        for entry, read in iter_archive_members(archive_path, archive_mtime_ns):
+            if entry.path not in wanted:
+                continue
+            try:
+                members[entry.path] = (entry, read())
+            except Exception as e:
+                logger.error(f"Could not process file {entry.path}: {e}")
+            wanted.discard(entry.path)
+            if not wanted:
+                break
+        for file_path in wanted:
+            logger.error(f"Could not process file {file_path}: it is not in the archive")
+    return members
+
+
+def file_size(file_path):
+    """
+    Returns:
+        int: The size of a file, or the uncompressed size of an archive
+             member.
+
+    Raises:
+        OSError: If the file or member does not exist.
+    """
+    parts = split_member_path(file_path)
+    if parts is None:
+        return os.path.getsize(file_path)
+    archive_path, member_name = parts
+
+    import tarfile
+    import zipfile
+
+    try:
+        if archive_path.lower().endswith('.zip'):
+            with zipfile.ZipFile(archive_path) as archive:
+                return archive.getinfo(member_name).file_size
+        with tarfile.open(archive_path) as archive:
+            return archive.getmember(member_name).size
+    except (KeyError, zipfile.BadZipFile, tarfile.TarError) as e:
+        raise OSError(f"Could not read {file_path}: {e}")
+
+
+class MemberContents:
+    """
+    The content stage of a scan that includes archive members, used in place
+    of a ReadAhead (see hash_file_entries).
+
+    The content of a member is added as soon as it is read from its archive
+    and handed on from memory. Other files go through the given ReadAhead,
+    or are left for the decoder to read if there is none.
+    """
+
+    def __init__(self, read_ahead=None):
+        self.read_ahead = read_ahead
+        self._contents = {}
+        if read_ahead is not None:
+            read_file = read_ahead.read_file
+
+            def read_file_or_member(file_path):
+                if file_path in self._contents:
+                    return self._contents.pop(file_path)
+                return read_file(file_path)
+
+            read_ahead.read_file = read_file_or_member
+
+    def add(self, file_path, data):
+        self._contents[file_path] = data
+
+    def iter_contents(self, entries, metrics=None):
+        """
+        Yields:
+            tuple: (entry, data) for every entry, in order. data is None for
+                   files the decoder reads itself.
+        """
+        if self.read_ahead is not None:
+            yield from self.read_ahead.iter_contents(entries, metrics)
+            return
+        for entry in entries:
+            yield entry, self._contents.pop(entry.path, None)
@@ -0,0 +1,129 @@
+"""
+Pluggable implementations of the perceptual hashes.
+
+Importing this module is cheap: each backend imports what it needs (Pillow,
+NumPy, imagehash and through it SciPy or PyWavelets) the first time one of
+its hashes is computed. Every backend must produce exactly the hashes
+imagehash does for the same method and size, so backends can be swapped
+freely, e.g. without invalidating the hash cache.
+"""
+
+# The perceptual hashes supported by the tool.
+HASH_METHODS = ('phash', 'ahash', 'dhash', 'whash')
+
+# Hash methods that can be used to verify candidate groups.
+VERIFY_METHODS = ('phash', 'whash')
+
+# Backends tried, in order, for the 'auto' backend.
+AUTO_BACKEND_ORDER = ('numpy', 'imagehash')
+
+
+def lanczos_filter():
+    """
+    Returns the resampling filter imagehash shrinks images with.
+    """
+    from PIL import Image
+    try:
+        return Image.Resampling.LANCZOS
+    except AttributeError:  # Pillow < 9.1
+        return Image.LANCZOS
+
+
+def bits_to_hex(bits):
+    """
+    Formats a boolean array as a hexadecimal string, the way imagehash does.
+    """
+    import numpy as np
+
+    flat = bits.ravel()
+    # packbits pads the last byte with zero bits, which are shifted out.
+    value = int.from_bytes(np.packbits(flat).tobytes(), 'big') >> (-len(flat) % 8)
+    return format(value, f"0{-(-len(flat) // 4)}x")
+
+
+def check_hash_size(hash_size):
+    if hash_size < 2:
+        raise ValueError('Hash size must be greater than or equal to 2')
+
+
+def numpy_average_hash(img, hash_size):
+    """
+    The average hash, on Pillow and NumPy only.
+    """
+    import numpy as np
+
+    check_hash_size(hash_size)
+    pixels = np.asarray(img.convert('L').resize((hash_size, hash_size), lanczos_filter()))
+    return bits_to_hex(pixels > np.mean(pixels))
+
+
+def numpy_dhash(img, hash_size):
+    """
+    The horizontal difference hash, on Pillow and NumPy only.
+    """
+    import numpy as np
+
+    check_hash_size(hash_size)
+    pixels = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), lanczos_filter()))
+    return bits_to_hex(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _imagehash(function_name):
+    def compute(img, hash_size):
+        import imagehash
+        return str(getattr(imagehash, function_name)(img, hash_size=hash_size))
+    compute.__name__ = f"imagehash_{function_name}"
+    return compute
+
+
+# Every backend maps hash methods to functions taking (image, hash_size) and
+# returning the hexadecimal hash.
+HASH_BACKENDS = {
+    'numpy': {
+        'ahash': numpy_average_hash,
+        'dhash': numpy_dhash,
+    },
+    'imagehash': {
+        'phash': _imagehash('phash'),
+        'ahash': _imagehash('average_hash'),
+        'dhash': _imagehash('dhash'),
+        'whash': _imagehash('whash'),
+    },
+}
+
+
+def register_backend(name, functions):
+    """
+    Adds (or replaces) a hash backend.
+
+    Args:
+        name (str): The backend name, as used by --hash_backend.
+        functions (dict): Functions taking (image, hash_size) and returning
+                          the hexadecimal hash, keyed by hash method.
+    """
+    HASH_BACKENDS[name] = dict(functions)
+
+
+def get_hash_function(hash_method, backend='auto'):
+    """
+    Looks up the function computing a hash method.
+
+    Args:
+        hash_method (str): The hashing algorithm.
+        backend (str): A backend name, or 'auto' for the first backend in
+                       AUTO_BACKEND_ORDER that supports the method.
+
+    Returns:
+        callable: A function taking (image, hash_size).
+
+    Raises:
+        ValueError: If no such backend supports the method.
+    """
+    names = AUTO_BACKEND_ORDER if backend == 'auto' else (backend,)
+    for name in names:
+        function = HASH_BACKENDS.get(name, {}).get(hash_method)
+        if function is not None:
+            return function
+    if backend == 'auto':
+        raise ValueError(f"Unsupported hash method: {hash_method}")
+    raise ValueError(f"Unsupported hash method for the {backend} backend: {hash_method}")
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of pending writes to collect before they are flushed to disk.
+_COMMIT_EVERY = 1000
+
+
+class HashCache:
+    """
+    A persistent SQLite cache of perceptual hashes.
+
+    Entries are keyed on the file path together with the hash method and hash
+    size, and are only considered valid while the file size and modification
+    time still match the values recorded when the hash was computed.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        cache_dir = os.path.dirname(os.path.abspath(cache_path))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT NOT NULL,
+                hash_method TEXT NOT NULL,
+                hash_size INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (path, hash_method, hash_size)
+            )
+            """
+        )
+        # Paths seen during the current scan, used to evict deleted files.
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)")
+        self.conn.commit()
+
+        self._pending = []
+        self._seen = []
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, path, size, mtime_ns, hash_method, hash_size):
+        """
+        Returns the cached hash for a file, or None if the file is not cached
+        or has changed since it was hashed.
+        """
+        path = os.path.abspath(path)
+        self._mark_seen(path)
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, hash FROM hashes WHERE path = ? AND hash_method = ? AND hash_size = ?",
+            (path, hash_method, hash_size),
+        ).fetchone()
+
+        if row is not None and row[0] == size and row[1] == mtime_ns:
+            self.hits += 1
+            return row[2]
+
+        self.misses += 1
+        return None
+
+    def store(self, path, size, mtime_ns, hash_method, hash_size, image_hash):
+        """
+        Records a freshly computed hash. Writes are batched and flushed
+        periodically, or when the cache is closed.
+        """
+        path = os.path.abspath(path)
+        self._pending.append((path, hash_method, hash_size, size, mtime_ns, image_hash))
+        if len(self._pending) >= _COMMIT_EVERY:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all pending entries to disk.
+        """
+        if self._pending:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hashes (path, hash_method, hash_size, size, mtime_ns, hash) VALUES (?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+            self._pending = []
+        if self._seen:
+            self.conn.executemany("INSERT OR IGNORE INTO seen (path) VALUES (?)", self._seen)
+            self._seen = []
+        self.conn.commit()
+
+    def evict_missing(self, root_directory):
+        """
+        Removes entries below root_directory for files that were not seen
+        during the current scan, i.e. files that have been deleted or moved.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        self.flush()
+        prefix = os.path.join(os.path.abspath(root_directory), "")
+        cursor = self.conn.execute(
+            "DELETE FROM hashes WHERE substr(path, 1, ?) = ? AND path NOT IN (SELECT path FROM seen)",
+            (len(prefix), prefix),
+        )
+        self.conn.execute("DELETE FROM seen")
+        self.conn.commit()
+        return cursor.rowcount
+
+    def invalidate(self):
+        """
+        Drops every cached entry.
+        """
+        self._pending = []
+        self.conn.execute("DELETE FROM hashes")
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def _mark_seen(self, path):
+        self._seen.append((path,))
+        if len(self._seen) >= _COMMIT_EVERY:
+            self.flush()
+
+
+def open_hash_cache(var, invalidate=True):
+    """
+    Opens the hash cache configured on the variables object.
+
+    Args:
+        var (Variables): The variables object with the cache settings.
+        invalidate (bool): Whether var.invalidate_cache is honored. Pass False
+                           when the cache is reopened later in the same run.
+
+    Returns:
+        HashCache or None: The opened cache, or None if caching is disabled.
+    """
+    cache_path = var.cache_path
+    if not cache_path:
+        return None
+
+    try:
+        cache = HashCache(cache_path)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Could not open hash cache '{cache_path}', continuing without it: {e}")
+        return None
+
+    if invalidate and var.invalidate_cache:
+        logger.info(f"Invalidating hash cache: {cache_path}")
+        cache.invalidate()
+
+    return cache
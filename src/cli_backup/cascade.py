@@ -0,0 +1,167 @@
+import os
+import logging
+
+from cli_backup.archives import MemberContents, is_archive_member, load_members
+from cli_backup.backends import VERIFY_METHODS
+from cli_backup.cache import open_hash_cache
+from cli_backup.functions import hash_file_entries
+from cli_backup.limits import limits_for
+from cli_backup.prefetch import read_ahead_for
+from cli_backup.scanner import FileEntry
+from cli_backup.search_index import UnionFind, find_similar_pairs, hamming_distance, hex_to_int
+
+logger = logging.getLogger(__name__)
+
+
+def default_verify_threshold(threshold, hash_size, verify_size):
+    """
+    Scales the candidate threshold to the size of the verification hash, so
+    that the same fraction of differing bits is accepted.
+    """
+    return int(round(threshold * (verify_size / float(hash_size)) ** 2))
+
+
+def compute_verification_hashes(var, file_entries, hash_method, hash_size, member_data=None):
+    """
+    Computes (or loads from the hash cache) the verification hash of every
+    given file.
+
+    Args:
+        var (Variables): The variables object with the decode, worker and
+                         cache settings.
+        file_entries (list): FileEntry objects of the files to hash.
+        hash_method (str): The verification hashing algorithm.
+        hash_size (int): The size of the verification hash.
+        member_data (dict): The content of every archive member among the
+                            files, keyed by path.
+
+    Returns:
+        dict: The hexadecimal hash of every file that could be hashed, keyed
+              by path. With var.orientation_invariant, the tuple of hashes of
+              its dihedral variants instead.
+    """
+    dihedral = var.orientation_invariant
+    cache_method = hash_method if var.decode_mode == 'full' else f"{hash_method}:{var.decode_mode}"
+    if dihedral:
+        cache_method += ':dihedral'
+    # The candidate scan already invalidated the cache if that was requested.
+    cache = open_hash_cache(var, invalidate=False)
+
+    read_ahead = read_ahead_for(var)
+    if member_data:
+        read_ahead = MemberContents(read_ahead)
+        for file_path, data in member_data.items():
+            read_ahead.add(file_path, data)
+
+    verified = {}
+    to_hash = []
+    try:
+        for entry in file_entries:
+            if cache is not None:
+                image_hash = cache.lookup(entry.path, entry.size, entry.mtime_ns, cache_method, hash_size)
+                if image_hash is not None:
+                    verified[entry.path] = tuple(image_hash.split(',')) if dihedral else image_hash
+                    continue
+            to_hash.append(entry)
+
+        for entry, image_hash, error in hash_file_entries(
+            to_hash, hash_size, hash_method, var.decode_mode, var.workers, var.metrics, read_ahead,
+            var.hash_backend, dihedral, limits_for(var)
+        ):
+            if error is not None:
+                logger.error(f"Could not process file {entry.path}: {error}")
+                continue
+            verified[entry.path] = image_hash
+            if cache is not None:
+                cached = ','.join(image_hash) if dihedral else image_hash
+                cache.store(entry.path, entry.size, entry.mtime_ns, cache_method, hash_size, cached)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    return verified
+
+
+def verify_groups(var, candidate_groups):
+    """
+    Second stage of the hash cascade: confirms candidate groups found with the
+    cheap hash using a stronger one.
+
+    The verification hash is only computed for files that are part of a
+    candidate group, which is usually a small fraction of the scan. Within
+    each candidate group, files are regrouped by the Hamming distance of their
+    verification hashes, so a group can shrink, split or disappear entirely.
+
+    Args:
+        var (Variables): The variables object with the cascade settings
+                         (verify_method, verify_size, verify_threshold).
+        candidate_groups (DuplicateGroups): The groups found by the first stage.
+
+    Returns:
+        DuplicateGroups: The confirmed groups.
+    """
+    store = candidate_groups.store
+    verify_threshold = var.verify_threshold
+    if verify_threshold is None:
+        verify_threshold = default_verify_threshold(var.threshold, var.hash_size, var.verify_size)
+
+    file_entries = []
+    member_paths = []
+    for file_id in candidate_groups.members.tolist():
+        file_path = store.paths[file_id]
+        if is_archive_member(file_path):
+            member_paths.append(file_path)
+            continue
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            logger.error(f"Could not process file {file_path}: {e}")
+            continue
+        file_entries.append(FileEntry(file_path, stat.st_size, stat.st_mtime_ns))
+    # Archive members are read up front, each archive once.
+    members = load_members(member_paths)
+    file_entries.extend(entry for entry, _ in members.values())
+
+    logger.info(
+        f"Verifying {len(candidate_groups)} candidate groups ({len(file_entries)} files) with "
+        f"{var.verify_method} (hash size {var.verify_size}, threshold {verify_threshold})..."
+    )
+    member_data = {file_path: data for file_path, (_, data) in members.items()}
+    verified = compute_verification_hashes(var, file_entries, var.verify_method, var.verify_size, member_data)
+
+    confirmed = []
+    for group_index in range(len(candidate_groups)):
+        by_hash = {}
+        variants = {}
+        for file_id in candidate_groups.file_ids(group_index).tolist():
+            image_hash = verified.get(store.paths[file_id])
+            if image_hash is None:
+                continue
+            if var.orientation_invariant:
+                variants.setdefault(image_hash[0], image_hash[1:])
+                image_hash = image_hash[0]
+            by_hash.setdefault(image_hash, []).append(file_id)
+
+        # Candidate groups are small, so the verification hashes of each one
+        # are matched on their own.
+        hashes = sorted(by_hash)
+        groups = UnionFind(len(hashes))
+        for i, j, _ in find_similar_pairs(hashes, verify_threshold, var.metrics):
+            groups.union(i, j)
+        if variants:
+            # Rotated and mirrored copies match through a variant.
+            values = [hex_to_int(image_hash) for image_hash in hashes]
+            for i, image_hash in enumerate(hashes):
+                for variant in map(hex_to_int, variants[image_hash]):
+                    for j, value in enumerate(values):
+                        if i != j and hamming_distance(variant, value) <= verify_threshold:
+                            groups.union(i, j)
+        for component in groups.components():
+            confirmed.append([file_id for i in component for file_id in by_hash[hashes[i]]])
+
+    duplicate_groups = store.group_files(confirmed)
+    logger.info(
+        f"Cascade: {len(duplicate_groups)} of {len(candidate_groups)} candidate groups confirmed "
+        f"({duplicate_groups.total_duplicates()} of {candidate_groups.total_duplicates()} duplicates)."
+    )
+    return duplicate_groups
@@ -0,0 +1,153 @@
+import os
+import json
+import random
+import shutil
+import logging
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+logger = logging.getLogger(__name__)
+
+# Named corpus sizes: the number of original images generated.
+CORPUS_SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+# Transformations applied to originals to create near-duplicates.
+VARIANT_KINDS = ('resize', 'recompress', 'crop', 'brightness', 'copy')
+
+# Files per subdirectory, so that very large corpora stay browsable.
+FILES_PER_DIRECTORY = 1000
+
+MANIFEST_NAME = 'ground_truth.json'
+
+_IMAGE_SIZE = (256, 192)
+
+
+def generate_image(rng):
+    """
+    Draws a random image of overlapping shapes. Images from different seeds
+    are visually unrelated.
+
+    Args:
+        rng (random.Random): The random generator to draw from.
+
+    Returns:
+        PIL.Image.Image: The generated image.
+    """
+    width, height = _IMAGE_SIZE
+    background = tuple(rng.randrange(256) for _ in range(3))
+    img = Image.new('RGB', _IMAGE_SIZE, background)
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(6, 14)):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randint(10, width // 2), y0 + rng.randint(10, height // 2)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle([x0, y0, x1, y1], fill=color)
+        else:
+            draw.ellipse([x0, y0, x1, y1], fill=color)
+    return img
+
+
+def make_variant(img, kind, rng):
+    """
+    Applies one near-duplicate transformation to an image.
+
+    Args:
+        img (PIL.Image.Image): The original image.
+        kind (str): One of VARIANT_KINDS. 'copy' is handled by the caller,
+                    since it copies the original file byte for byte.
+        rng (random.Random): The random generator to draw from.
+
+    Returns:
+        PIL.Image.Image: The transformed image.
+    """
+    width, height = img.size
+    if kind == 'resize':
+        scale = rng.choice((0.5, 0.75, 1.5))
+        return img.resize((int(width * scale), int(height * scale)), Image.LANCZOS)
+    if kind == 'recompress':
+        buffer = BytesIO()
+        img.save(buffer, 'JPEG', quality=rng.randint(20, 50))
+        buffer.seek(0)
+        return Image.open(buffer).convert('RGB')
+    if kind == 'crop':
+        dx, dy = int(width * rng.uniform(0.02, 0.08)), int(height * rng.uniform(0.02, 0.08))
+        return img.crop((dx, dy, width - dx, height - dy))
+    if kind == 'brightness':
+        return ImageEnhance.Brightness(img).enhance(rng.choice((0.7, 0.85, 1.15, 1.3)))
+    raise ValueError(f"Unsupported variant kind: {kind}")
+
+
+def generate_corpus(output_dir, num_images, seed=0, variants_per_image=(0, 3)):
+    """
+    Writes a reproducible corpus of original images and near-duplicate
+    variants, together with a ground-truth manifest.
+
+    Every original gets a random number of variants, each made with a random
+    kind from VARIANT_KINDS. The same seed always produces the same corpus.
+
+    Args:
+        output_dir (str): The directory to write to. It is created if needed.
+        num_images (int): The number of original images.
+        seed (int): The random seed.
+        variants_per_image (tuple): Inclusive (min, max) number of variants
+                                    per original.
+
+    Returns:
+        dict: The manifest, also saved as ground_truth.json in output_dir. Its
+              'files' entry maps each relative path to the index of its
+              original.
+    """
+    rng = random.Random(seed)
+    files = {}
+    kinds = dict.fromkeys(VARIANT_KINDS, 0)
+
+    for source in range(num_images):
+        subdirectory = f"{source // FILES_PER_DIRECTORY:04d}"
+        os.makedirs(os.path.join(output_dir, subdirectory), exist_ok=True)
+
+        img = generate_image(random.Random(rng.getrandbits(64)))
+        original = f"{subdirectory}/img{source:07d}.jpg"
+        img.save(os.path.join(output_dir, original), 'JPEG', quality=90)
+        files[original] = source
+
+        for number in range(rng.randint(*variants_per_image)):
+            kind = rng.choice(VARIANT_KINDS)
+            kinds[kind] += 1
+            if kind == 'copy':
+                variant = f"{subdirectory}/img{source:07d}_v{number}_{kind}.jpg"
+                shutil.copyfile(os.path.join(output_dir, original), os.path.join(output_dir, variant))
+            else:
+                variant = f"{subdirectory}/img{source:07d}_v{number}_{kind}.png"
+                make_variant(img, kind, rng).save(os.path.join(output_dir, variant))
+            files[variant] = source
+
+        if (source + 1) % 10000 == 0:
+            logger.info(f"Generated {source + 1} of {num_images} originals...")
+
+    manifest = {'seed': seed, 'num_images': num_images, 'variants': kinds, 'files': files}
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def load_corpus(corpus_dir, num_images, seed=0):
+    """
+    Loads the manifest of an existing corpus, or generates the corpus if it
+    does not exist yet.
+
+    Returns:
+        dict: The corpus manifest.
+    """
+    manifest_path = os.path.join(corpus_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['seed'] == seed and manifest['num_images'] == num_images:
+            logger.info(f"Reusing the corpus in {corpus_dir}")
+            return manifest
+        raise ValueError(f"{corpus_dir} holds a corpus generated with other parameters")
+
+    logger.info(f"Generating a corpus of {num_images} originals in {corpus_dir}...")
+    return generate_corpus(corpus_dir, num_images, seed)
@@ -1,182 +1,713 @@
+import io
 import os
-import imagehash
 import sys
 import re
 import logging
-from collections import defaultdict
-from PIL import Image
+import itertools
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from cli_backup.actions import apply_plan
+from cli_backup.archives import ARCHIVE_EXTENSIONS, MemberContents, file_size, is_archive, is_archive_member, iter_archive_members
+from cli_backup.backends import HASH_METHODS, get_hash_function
+from cli_backup.cache import open_hash_cache
+from cli_backup.limits import NO_LIMITS, DeadlinePool, LimitExceeded, SkipList, check_file_size, check_image_size, decode_deadline, limits_for
+from cli_backup.prefetch import read_ahead_for
+from cli_backup.prefilter import ExactDuplicateFilter
+from cli_backup.scanner import IMAGE_EXTENSIONS, iter_image_files
+from cli_backup.packed import pack_hashes
+from cli_backup.shards import shard_filters
+from cli_backup.search_index import UnionFind, find_similar_pairs, find_variant_pairs, group_paths
+from cli_backup.store import DuplicateGroups
 
 logger = logging.getLogger(__name__)
 
-def get_image_hashes(var, hash_size=8, hash_method='dhash'):
+# Smallest side, in pixels, that the fast decode path shrinks images to. It is
+# kept well above the few pixels imagehash resamples to, so the final hash is
+# still computed from a properly filtered image.
+FAST_DECODE_MIN_SIDE = 128
+
+# Number of files handed to a worker process at a time, and the number of
+# chunks queued per worker. Together they bound how far hashing can lag
+# behind discovery.
+HASH_CHUNK_SIZE = 16
+CHUNKS_PER_WORKER = 2
+
+
+class ScanCancelled(Exception):
+    """
+    Raised by get_image_hashes when the scan was cancelled through
+    var.cancel_event.
+    """
+
+def compute_image_hash(img, hash_method='dhash', hash_size=8, backend='auto'):
+    """
+    Computes the perceptual hash of an already opened image.
+
+    Args:
+        img (PIL.Image.Image): The image to hash.
+        hash_method (str): The hashing algorithm to use ('phash', 'ahash', 'dhash', 'whash').
+        hash_size (int): The size of the hash.
+        backend (str): The hash backend, or 'auto' (see cli_backup.backends).
+
+    Returns:
+        str: The hash as a hexadecimal string.
+    """
+    return get_hash_function(hash_method, backend)(img, hash_size)
+
+
+def load_image(file_path, decode_mode='full', hash_size=8, limits=NO_LIMITS):
+    """
+    Opens and decodes an image for hashing.
+
+    In 'full' mode the image is decoded at full resolution and converted to
+    RGB. In 'fast' mode JPEGs are decoded straight to grayscale at a reduced
+    scale with draft(), other formats are shrunk with reduce(), and the
+    intermediate RGB copy is skipped entirely.
+
+    Only the first frame of animated and multi-page images (GIF, APNG, WebP,
+    TIFF) is decoded.
+
+    Args:
+        file_path (str): The image file to open, or a file object holding
+                         its content.
+        decode_mode (str): 'full' or 'fast'.
+        hash_size (int): The hash size, used to pick the fast decode size.
+        limits (FileLimits): Limits checked before decoding.
+
+    Returns:
+        PIL.Image.Image: The decoded image.
+
+    Raises:
+        LimitExceeded: If the image has more pixels than limits.max_pixels,
+                       or than Pillow's decompression bomb limit.
+    """
+    # Pillow is imported on first use, so that starting up stays fast.
+    from PIL import Image
+
+    try:
+        img = Image.open(file_path)
+    except Image.DecompressionBombError as e:
+        raise LimitExceeded('max_pixels', str(e))
+
+    # Opening reads the header and positions the image on its first frame;
+    # the other frames are never decoded.
+    img.seek(0)
+
+    if decode_mode != 'fast':
+        check_image_size(img, limits)
+        # Convert to a common format (RGB) to handle different image types
+        return img.convert('RGB')
+
+    min_side = max(FAST_DECODE_MIN_SIDE, hash_size * 16)
+
+    # JPEG only: decode the luma channel at 1/2, 1/4 or 1/8 scale. This is a
+    # no-op for other formats.
+    img.draft('L', (min_side, min_side))
+    check_image_size(img, limits)
+
+    if img.mode not in ('L', 'RGB'):
+        img = img.convert('L')
+
+    factor = min(img.size) // min_side
+    if factor > 1:
+        img = img.reduce(factor)
+
+    return img.convert('L')
+
+
+def hash_image_file(file_path, hash_size=8, hash_method='dhash', decode_mode='full', data=None, backend='auto',
+                    dihedral=False, limits=NO_LIMITS):
+    """
+    Opens and hashes a single image file. This is the unit of work executed by
+    the hashing workers, so it never raises; errors are returned instead and
+    logged by the caller.
+
+    If the content of the file was already read (e.g. by the read-ahead
+    stage), it is passed as data and decoded from memory.
+
+    With dihedral, the hashes of the 8 rotations and mirror images of the
+    image are computed from the same decode (see cli_backup.multihash), and
+    image_hash is the tuple of them, the hash of the unchanged image first.
+
+    Decoding and hashing are interrupted after limits.decode_timeout seconds
+    (see decode_deadline), and files over limits.max_bytes or images over
+    limits.max_pixels are not decoded.
+    The error of such files is the LimitExceeded exception itself rather than
+    a message, so the caller can skip them.
+
+    Returns:
+        tuple: (file_path, image_hash, error, decode_seconds), where exactly one
+               of image_hash and error is None.
+    """
+    start = time.perf_counter()
+    try:
+        with decode_deadline(limits.decode_timeout):
+            if limits.max_bytes is not None:
+                check_file_size(os.path.getsize(file_path) if data is None else len(data), limits)
+            source = file_path if data is None else io.BytesIO(data)
+            img = load_image(source, decode_mode, hash_size, limits)
+            decode_seconds = time.perf_counter() - start
+            if dihedral:
+                from cli_backup.multihash import compute_hashes
+                image_hash = compute_hashes(img, [(hash_method, hash_size)], dihedral=True)[(hash_method, hash_size)]
+            else:
+                image_hash = compute_image_hash(img, hash_method, hash_size, backend)
+        return file_path, image_hash, None, decode_seconds
+    except LimitExceeded as e:
+        return file_path, None, e, time.perf_counter() - start
+    except Exception as e:
+        return file_path, None, str(e), time.perf_counter() - start
+
+
+def _resolve_workers(workers):
+    """
+    Turns the requested worker count into a usable number of processes.
+    A value of 0 (or None) means one worker per CPU core.
+    """
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+
+def hash_image_files(file_paths, hash_size=8, hash_method='dhash', decode_mode='full', contents=None, backend='auto',
+                     dihedral=False, limits=NO_LIMITS):
+    """
+    Hashes a chunk of image files in a worker process.
+
+    Args:
+        contents (list): Optional content of every file, or None for files
+                         the worker should read itself.
+
+    Returns:
+        list: (file_path, image_hash, error, decode_seconds) for every input path.
+    """
+    if contents is None:
+        contents = [None] * len(file_paths)
+    return [
+        hash_image_file(file_path, hash_size, hash_method, decode_mode, data, backend, dihedral, limits)
+        for file_path, data in zip(file_paths, contents)
+    ]
+
+
+def _chunked(iterable, size):
+    """
+    Splits an iterable into lists of at most `size` items, lazily.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def hash_file_entries(entries, hash_size, hash_method, decode_mode, workers, metrics=None, read_ahead=None,
+                      backend='auto', dihedral=False, limits=NO_LIMITS, executor=None):
+    """
+    Hashes a stream of files, either in-process or on a pool of worker
+    processes. Files are handed to the workers in chunks as they arrive, and
+    only a few chunks per worker are queued at a time, so hashing starts with
+    the first files found and memory does not grow with the size of the tree.
+
+    If a ReadAhead stage is given, files are read by its I/O threads while
+    earlier files are being decoded, and are decoded from memory.
+
+    If a Metrics object is given, the decode time of every file and the
+    number of decoded bytes and failures are recorded on it.
+
+    With dihedral, every image_hash is the tuple of hashes of the dihedral
+    variants of the image (see hash_image_file). Files that exceed the
+    per-file limits get a LimitExceeded exception as their error.
+
+    With a decode timeout, files are hashed one at a time on a DeadlinePool,
+    even with a single worker, so that a file that overruns it is stopped
+    whatever the decoder is doing.
+
+    A long-running process can pass its own ProcessPoolExecutor (or
+    DeadlinePool, with a decode timeout), which is then used (and left
+    running) instead of starting a pool for every call.
+
+    Yields:
+        tuple: (entry, image_hash, error) for every input entry, in order.
+    """
+    workers = _resolve_workers(workers)
+
+    if read_ahead is not None:
+        contents = read_ahead.iter_contents(entries, metrics)
+    else:
+        contents = ((entry, None) for entry in entries)
+
+    if limits.decode_timeout:
+        yield from _hash_with_deadline(
+            contents, hash_size, hash_method, decode_mode, workers, metrics, backend, dihedral, limits,
+            executor if isinstance(executor, DeadlinePool) else None,
+        )
+        return
+
+    if workers == 1:
+        for entry, data in contents:
+            result = hash_image_file(entry.path, hash_size, hash_method, decode_mode, data, backend, dihedral, limits)
+            yield _record_result(entry, result, metrics)
+        return
+
+    if executor is None:
+        logger.info(f"Hashing with {workers} worker processes...")
+    hash_chunk = partial(
+        hash_image_files, hash_size=hash_size, hash_method=hash_method, decode_mode=decode_mode, backend=backend,
+        dihedral=dihedral, limits=limits,
+    )
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        in_flight = deque()
+        for chunk in _chunked(contents, HASH_CHUNK_SIZE):
+            paths = [entry.path for entry, _ in chunk]
+            data = [data for _, data in chunk] if read_ahead is not None else None
+            in_flight.append(([entry for entry, _ in chunk], executor.submit(hash_chunk, paths, contents=data)))
+            if len(in_flight) >= workers * CHUNKS_PER_WORKER:
+                yield from _chunk_results(*in_flight.popleft(), metrics)
+
+        while in_flight:
+            yield from _chunk_results(*in_flight.popleft(), metrics)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
+def _hash_with_deadline(contents, hash_size, hash_method, decode_mode, workers, metrics, backend, dihedral, limits,
+                        pool=None):
+    # Hashes every file on a DeadlinePool, which kills the worker of a file
+    # that overruns the decode timeout.
+    def failed(args, error, seconds):
+        return args[0], None, error, seconds
+
+    entries = deque()
+
+    def tasks():
+        for entry, data in contents:
+            entries.append(entry)
+            yield entry.path, hash_size, hash_method, decode_mode, data, backend, dihedral, limits
+
+    own_pool = pool is None
+    if own_pool:
+        logger.info(f"Hashing with {workers} worker processes, stopped after {limits.decode_timeout:g} seconds per file...")
+        pool = DeadlinePool(workers)
+    try:
+        for result in pool.map(hash_image_file, tasks(), limits.decode_timeout, failed):
+            yield _record_result(entries.popleft(), result, metrics)
+    finally:
+        if own_pool:
+            pool.shutdown(wait=True)
+
+
+def _chunk_results(chunk, future, metrics):
+    for entry, result in zip(chunk, future.result()):
+        yield _record_result(entry, result, metrics)
+
+
+def _record_result(entry, result, metrics):
+    _, image_hash, error, decode_seconds = result
+    if metrics is not None:
+        metrics.observe('decode_seconds', decode_seconds)
+        if error is None:
+            metrics.count('files_decoded_total')
+            metrics.count('bytes_decoded_total', entry.size)
+        elif not isinstance(error, LimitExceeded):
+            metrics.count('decode_failures_total')
+    return entry, image_hash, error
+
+
+def get_image_hashes(var, hash_size=8, hash_method='dhash', index=None, entries=None, on_directory=None,
+                     variants=None, failed=None):
     """
     Recursively walks through a directory, computes a perceptual hash for each
     image file, and stores it in a dictionary.
+
+    The scan is a streaming pipeline: files are discovered lazily, resolved
+    from the hash cache or the exact-duplicate prefilter where possible, and
+    the rest are hashed while the walk is still running. Each hash is passed
+    on as soon as it is known.
     
     Args:
         var (Variables): The variables object containing the target directory.
         hash_size (int): The size of the hash, which can affect precision.
-        hash_method (str): The hashing algorithm to use ('phash', 'ahash', 'dhash').
+        hash_method (str): The hashing algorithm to use ('phash', 'ahash', 'dhash', 'whash').
+        index (DuplicateIndex): Optional index (or ImageStore) that receives
+                                every hash as it is computed, instead of the
+                                dictionary.
+        entries (dict): Optional dictionary that receives the FileEntry of
+                        every hashed file, keyed by path.
+        on_directory (callable): Optional callback invoked with every directory
+                                 before it is listed.
+        variants (dict): Optional dictionary that receives, for orientation-
+                         invariant scans, the hashes of the other dihedral
+                         variants of every hash, keyed by hash.
+        failed (dict): Optional dictionary that receives the FileEntry of
+                       every file that could not be hashed or was skipped,
+                       keyed by path.
     
+    With var.orientation_invariant, the dihedral variants of every image are
+    hashed as well and passed to the index (or the variants dictionary) along
+    with its hash.
+
+    Files that exceed the per-file limits (var.max_file_bytes,
+    var.max_image_pixels, var.decode_timeout) are skipped with a warning and
+    recorded in the skip list at var.skip_list_path, if set. Files over the
+    byte limit are not even read.
+
+    With var.scan_archives, the images inside zip and tar archives are
+    hashed as well, as `archive.zip!/path/in/archive.jpg`. They are read
+    into memory while the archive is listed, without extracting anything.
+
+    Progress is reported to var.progress_callback, if set, as
+    (files_found, files_done, discovery_done) after every file. The scan
+    stops with ScanCancelled once var.cancel_event, if set, is set.
+
     Returns:
         dict: A dictionary where keys are image hashes and values are a list of
-              file paths that share that hash.
+              file paths that share that hash. If an index was given, the
+              index is returned instead.
     """
     logger.info(f"Scanning directory: {var.target_directory}")
+    metrics = var.metrics
+    progress = {'found': 0, 'done': 0, 'discovery_done': False}
+
+    def advance(found=0, done=0):
+        progress['found'] += found
+        progress['done'] += done
+        if var.progress_callback is not None:
+            var.progress_callback(progress['found'], progress['done'], progress['discovery_done'])
+
+    def check_cancelled():
+        if var.cancel_event is not None and var.cancel_event.is_set():
+            raise ScanCancelled("The scan was cancelled.")
     
     # Use a local dictionary to store hashes for this run.
-    image_hashes = defaultdict(list)
-
-    for dirpath, _, filenames in os.walk(var.target_directory):
-        for filename in filenames:
-            file_path = os.path.join(dirpath, filename)
-            
-            # Check if the file is an image based on its extension
-            if not filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+    image_hashes = defaultdict(list) if index is None else index
+
+    def add_hash(image_hash, entry):
+        other_variants = None
+        if var.orientation_invariant:
+            image_hash, other_variants = image_hash[0], image_hash[1:]
+        if index is not None:
+            index.add(image_hash, entry.path, entry.size, other_variants)
+        else:
+            image_hashes[image_hash].append(entry.path)
+            if variants is not None and other_variants:
+                # Like the index, keeps the variants of the first file of a hash.
+                variants.setdefault(image_hash, other_variants)
+        if entries is not None:
+            entries[entry.path] = entry
+        advance(done=1)
+
+    def add_failure(entry, error):
+        logger.error(f"Could not process file {entry.path}: {error}")
+        if failed is not None:
+            failed[entry.path] = entry
+        advance(done=1)
+
+    if hash_method not in HASH_METHODS:
+        logger.error(f"Unsupported hash method: {hash_method}")
+        return image_hashes
+
+    # Hashes from the fast decode path may differ slightly from full decodes,
+    # so they are cached separately.
+    cache_method = hash_method if var.decode_mode == 'full' else f"{hash_method}:{var.decode_mode}"
+    if var.orientation_invariant:
+        # The variants are cached together, comma-separated.
+        cache_method += ':dihedral'
+
+    limits = limits_for(var)
+    skip_list = SkipList(var.skip_list_path) if var.skip_list_path else None
+
+    def skip(entry, error):
+        metrics.count('files_skipped_total')
+        logger.warning(f"Skipped file {entry.path}: {error}")
+        if skip_list is not None:
+            skip_list.add(entry.path, error)
+        if failed is not None:
+            failed[entry.path] = entry
+        advance(done=1)
+
+    # Previously computed hashes are reused for files that have not changed.
+    cache = open_hash_cache(var)
+
+    # In shard mode only this shard's part of the tree is hashed.
+    include_directory = include_file = None
+    if var.shard is not None:
+        include_directory, include_file = shard_filters(var.target_directory, var.shard, var.shard_by)
+
+    # Byte-identical copies are matched to an earlier file without being
+    # decoded, and inherit its hash once that file has been hashed.
+    exact_filter = ExactDuplicateFilter() if var.exact_prefilter else None
+    content_groups = {}
+    exact_copies = defaultdict(list)
+
+    def record(entry, image_hash):
+        add_hash(image_hash, entry)
+        if cache is not None:
+            cached = ','.join(image_hash) if var.orientation_invariant else image_hash
+            cache.store(entry.path, entry.size, entry.mtime_ns, cache_method, hash_size, cached)
+
+    # Archive members are read while their archive is listed, and handed
+    # to the decoder from memory.
+    read_ahead = read_ahead_for(var)
+    member_contents = MemberContents(read_ahead) if var.scan_archives else None
+
+    def discover():
+        # Yields (entry, read) for every image, where read() returns the
+        # content of an archive member and is None for files.
+        extensions = IMAGE_EXTENSIONS + ARCHIVE_EXTENSIONS if var.scan_archives else IMAGE_EXTENSIONS
+        for entry in iter_image_files(var.target_directory, extensions, on_directory, include_directory):
+            # Shards split the tree by archive, so every archive is only
+            # read by one of them.
+            if include_file is not None and not include_file(entry.path):
                 continue
+            if var.scan_archives and is_archive(entry.path):
+                metrics.count('archives_found_total')
+                yield from iter_archive_members(entry.path, entry.mtime_ns)
+            else:
+                yield entry, None
+
+    def files_to_hash():
+        # Resolves every file that does not need decoding and yields the rest.
+        for entry, read in metrics.timed_iter('walk', discover()):
+            check_cancelled()
+            metrics.count('files_found_total')
+            metrics.count('bytes_found_total', entry.size)
+            advance(found=1)
+            if cache is not None:
+                image_hash = cache.lookup(entry.path, entry.size, entry.mtime_ns, cache_method, hash_size)
+                if image_hash is not None:
+                    metrics.count('cache_hits_total')
+                    if var.orientation_invariant:
+                        image_hash = tuple(image_hash.split(','))
+                    add_hash(image_hash, entry)
+                    continue
 
             try:
-                # Open the image file
-                img = Image.open(file_path)
-                
-                # Convert to a common format (RGB) to handle different image types
-                img = img.convert('RGB')
-                
-                # Compute the hash based on the selected method
-                if hash_method == 'phash':
-                    image_hash = str(imagehash.phash(img, hash_size=hash_size))
-                elif hash_method == 'ahash':
-                    image_hash = str(imagehash.average_hash(img, hash_size=hash_size))
-                elif hash_method == 'dhash':
-                    image_hash = str(imagehash.dhash(img, hash_size=hash_size))
-                else:
-                    logger.error(f"Unsupported hash method: {hash_method}")
+                check_file_size(entry.size, limits)
+            except LimitExceeded as e:
+                skip(entry, e)
+                continue
+
+            if read is not None:
+                try:
+                    member_contents.add(entry.path, read())
+                except Exception as e:
+                    add_failure(entry, e)
+                    continue
+                # Members are already in memory, so they skip the exact
+                # prefilter, which reads files from disk.
+                yield entry
+                continue
+
+            if exact_filter is not None:
+                group = exact_filter.add(entry.path, entry.size)
+                if group.path != entry.path:
+                    if group.image_hash is not None:
+                        record(entry, group.image_hash)
+                    elif isinstance(group.error, LimitExceeded):
+                        skip(entry, group.error)
+                    elif group.error is not None:
+                        add_failure(entry, group.error)
+                    else:
+                        # The original is still being hashed.
+                        exact_copies[group.path].append(entry)
                     continue
+                content_groups[entry.path] = group
 
-                # Add the hash and file path to the dictionary
-                image_hashes[image_hash].append(file_path)
-                
-            except Exception as e:
-                logger.error(f"Could not process file {file_path}: {e}")
+            yield entry
+
+        progress['discovery_done'] = True
+        advance()
+
+    try:
+        for entry, image_hash, error in hash_file_entries(
+            files_to_hash(), hash_size, hash_method, var.decode_mode, var.workers, metrics,
+            member_contents if member_contents is not None else read_ahead, var.hash_backend, var.orientation_invariant, limits
+        ):
+            group = content_groups.pop(entry.path, None)
+            if group is not None:
+                group.image_hash, group.error = image_hash, error
+            copies = exact_copies.pop(entry.path, [])
+
+            if isinstance(error, LimitExceeded):
+                # Byte-identical copies would exceed the limit just the same.
+                for skipped in [entry] + copies:
+                    skip(skipped, error)
+                check_cancelled()
+                continue
+            if error is not None:
+                for failed_entry in [entry] + copies:
+                    add_failure(failed_entry, error)
+                check_cancelled()
                 continue
 
+            # Add the hash and file path (and any exact copies) to the dictionary
+            for hashed in [entry] + copies:
+                record(hashed, image_hash)
+            check_cancelled()
+
+        if exact_filter is not None:
+            metrics.count('exact_copies_total', exact_filter.duplicates_found)
+            logger.info(f"Exact prefilter: {exact_filter.duplicates_found} byte-identical copies were not decoded.")
+
+        if cache is not None:
+            # A shard only sees part of the tree, so it cannot tell which
+            # entries are stale.
+            evicted = cache.evict_missing(var.target_directory) if var.shard is None else 0
+            logger.info(f"Hash cache: {cache.hits} hits, {cache.misses} misses, {evicted} stale entries evicted.")
+        if skip_list is not None:
+            logger.info(f"{skip_list.count} files exceeded a limit and were skipped; see {skip_list.skip_list_path}.")
+    finally:
+        if cache is not None:
+            cache.close()
+        if skip_list is not None:
+            skip_list.close()
+
     return image_hashes
 
 
-def find_duplicates(hashes_map, threshold=10):
+def find_duplicates(hashes_map, threshold=10, metrics=None, variants=None):
     """
     Finds groups of duplicate and near-duplicate images based on a hash map.
-    This function is now designed to be stateless and returns a new list.
+    This function is stateless: it returns a new list and never modifies
+    hashes_map.
+
+    Matching hashes are found with a multi-index Hamming search, or with a
+    vectorized all-pairs kernel when the threshold is too wide for the index
+    to prune much, and are merged transitively with a union-find, so
+    the groups do not depend on the iteration order of hashes_map.
 
     Args:
         hashes_map (dict): The dictionary of image hashes and file paths.
         threshold (int): The maximum Hamming distance for near-duplicates.
+        metrics (Metrics): Optional metrics that receive the number of hash
+                           comparisons and groups.
+        variants (dict): Optional hashes of the other dihedral variants of
+                         every hash, as collected by get_image_hashes. Images
+                         then also match when one is a rotated or mirrored
+                         copy of the other.
 
     Returns:
         list: A list of lists, where each inner list contains the file paths
               of duplicate or near-duplicate images.
     """
-    # CRITICAL FIX: We initialize a new, empty list here.
-    # This prevents the list from growing with subsequent runs.
-    duplicate_groups = []
-    
-    # Process the hashes for exact duplicates first
-    processed_hashes = set()
-    for img_hash, file_paths in hashes_map.items():
-        if len(file_paths) > 1:
-            duplicate_groups.append(file_paths)
-            processed_hashes.add(img_hash)
-
-    # Now, find near-duplicates
-    all_hashes = list(hashes_map.keys())
-    for i in range(len(all_hashes)):
-        hash1 = imagehash.hex_to_hash(all_hashes[i])
-        
-        # If this hash has already been processed as an exact duplicate, skip it
-        if all_hashes[i] in processed_hashes:
-            continue
-            
-        group = hashes_map[all_hashes[i]]
-        processed_hashes.add(all_hashes[i])
-        
-        for j in range(i + 1, len(all_hashes)):
-            hash2 = imagehash.hex_to_hash(all_hashes[j])
-            
-            # If this hash has already been processed, skip it
-            if all_hashes[j] in processed_hashes:
-                continue
-                
-            hamming_distance = hash1 - hash2
-            
-            if hamming_distance <= threshold:
-                group.extend(hashes_map[all_hashes[j]])
-                processed_hashes.add(all_hashes[j])
-        
-        if len(group) > 1:
-            duplicate_groups.append(group)
-            
+    # Sort the hashes so that the search itself is deterministic as well.
+    all_hashes = sorted(hashes_map)
+
+    groups = UnionFind(len(all_hashes))
+    for i, j, _ in find_similar_pairs(all_hashes, threshold, metrics):
+        groups.union(i, j)
+
+    if variants and all_hashes:
+        num_bits = max(len(img_hash) for img_hash in all_hashes) * 4
+        packed = pack_hashes(all_hashes, num_bits)
+        packed_variants = pack_hashes([v for h in all_hashes for v in variants[h]], num_bits)
+        packed_variants = packed_variants.reshape(len(all_hashes), -1, packed.shape[1])
+        for i, j, _ in find_variant_pairs(packed, packed_variants, num_bits, threshold, metrics):
+            groups.union(i, j)
+
+    duplicate_groups = group_paths(groups.components(), all_hashes, hashes_map)
+    if metrics is not None:
+        metrics.count('duplicate_groups_total', len(duplicate_groups))
     return duplicate_groups
 
 
-def delete_duplicates(var, deletion_strategy='keep_first'):
+def _group_file_sizes(duplicate_groups, group_index, group):
     """
-    Deletes duplicate images based on the specified strategy.
-    
+    Returns the sizes of the files in a group, taken from the scan when the
+    groups come from an ImageStore, and from the filesystem otherwise.
+    """
+    if isinstance(duplicate_groups, DuplicateGroups):
+        sizes = [duplicate_groups.store.sizes[file_id] for file_id in duplicate_groups.file_ids(group_index).tolist()]
+        if min(sizes) >= 0:
+            return sizes
+    return [file_size(f) for f in group]
+
+
+def plan_deletions(var, deletion_strategy='keep_first'):
+    """
+    Works out, for each duplicate group, which file is kept and which are
+    deleted (or otherwise handled).
+
     Args:
         var (Variables): The variables object containing duplicate groups.
-        deletion_strategy (str): The strategy to use for deletion.
-                                 'keep_first' or 'keep_smallest'.
+        deletion_strategy (str): 'keep_first' or 'keep_smallest'.
+
+    Returns:
+        list: (kept, duplicates) for every group, in the order of the groups.
     """
-    logger.info("Starting deletion process...")
-    files_to_delete = []
+    def original_file_key(file_path):
+        # A simple check to see if the filename contains " - Copy"
+        # Files without the string will have a lower (0) value and be sorted first.
+        # Archive members, which are never changed, come after loose files.
+        return is_archive_member(file_path), " - Copy" in os.path.basename(file_path)
 
-    # This is the corrected and restored logic to ensure the "original" file is kept.
-    for group in var.duplicate_groups:
+    deletion_plan = []
+    for group_index, group in enumerate(var.duplicate_groups):
         if deletion_strategy == 'keep_first':
             # We sort the group to ensure that the original file (without " - Copy")
             # is always at the beginning of the list, so it will be kept.
-            def original_file_key(file_path):
-                # A simple check to see if the filename contains " - Copy"
-                # Files without the string will have a lower (0) value and be sorted first.
-                return " - Copy" in os.path.basename(file_path)
-
-            group.sort(key=original_file_key)
-            files_to_delete.extend(group[1:])
+            group = sorted(group, key=original_file_key)
         elif deletion_strategy == 'keep_smallest':
             # Sort by file size (smallest first) and delete all but the smallest
-            files_and_sizes = [(f, os.path.getsize(f)) for f in group]
-            files_and_sizes.sort(key=lambda x: x[1])
-            files_to_delete.extend([f for f, s in files_and_sizes[1:]])
+            sizes = _group_file_sizes(var.duplicate_groups, group_index, group)
+            group = [f for f, s in sorted(zip(group, sizes), key=lambda x: x[1])]
         else:
             logger.info(f"Error: Unsupported deletion strategy '{deletion_strategy}'. Using 'keep_first'.")
-            files_to_delete.extend(group[1:])
-
-    # Print a summary of files to be deleted (Dry Run)
-    logger.info("\n--- Duplicate files ---")
-    for group in var.duplicate_groups:
-        logger.info(f"Group with original kept file:")
-        logger.info(f"  - Kept: {group[0]}")
-        logger.info(f"  - Deleting:")
-        for file_path in group[1:]:
-            logger.info(f"    - {file_path}")
-    logger.info("-----------------------------------\n")
-    
-    deleted_count = 0
-    if not var.dry_run:
-        for file_path in files_to_delete:
-            try:
-                os.remove(file_path)
-                logger.info(f"Deleted file: {file_path}")
-                deleted_count += 1
-            except OSError as e:
-                logger.error(f"Error deleting {file_path}: {e}")
-    else:
-        # This is the dry run block
-        logger.info("Dry run enabled. No files will be deleted.")
-        for file_path in files_to_delete:
-            logger.info(f"Would have deleted: {file_path}")
+        deletion_plan.append((group[0], group[1:]))
+    return deletion_plan
+
+
+def delete_duplicates(var, deletion_strategy='keep_first', deletion_plan=None):
+    """
+    Deletes duplicate images based on the specified strategy, or applies the
+    alternative action set in var.action (hardlink, symlink or quarantine).
+
+    The files of every group are logged, unless a report is written to
+    var.output_path, which lists them instead.
     
-    if not var.dry_run:
-        logger.info(f"\nSuccessfully deleted {deleted_count} files.")
+    Args:
+        var (Variables): The variables object containing duplicate groups.
+        deletion_strategy (str): The strategy to use for deletion.
+                                 'keep_first' or 'keep_smallest'.
+        deletion_plan (list): The plan returned by plan_deletions, if it was
+                              already made.
+    """
+    logger.info("Starting deletion process...")
+    if deletion_plan is None:
+        deletion_plan = plan_deletions(var, deletion_strategy)
+
+    # Duplicates inside archives are listed, but left in place.
+    files_to_delete = sum(not is_archive_member(f) for _, duplicates in deletion_plan for f in duplicates)
+    var.metrics.count('files_to_delete_total', files_to_delete)
+
+    # Print a summary of the files to be deleted, once, unless the report
+    # already lists them.
+    if var.output_path:
+        logger.info(f"{len(deletion_plan)} duplicate groups are listed in {var.output_path}.")
     else:
-        logger.info(f"\nNo files were deleted because dry run was enabled.")
\ No newline at end of file
+        action_label = {'delete': 'Deleting', 'quarantine': 'Quarantining'}.get(var.action, f"Replacing with {var.action}s")
+        logger.info("\n--- Duplicate files ---")
+        for kept, duplicates in deletion_plan:
+            logger.info(f"Group with original kept file:")
+            logger.info(f"  - Kept: {kept}")
+            logger.info(f"  - {action_label}:")
+            for file_path in duplicates:
+                note = " (inside an archive, left in place)" if is_archive_member(file_path) else ""
+                logger.info(f"    - {file_path}{note}")
+        logger.info("-----------------------------------\n")
+
+    if var.dry_run:
+        logger.info(f"Dry run enabled. No files will be changed; {files_to_delete} files would be processed.")
+        logger.info(f"\nNo files were deleted because dry run was enabled.")
+        return
+
+    done = apply_plan(var, deletion_plan)
+    logger.info(f"\nSuccessfully processed {done} of {files_to_delete} files ({var.action}).")
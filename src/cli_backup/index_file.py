@@ -0,0 +1,307 @@
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+from functools import lru_cache
+
+import numpy as np
+
+from cli_backup.packed import hamming_distances, pack_hashes, words_for_bits
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'DUPIDX\r\n'
+INDEX_FORMAT = 'duplicate-image-detector-index'
+INDEX_VERSION = 1
+
+# Hashes are split into substrings of at most this many bits for the
+# multi-index lookup. Each substring gets a table of 2 ** bits bucket offsets.
+INDEX_CHUNK_BITS = 16
+
+# Sections are aligned so they can be mapped directly as NumPy arrays.
+_ALIGNMENT = 64
+
+# Rows compared at a time when a query falls back to a full scan.
+_SCAN_BLOCK_ROWS = 1 << 20
+
+# The magic, then the length of the JSON header that follows it.
+_PREAMBLE = struct.Struct('<8sQ')
+
+
+def chunk_layout(num_bits):
+    """
+    Splits num_bits into the substrings indexed by the neighbor tables.
+
+    Returns:
+        list: (shift, bits) for every substring, lowest bits first.
+    """
+    chunks = max(1, -(-num_bits // INDEX_CHUNK_BITS))
+    base_bits, extra = divmod(num_bits, chunks)
+    layout = []
+    shift = 0
+    for i in range(chunks):
+        bits = base_bits + (1 if i < extra else 0)
+        layout.append((shift, bits))
+        shift += bits
+    return layout
+
+
+def _chunk_values(packed, shift, bits):
+    """
+    Extracts one substring of every packed hash, which may straddle two of the
+    64-bit words (stored most significant first).
+    """
+    word, offset = divmod(shift, 64)
+    column = packed.shape[1] - 1 - word
+    values = packed[:, column] >> np.uint64(offset)
+    if offset + bits > 64:
+        values |= packed[:, column - 1] << np.uint64(64 - offset)
+    return values & np.uint64((1 << bits) - 1)
+
+
+@lru_cache(maxsize=64)
+def _flip_masks(bits, radius):
+    """
+    Returns:
+        numpy.ndarray: Every bits-wide mask with at most `radius` bits set.
+    """
+    values = np.arange(1 << bits, dtype=np.uint32)
+    counts = np.zeros(len(values), dtype=np.uint8)
+    for bit in range(bits):
+        counts += ((values >> bit) & 1).astype(np.uint8)
+    return values[counts <= radius]
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def write_index_file(index_path, store, target_directory, hash_method, hash_size, decode_mode):
+    """
+    Writes the hashes of a scan as a persistent index that IndexFile can map
+    into memory and query without loading it.
+
+    The file holds the distinct hashes packed into 64-bit words, a neighbor
+    structure for multi-index Hamming search (for every substring of the
+    hashes, the hash ids sorted by substring value plus a table of bucket
+    offsets), and a path table (the files of every hash, with their sizes and
+    UTF-8 paths). A JSON header describes the scan and where each section is.
+
+    Args:
+        index_path (str): The file to write.
+        store (ImageStore): The hashed files.
+        target_directory (str): The scanned directory.
+        hash_method (str): The hashing algorithm used.
+        hash_size (int): The hash size used.
+        decode_mode (str): The decode mode used.
+
+    Returns:
+        int: The number of files written.
+    """
+    # Hex strings hold whole nibbles, so that is what an empty store assumes.
+    num_bits = store.num_bits or -(-hash_size * hash_size // 4) * 4
+    words = words_for_bits(num_bits)
+    packed = store.packed_hashes() if store.num_hashes else np.zeros((0, words), dtype=np.uint64)
+    layout = chunk_layout(num_bits)
+
+    sections = [('hashes', packed)]
+    for i, (shift, bits) in enumerate(layout):
+        values = _chunk_values(packed, shift, bits)
+        sections.append((f'chunk{i}_ids', np.argsort(values, kind='stable').astype(np.uint32)))
+        offsets = np.zeros((1 << bits) + 1, dtype=np.uint32)
+        np.cumsum(np.bincount(values.astype(np.int64), minlength=1 << bits), out=offsets[1:])
+        sections.append((f'chunk{i}_offsets', offsets))
+
+    # Files ordered by hash id, so the files of a hash are contiguous.
+    hash_ids = np.array(store.hash_ids, dtype=np.int64)
+    files = np.argsort(hash_ids, kind='stable').astype(np.uint32)
+    file_offsets = np.zeros(store.num_hashes + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(hash_ids, minlength=store.num_hashes), out=file_offsets[1:])
+
+    encoded = [store.paths[file_id].encode('utf-8', 'surrogateescape') for file_id in range(len(store))]
+    path_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(path) for path in encoded], out=path_offsets[1:])
+
+    sections += [
+        ('files', files),
+        ('file_offsets', file_offsets),
+        ('sizes', np.array(store.sizes, dtype=np.int64)),
+        ('path_offsets', path_offsets),
+        ('paths', np.frombuffer(b''.join(encoded), dtype=np.uint8)),
+    ]
+
+    header = {
+        'format': INDEX_FORMAT,
+        'version': INDEX_VERSION,
+        'target_directory': os.path.abspath(target_directory),
+        'hash_method': hash_method,
+        'hash_size': hash_size,
+        'decode_mode': decode_mode,
+        'num_bits': num_bits,
+        'words': words,
+        'num_hashes': store.num_hashes,
+        'num_files': len(store),
+        'chunks': layout,
+        'created': time.time(),
+        'sections': {},
+    }
+
+    # The section offsets depend on the header length, which depends on the
+    # offsets; reserving a generous fixed size for them avoids iterating.
+    header_size = _aligned(_PREAMBLE.size + len(json.dumps(header)) + 64 * len(sections) + _ALIGNMENT)
+    position = header_size
+    for name, data in sections:
+        header['sections'][name] = [position, data.dtype.str, list(data.shape)]
+        position = _aligned(position + data.nbytes)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    if _PREAMBLE.size + len(header_bytes) > header_size:
+        raise ValueError("The index header does not fit in the space reserved for it.")
+
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(INDEX_MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        for name, data in sections:
+            f.seek(header['sections'][name][0])
+            f.write(np.ascontiguousarray(data).tobytes())
+        f.truncate(position)
+    # Readers never see a partially written index.
+    os.replace(temp_path, index_path)
+    logger.info(f"Wrote an index of {len(store)} files ({store.num_hashes} distinct hashes) to {index_path}")
+    return len(store)
+
+
+class IndexFile:
+    """
+    A read-only, memory-mapped index written by write_index_file.
+
+    Opening an index only parses its header; the sections are NumPy views of
+    the mapped file, so a query touches just the pages it needs and the index
+    is never loaded into Python objects. Use as a context manager, or call
+    close() when done.
+
+    Attributes:
+        header (dict): The header written with the index.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, 'rb') as f:
+            magic, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{index_path} is not an index file")
+            self.header = json.loads(f.read(header_length))
+            if self.header.get('format') != INDEX_FORMAT or self.header.get('version') != INDEX_VERSION:
+                raise ValueError(f"{index_path} is not a supported index file")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._sections = {}
+        for name, (offset, dtype, shape) in self.header['sections'].items():
+            count = int(np.prod(shape, dtype=np.int64))
+            self._sections[name] = np.frombuffer(self._map, dtype=dtype, count=count, offset=offset).reshape(shape)
+        self._chunks = [
+            (shift, bits, self._sections[f'chunk{i}_ids'], self._sections[f'chunk{i}_offsets'])
+            for i, (shift, bits) in enumerate(self.header['chunks'])
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.header['num_files']
+
+    def close(self):
+        # The views must be released before the mapping can be closed.
+        self._sections = {}
+        self._chunks = []
+        self._map.close()
+
+    def query(self, image_hash, threshold):
+        """
+        Finds the indexed files whose hash is within `threshold` bits of
+        image_hash.
+
+        Candidates are found by probing, for every substring of the hash, the
+        buckets within threshold // substrings bits of the query's substring;
+        by the pigeonhole principle every match is in at least one of them.
+        When that would probe more buckets than there are hashes, all hashes
+        are compared instead.
+
+        Args:
+            image_hash (str): The hexadecimal hash, computed with the index's
+                              hash method and size.
+            threshold (int): The maximum Hamming distance.
+
+        Returns:
+            list: (file_path, distance, size) tuples, closest first.
+        """
+        num_bits = self.header['num_bits']
+        if len(image_hash) * 4 != num_bits:
+            raise ValueError(f"A {len(image_hash) * 4}-bit hash cannot be matched against {num_bits}-bit hashes")
+        hashes = self._sections['hashes']
+        query = pack_hashes([image_hash], num_bits)[0]
+
+        chunk_radius = threshold // len(self._chunks)
+        probes = sum(len(_flip_masks(bits, chunk_radius)) for _, bits, _, _ in self._chunks)
+        if probes >= len(hashes):
+            matched, distances = self._scan(hashes, query, threshold)
+        else:
+            value = int(image_hash, 16)
+            candidates = [
+                self._probe(ids, offsets, (value >> shift) & ((1 << bits) - 1), _flip_masks(bits, chunk_radius))
+                for shift, bits, ids, offsets in self._chunks
+            ]
+            candidates = np.unique(np.concatenate(candidates))
+            distances = hamming_distances(hashes[candidates], query)
+            close = distances <= threshold
+            matched, distances = candidates[close], distances[close]
+
+        file_offsets = self._sections['file_offsets']
+        files = self._sections['files']
+        matches = []
+        for hash_id, distance in zip(matched.tolist(), distances.tolist()):
+            for file_id in files[int(file_offsets[hash_id]):int(file_offsets[hash_id + 1])].tolist():
+                matches.append((self.path(file_id), distance, int(self._sections['sizes'][file_id])))
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+    def path(self, file_id):
+        """
+        Returns:
+            str: The path of an indexed file.
+        """
+        path_offsets = self._sections['path_offsets']
+        start, stop = int(path_offsets[file_id]), int(path_offsets[file_id + 1])
+        return self._sections['paths'][start:stop].tobytes().decode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def _probe(ids, offsets, chunk, flips):
+        keys = (np.uint32(chunk) ^ flips).astype(np.int64)
+        starts = offsets[keys].astype(np.int64)
+        lengths = offsets[keys + 1].astype(np.int64) - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.zeros(0, dtype=np.uint32)
+        # Concatenates the ranges starts[i]:starts[i] + lengths[i].
+        run_starts = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - run_starts, lengths) + np.arange(total)
+        return ids[positions]
+
+    @staticmethod
+    def _scan(hashes, query, threshold):
+        matched = []
+        distances = []
+        for start in range(0, len(hashes), _SCAN_BLOCK_ROWS):
+            block = hamming_distances(hashes[start:start + _SCAN_BLOCK_ROWS], query)
+            close = np.flatnonzero(block <= threshold)
+            matched.append(close + start)
+            distances.append(block[close])
+        if not matched:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint16)
+        return np.concatenate(matched), np.concatenate(distances)
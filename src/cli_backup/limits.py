@@ -0,0 +1,282 @@
+import json
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+import multiprocessing.connection
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Per-file limits enforced while hashing. None disables a limit.
+#   max_pixels: the most pixels an image may decode to.
+#   max_bytes: the largest file that is read at all.
+#   decode_timeout: the most seconds decoding and hashing one file may take.
+FileLimits = namedtuple('FileLimits', ['max_pixels', 'max_bytes', 'decode_timeout'])
+
+NO_LIMITS = FileLimits(None, None, None)
+
+# Seconds a task may run past its timeout, to stop by itself through
+# decode_deadline, before DeadlinePool kills its worker.
+KILL_GRACE_SECONDS = 1.0
+
+# Tasks a DeadlinePool runs ahead of the first unfinished one, per worker.
+TASKS_PER_WORKER = 4
+
+
+class LimitExceeded(Exception):
+    """
+    Raised (and returned by the hashing workers) when a file exceeds one of
+    its FileLimits. Such files are skipped rather than reported as errors.
+
+    Attributes:
+        limit (str): The name of the limit, as in FileLimits.
+    """
+
+    def __init__(self, limit, message):
+        super().__init__(limit, message)
+        self.limit = limit
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def limits_for(var):
+    """
+    Returns:
+        FileLimits: The per-file limits configured on a Variables object.
+    """
+    return FileLimits(var.max_image_pixels, var.max_file_bytes, var.decode_timeout)
+
+
+def check_file_size(size, limits):
+    """
+    Raises LimitExceeded if a file is larger than limits.max_bytes.
+    """
+    if limits.max_bytes is not None and size > limits.max_bytes:
+        raise LimitExceeded('max_bytes', f"The file has {size} bytes, more than the limit of {limits.max_bytes}")
+
+
+def check_image_size(img, limits):
+    """
+    Raises LimitExceeded if an opened image would decode to more than
+    limits.max_pixels pixels. Only the header has been read at that point.
+    """
+    width, height = img.size
+    if limits.max_pixels is not None and width * height > limits.max_pixels:
+        raise LimitExceeded(
+            'max_pixels', f"The image has {width}x{height} pixels, more than the limit of {limits.max_pixels}"
+        )
+
+
+@contextmanager
+def decode_deadline(seconds):
+    """
+    Interrupts the enclosed code with LimitExceeded once it has run for
+    `seconds`, using SIGALRM.
+
+    The signal is only handled between Python bytecodes, so code that stays
+    in C (a decoder stuck on a malformed file) is not interrupted, and it can
+    only be armed on the main thread of a process where SIGALRM exists (not
+    on Windows). Elsewhere the code runs to completion. This is a fast path
+    for the workers of a DeadlinePool, which enforces the timeout in every
+    case by killing the worker.
+    """
+    if not seconds or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise LimitExceeded('decode_timeout', f"Decoding took longer than {seconds:g} seconds")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+_Worker = namedtuple('_Worker', ['process', 'connection'])
+
+
+def _deadline_worker(connection):
+    # Runs the tasks sent by a DeadlinePool, one at a time, until the pipe is
+    # closed. Interrupts are left to the parent, which stops the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        function, args = message
+        connection.send(function(*args))
+
+
+class DeadlinePool:
+    """
+    Worker processes that run one task at a time, and are killed and
+    replaced when a task overruns its timeout or the process dies.
+
+    Unlike the workers of a ProcessPoolExecutor, which cannot be stopped
+    while they run a task, this enforces a timeout on any code, including a
+    decoder stuck in C. It is used for hashing when a decode timeout is set.
+
+    Idle workers are kept between calls to map() until shutdown(), and
+    several threads may call map() at once; each call uses up to `workers`
+    processes.
+    """
+
+    def __init__(self, workers, mp_context=None):
+        self.workers = max(1, workers)
+        self._context = mp_context or multiprocessing.get_context()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def map(self, function, tasks, timeout, failed):
+        """
+        Runs function(*args) for every args tuple of tasks in the workers,
+        lazily, a few tasks ahead of the results consumed.
+
+        Args:
+            function (callable): A picklable function that does not raise.
+            tasks (iterable): The argument tuples.
+            timeout (float): Seconds after which a task is stopped.
+            failed (callable): Called as failed(args, error, seconds) for a
+                               task that was stopped or whose worker died,
+                               where error is a LimitExceeded for a timeout
+                               and a message otherwise.
+
+        Yields:
+            The result of every task, or that of failed(), in order.
+        """
+        tasks = iter(tasks)
+        running = {}
+        results = {}
+        submitted = 0
+        yielded = 0
+        exhausted = False
+        try:
+            while True:
+                while (not exhausted and len(running) < self.workers
+                       and submitted - yielded < self.workers * TASKS_PER_WORKER):
+                    args = next(tasks, None)
+                    if args is None:
+                        exhausted = True
+                        break
+                    worker = self._acquire()
+                    try:
+                        worker.connection.send((function, args))
+                    except OSError:
+                        # The worker died after it was checked; start a new one.
+                        self._kill(worker)
+                        worker = self._start()
+                        worker.connection.send((function, args))
+                    running[worker.connection] = (worker, submitted, args, time.monotonic())
+                    submitted += 1
+
+                while yielded in results:
+                    yield results.pop(yielded)
+                    yielded += 1
+                if not running:
+                    if exhausted:
+                        return
+                    continue
+
+                deadline = min(started for _, _, _, started in running.values()) + timeout + KILL_GRACE_SECONDS
+                for connection in multiprocessing.connection.wait(list(running), max(0.0, deadline - time.monotonic())):
+                    worker, number, args, started = running.pop(connection)
+                    try:
+                        results[number] = connection.recv()
+                    except (EOFError, OSError):
+                        self._kill(worker)
+                        results[number] = failed(args, "The worker process stopped unexpectedly", time.monotonic() - started)
+                    else:
+                        self._release(worker)
+
+                now = time.monotonic()
+                for connection, (worker, number, args, started) in list(running.items()):
+                    if now - started >= timeout + KILL_GRACE_SECONDS:
+                        del running[connection]
+                        self._kill(worker)
+                        error = LimitExceeded('decode_timeout', f"Decoding took longer than {timeout:g} seconds")
+                        results[number] = failed(args, error, now - started)
+        finally:
+            # Results that are no longer wanted are not waited for.
+            for worker, _, _, _ in running.values():
+                self._kill(worker)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the idle workers. Named after ProcessPoolExecutor.shutdown, so
+        either can be passed as the pool of a long-running process.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            try:
+                worker.connection.send(None)
+            except OSError:
+                pass
+        for worker in idle:
+            if wait:
+                worker.process.join()
+            worker.connection.close()
+
+    def _acquire(self):
+        # A worker can die while it is idle (e.g. killed by the OOM killer);
+        # dead workers are dropped rather than handed out.
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                worker = self._idle.pop()
+            if worker.process.is_alive():
+                return worker
+            self._kill(worker)
+        return self._start()
+
+    def _start(self):
+        parent, child = self._context.Pipe()
+        process = self._context.Process(target=_deadline_worker, args=(child,), daemon=True)
+        process.start()
+        child.close()
+        return _Worker(process, parent)
+
+    def _release(self, worker):
+        with self._lock:
+            self._idle.append(worker)
+
+    def _kill(self, worker):
+        worker.process.kill()
+        worker.process.join()
+        worker.connection.close()
+
+
+class SkipList:
+    """
+    Records the files skipped for exceeding a limit, one JSON line per file:
+    {"path": ..., "limit": ..., "reason": ...}. Lines are flushed as they are
+    written, so the list is complete up to the file being scanned even if the
+    scan is interrupted.
+    """
+
+    def __init__(self, skip_list_path):
+        self.skip_list_path = skip_list_path
+        self.count = 0
+        self._file = open(skip_list_path, 'w', encoding='utf-8')
+
+    def add(self, file_path, error):
+        self.count += 1
+        item = {'path': file_path, 'limit': error.limit, 'reason': error.message}
+        self._file.write(json.dumps(item, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
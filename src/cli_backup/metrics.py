@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import bisect
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the per-file decode time histogram buckets.
+DECODE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix of every metric name in the Prometheus output.
+PROMETHEUS_PREFIX = 'duplicate_image_detector'
+
+
+def _cpu_time():
+    """
+    CPU time of this process plus that of finished child processes, so work
+    done by the hashing pool is included once the pool has shut down.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Histogram:
+    """
+    A cumulative histogram with fixed bucket bounds, as used by Prometheus.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        Returns:
+            list: (upper bound, number of observations <= bound) tuples, ending
+                  with float('inf').
+        """
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Metrics:
+    """
+    Collects per-stage timings, counters and histograms for one run.
+
+    Stages record wall and CPU time and may be entered several times; their
+    times add up. Counters are plain running totals.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = defaultdict(int)
+        self.histograms = {}
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the body of a with block as stage `name`.
+        """
+        wall_start, cpu_start = time.perf_counter(), _cpu_time()
+        try:
+            yield
+        finally:
+            self._add_stage(name, time.perf_counter() - wall_start, _cpu_time() - cpu_start)
+
+    def timed_iter(self, name, iterable):
+        """
+        Yields the items of an iterable, timing only the time spent producing
+        them as stage `name`. Used for lazy producers such as the directory
+        walk, whose work is interleaved with the stages that consume it.
+        """
+        iterator = iter(iterable)
+        while True:
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._add_stage(name, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def observe(self, name, value, buckets=DECODE_BUCKETS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: All collected metrics, ready to be serialized as JSON.
+        """
+        return {
+            'started': self.started,
+            'stages': self.stages,
+            'counters': dict(self.counters),
+            'histograms': {
+                name: {
+                    'buckets': [[bound if bound != float('inf') else '+Inf', count]
+                                for bound, count in histogram.cumulative_counts()],
+                    'sum': histogram.sum,
+                    'count': histogram.count,
+                }
+                for name, histogram in self.histograms.items()
+            },
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        logger.info(f"Metrics written to {path}")
+
+    def write_prometheus(self, path, prefix=PROMETHEUS_PREFIX):
+        """
+        Writes the metrics in the Prometheus text exposition format, for the
+        node exporter's textfile collector. The file is replaced atomically so
+        the collector never reads a partial file.
+        """
+        lines = [
+            f"# HELP {prefix}_last_run_timestamp_seconds Start time of the run.",
+            f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+            f"{prefix}_last_run_timestamp_seconds {self.started}",
+        ]
+        for field, help_text in (('wall_seconds', 'Wall time'), ('cpu_seconds', 'CPU time')):
+            lines.append(f"# HELP {prefix}_stage_{field} {help_text} spent in each stage.")
+            lines.append(f"# TYPE {prefix}_stage_{field} gauge")
+            for stage, values in sorted(self.stages.items()):
+                lines.append(f'{prefix}_stage_{field}{{stage="{stage}"}} {values[field]}')
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.append(f"{prefix}_{name} {value}")
+
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for bound, count in histogram.cumulative_counts():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_{name}_bucket{{le="{le}"}} {count}')
+            lines.append(f"{prefix}_{name}_sum {histogram.sum}")
+            lines.append(f"{prefix}_{name}_count {histogram.count}")
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+        logger.info(f"Prometheus metrics written to {path}")
+
+    def log_summary(self):
+        """
+        Logs the time spent in each stage.
+        """
+        for stage, values in self.stages.items():
+            logger.info(f"Stage {stage}: {values['wall_seconds']:.3f}s wall, {values['cpu_seconds']:.3f}s CPU")
+
+    def _add_stage(self, name, wall, cpu, calls=1):
+        stage = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0})
+        stage['wall_seconds'] += wall
+        stage['cpu_seconds'] += cpu
+        stage['calls'] += calls
@@ -0,0 +1,154 @@
+"""
+Several perceptual hashes, and their dihedral variants, from one decode.
+
+The dihedral variants of a hash are the hashes of the image rotated by 0, 90,
+180 and 270 degrees, and of its mirror image rotated the same way. A rotated
+or mirrored copy of an image has a hash close to one of the variants of the
+original, so comparing the variants of one image with the hash of another
+finds duplicates in any orientation.
+
+Like cli_backup.backends, this module imports NumPy, Pillow and SciPy on
+first use.
+"""
+
+from cli_backup.backends import bits_to_hex, check_hash_size, lanczos_filter
+
+# The hashes that can be computed together and with dihedral variants.
+MULTI_HASH_METHODS = ('ahash', 'dhash', 'phash')
+
+# The order of the variants; every list of variants starts with the
+# unchanged image.
+DIHEDRAL_TRANSFORMS = ('identity', 'rot90', 'rot180', 'rot270', 'mirror', 'mirror_rot90', 'mirror_rot180', 'mirror_rot270')
+
+# Variants for which the width and height of the image are swapped.
+_SWAPS_AXES = (False, True, False, True, False, True, False, True)
+
+# Each hash shrinks the image to a small grid before comparing pixels; the
+# variants that swap axes need a grid of the transposed shape, which is
+# resampled from a copy of the image reduced to about this many times the
+# grid size rather than from the full image.
+_SWAPPED_SOURCE_FACTOR = 8
+
+
+def _dihedral(pixels):
+    """
+    Returns:
+        list: The 8 dihedral variants of a 2-D array, in DIHEDRAL_TRANSFORMS
+              order. They are views, not copies.
+    """
+    import numpy as np
+
+    mirrored = pixels[:, ::-1]
+    return [np.rot90(pixels, k) for k in range(4)] + [np.rot90(mirrored, k) for k in range(4)]
+
+
+class _Grayscale:
+    """
+    The grayscale image shared by every hash of one decode, with the small
+    grids resampled from it cached by size.
+    """
+
+    def __init__(self, img):
+        self.image = img if img.mode == 'L' else img.convert('L')
+        self._grids = {}
+        self._reduced = None
+
+    def grid(self, width, height):
+        import numpy as np
+
+        key = (width, height)
+        if key not in self._grids:
+            self._grids[key] = np.asarray(self.image.resize(key, lanczos_filter()))
+        return self._grids[key]
+
+    def swapped_grid(self, width, height):
+        """
+        Returns a height x width grid for the variants that swap axes. Square
+        grids are simply reused; others come from a reduced copy.
+        """
+        import numpy as np
+
+        if width == height:
+            return self.grid(width, height)
+        key = ('swapped', width, height)
+        if key not in self._grids:
+            if self._reduced is None:
+                factor = min(self.image.size) // (_SWAPPED_SOURCE_FACTOR * max(width, height))
+                self._reduced = self.image.reduce(factor) if factor > 1 else self.image
+            self._grids[key] = np.asarray(self._reduced.resize((height, width), lanczos_filter()))
+        return self._grids[key]
+
+    def variants(self, width, height, dihedral):
+        """
+        Returns:
+            list: The grid of the image for every variant (only the unchanged
+                  image unless dihedral), each of shape (height, width).
+        """
+        straight = self.grid(width, height)
+        if not dihedral:
+            return [straight]
+        # A quarter turn of the height x width grid of the transposed image
+        # has the shape of the grid of the image itself.
+        swapped = self.swapped_grid(width, height)
+        return [
+            turned if swaps else kept
+            for kept, turned, swaps in zip(_dihedral(straight), _dihedral(swapped), _SWAPS_AXES)
+        ]
+
+
+def _average_hash_bits(pixels):
+    import numpy as np
+
+    return pixels > np.mean(pixels)
+
+
+def _dhash_bits(pixels):
+    return pixels[:, 1:] > pixels[:, :-1]
+
+
+def _phash_bits(pixels, hash_size):
+    import numpy as np
+    import scipy.fftpack
+
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
+    low = dct[:hash_size, :hash_size]
+    return low > np.median(low)
+
+
+def compute_hashes(img, hash_requests, dihedral=False):
+    """
+    Computes several hashes of an image, optionally with their dihedral
+    variants, from a single grayscale conversion.
+
+    Each hash resamples the grayscale image once (the variants that swap axes
+    of dhash, whose grid is not square, are resampled once more from a
+    reduced copy); the variants themselves are just rotated and mirrored views
+    of the small grids. The hash of the unchanged image is identical to the
+    one imagehash computes.
+
+    Args:
+        img (PIL.Image.Image): The decoded image.
+        hash_requests (iterable): (hash_method, hash_size) pairs, with
+                                  methods from MULTI_HASH_METHODS.
+        dihedral (bool): Whether to compute the 8 dihedral variants.
+
+    Returns:
+        dict: For every (hash_method, hash_size), the tuple of hexadecimal
+              hashes of every variant, in DIHEDRAL_TRANSFORMS order (just the
+              unchanged image unless dihedral).
+    """
+    gray = _Grayscale(img)
+    hashes = {}
+    for hash_method, hash_size in hash_requests:
+        check_hash_size(hash_size)
+        if hash_method == 'ahash':
+            bits = [_average_hash_bits(p) for p in gray.variants(hash_size, hash_size, dihedral)]
+        elif hash_method == 'dhash':
+            bits = [_dhash_bits(p) for p in gray.variants(hash_size + 1, hash_size, dihedral)]
+        elif hash_method == 'phash':
+            size = hash_size * 4
+            bits = [_phash_bits(p, hash_size) for p in gray.variants(size, size, dihedral)]
+        else:
+            raise ValueError(f"Unsupported hash method for multiple hashes: {hash_method}")
+        hashes[(hash_method, hash_size)] = tuple(bits_to_hex(b) for b in bits)
+    return hashes
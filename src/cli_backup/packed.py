@@ -0,0 +1,138 @@
+import numpy as np
+
+# Upper bound on the number of uint64 words XOR-ed per block, which keeps the
+# temporary arrays of the brute-force kernel at a few tens of megabytes.
+_BLOCK_WORDS = 1 << 22
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(words):
+        return np.bitwise_count(words)
+else:  # NumPy < 2.0
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        counts = _POPCOUNT_TABLE[words.view(np.uint8)]
+        return counts.reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def words_for_bits(num_bits):
+    """
+    Returns the number of 64-bit words needed to hold a hash of num_bits bits.
+    """
+    return max(1, (num_bits + 63) // 64)
+
+
+def pack_hashes(hex_hashes, num_bits=None):
+    """
+    Packs hexadecimal hash strings into a contiguous array of 64-bit words.
+
+    Args:
+        hex_hashes (list): Hash strings as produced by imagehash.
+        num_bits (int): The hash length in bits. Defaults to the length of the
+                        longest hash string.
+
+    Returns:
+        numpy.ndarray: A C-contiguous uint64 array of shape (n, words), with
+                       the most significant word first.
+    """
+    if num_bits is None:
+        num_bits = max((len(h) for h in hex_hashes), default=0) * 4
+    words = words_for_bits(num_bits)
+    width = words * 16
+
+    raw = bytes.fromhex("".join(h.rjust(width, "0") for h in hex_hashes))
+    packed = np.frombuffer(raw, dtype=">u8").astype(np.uint64)
+    return np.ascontiguousarray(packed.reshape(len(hex_hashes), words))
+
+
+def unpack_to_ints(packed):
+    """
+    Converts packed hashes back to Python ints, one per row.
+    """
+    if packed.shape[1] == 1:
+        return packed[:, 0].tolist()
+
+    values = []
+    for row in packed.tolist():
+        value = 0
+        for word in row:
+            value = (value << 64) | word
+        values.append(value)
+    return values
+
+
+def hamming_distances(packed, query):
+    """
+    Computes the Hamming distance from one or more packed hashes to every
+    hash in a packed array.
+
+    Args:
+        packed (numpy.ndarray): Packed hashes of shape (n, words).
+        query (numpy.ndarray): Packed hashes of shape (m, words) or (words,).
+
+    Returns:
+        numpy.ndarray: Distances of shape (m, n), or (n,) for a single query.
+    """
+    single = query.ndim == 1
+    if single:
+        query = query[None, :]
+
+    counts = _popcount(query[:, None, :] ^ packed[None, :, :])
+    if packed.shape[1] == 1:
+        distances = counts[:, :, 0]
+    else:
+        distances = counts.sum(axis=-1, dtype=np.uint16)
+    return distances[0] if single else distances
+
+
+def find_pairs_bruteforce(packed, threshold):
+    """
+    Finds every pair of hashes within `threshold` bits of each other by
+    comparing all pairs, a block of rows at a time, with a vectorized
+    XOR-plus-popcount kernel.
+
+    Args:
+        packed (numpy.ndarray): Packed hashes of shape (n, words).
+        threshold (int): The maximum Hamming distance.
+
+    Yields:
+        tuple: (i, j, distance) with i < j indexing into packed.
+    """
+    count, words = packed.shape
+    block_rows = max(1, _BLOCK_WORDS // max(1, count * words))
+
+    for start in range(0, count, block_rows):
+        stop = min(count, start + block_rows)
+        # Only compare each block against itself and the rows after it.
+        distances = hamming_distances(packed[start:], packed[start:stop])
+        width = distances.shape[1]
+        rows, cols = np.divmod(np.flatnonzero(distances <= threshold), width)
+        upper = cols > rows
+        rows, cols = rows[upper], cols[upper]
+        found = distances[rows, cols]
+        for i, j, distance in zip((rows + start).tolist(), (cols + start).tolist(), found.tolist()):
+            yield i, j, distance
+
+
+def find_cross_pairs_bruteforce(queries, packed, threshold):
+    """
+    Finds every pair of a query hash and a hash in `packed` within
+    `threshold` bits of each other, a block of queries at a time.
+
+    Args:
+        queries (numpy.ndarray): Packed hashes of shape (m, words).
+        packed (numpy.ndarray): Packed hashes of shape (n, words).
+        threshold (int): The maximum Hamming distance.
+
+    Yields:
+        tuple: (i, j, distance) with i indexing into queries and j into packed.
+    """
+    count, words = packed.shape
+    block_rows = max(1, _BLOCK_WORDS // max(1, count * words))
+
+    for start in range(0, len(queries), block_rows):
+        distances = hamming_distances(packed, queries[start:start + block_rows])
+        rows, cols = np.divmod(np.flatnonzero(distances <= threshold), count)
+        found = distances[rows, cols]
+        for i, j, distance in zip((rows + start).tolist(), cols.tolist(), found.tolist()):
+            yield i, j, distance
@@ -0,0 +1,112 @@
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Default upper bound on the bytes read ahead and not yet decoded.
+DEFAULT_READ_AHEAD_BYTES = 64 * 1024 * 1024
+
+
+def read_file_bytes(file_path):
+    """
+    Reads a whole file into memory.
+    """
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+class ThrottledReader:
+    """
+    A stand-in for read_file_bytes that simulates a slow (e.g. network)
+    filesystem: every read takes at least `latency` seconds, plus the time its
+    data would take at `bandwidth` bytes per second. Reads on different threads
+    are delayed independently, as they are on a real network mount.
+    """
+
+    def __init__(self, latency=0.02, bandwidth=None, read_file=read_file_bytes):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.read_file = read_file
+
+    def __call__(self, file_path):
+        start = time.perf_counter()
+        data = self.read_file(file_path)
+        delay = self.latency + (len(data) / float(self.bandwidth) if self.bandwidth else 0.0)
+        remaining = delay - (time.perf_counter() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+        return data
+
+
+class ReadAhead:
+    """
+    Reads files on a pool of I/O threads ahead of the code that decodes them,
+    so that slow storage and the CPU are busy at the same time.
+
+    Reads are started in order as files arrive, for as long as the files read
+    but not yet handed on fit in the byte budget (a file larger than the
+    budget is still read, on its own).
+    """
+
+    def __init__(self, threads=4, byte_budget=DEFAULT_READ_AHEAD_BYTES, read_file=None):
+        self.threads = max(1, threads)
+        self.byte_budget = byte_budget
+        self.read_file = read_file or read_file_bytes
+
+    def iter_contents(self, entries, metrics=None):
+        """
+        Reads the content of a stream of files ahead of time.
+
+        Args:
+            entries (iterable): FileEntry objects.
+            metrics (Metrics): Optional metrics that receive the number of
+                               bytes read ahead.
+
+        Yields:
+            tuple: (entry, data) for every entry, in order. data is None if
+                   the file could not be read; the decoder then opens the file
+                   itself and reports the error.
+        """
+        in_flight = deque()
+        buffered = 0
+
+        def take_oldest():
+            nonlocal buffered
+            entry, future = in_flight.popleft()
+            buffered -= max(entry.size, 0)
+            try:
+                data = future.result()
+            except OSError as e:
+                logger.debug(f"Could not read {entry.path} ahead: {e}")
+                return entry, None
+            if metrics is not None:
+                metrics.count('bytes_read_ahead_total', len(data))
+            return entry, data
+
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            for entry in entries:
+                while in_flight and buffered + max(entry.size, 0) > self.byte_budget:
+                    yield take_oldest()
+                in_flight.append((entry, executor.submit(self.read_file, entry.path)))
+                buffered += max(entry.size, 0)
+            while in_flight:
+                yield take_oldest()
+        finally:
+            # Reads not started yet are dropped if the consumer stops early.
+            for _, future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+def read_ahead_for(var):
+    """
+    Returns:
+        ReadAhead or None: The read-ahead stage configured on a Variables
+                           object, or None if read-ahead is disabled.
+    """
+    if not var.read_ahead_threads:
+        return None
+    return ReadAhead(var.read_ahead_threads, var.read_ahead_bytes, var.read_file)
@@ -0,0 +1,126 @@
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from each end of a file for the partial hash.
+PARTIAL_HASH_BYTES = 4096
+
+_READ_CHUNK = 1 << 20
+
+
+class ContentGroup:
+    """
+    A set of byte-identical files, represented by the first one seen. Digests
+    are computed lazily, only once another file of the same size turns up.
+
+    The perceptual hash of the representative (or the error raised while
+    computing it) is recorded on the group, so copies found later can reuse
+    it without being decoded.
+    """
+
+    __slots__ = ('path', 'size', 'partial', 'full', 'image_hash', 'error')
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.partial = None
+        self.full = None
+        self.image_hash = None
+        self.error = None
+
+
+class ExactDuplicateFilter:
+    """
+    Detects byte-identical files without decoding them.
+
+    Files are compared in three increasingly expensive stages: by size, then
+    by a hash of their first and last few KB, and finally by a hash of their
+    whole content. Each stage only runs for files that matched the previous
+    one, so most files are never read at all.
+
+    The filter is incremental: add() is called for every file as it is
+    found, and returns the content group the file belongs to. A file that
+    starts a new group becomes its representative.
+
+    Groups are looked up by size, then partial digest, then full digest,
+    in nested dictionaries. A key seen only once maps directly to its group,
+    and is only split by the next digest when a second file shares it, so a
+    file with a unique size is never read and a new file is only compared
+    against the groups sharing its digests.
+    """
+
+    def __init__(self, partial_bytes=PARTIAL_HASH_BYTES):
+        self.partial_bytes = partial_bytes
+        self._by_size = {}
+        self.duplicates_found = 0
+
+    def add(self, file_path, size):
+        """
+        Registers a file.
+
+        Args:
+            file_path (str): The file to register.
+            size (int): The file size in bytes.
+
+        Returns:
+            ContentGroup: The group of byte-identical files. Its path is
+                          file_path itself if no earlier file had this content.
+        """
+        candidate = ContentGroup(file_path, size)
+        try:
+            group = self._insert(self._by_size, size, candidate, (self._partial_digest, self._full_digest))
+        except OSError as e:
+            # Unreadable files are left for the hashing stage to report.
+            logger.debug(f"Could not compare {file_path} byte-for-byte: {e}")
+            return candidate
+
+        if group is not candidate:
+            self.duplicates_found += 1
+        return group
+
+    def _insert(self, table, key, candidate, digests):
+        # table maps key to the only group with that key so far, or, once a
+        # second file shares it, to a table keyed by the next digest.
+        existing = table.get(key)
+        if existing is None:
+            table[key] = candidate
+            return candidate
+        if not digests:
+            # Every digest matched.
+            return existing
+
+        digest = digests[0]
+        if isinstance(existing, ContentGroup):
+            try:
+                existing_digest = digest(existing)
+            except OSError as e:
+                # The earlier file is gone; the new one takes its place.
+                logger.debug(f"Could not compare {existing.path} byte-for-byte: {e}")
+                table[key] = candidate
+                return candidate
+            existing = table[key] = {existing_digest: existing}
+        return self._insert(existing, digest(candidate), candidate, digests[1:])
+
+    def _partial_digest(self, entry):
+        if entry.partial is None:
+            with open(entry.path, 'rb') as f:
+                digest = hashlib.blake2b(f.read(self.partial_bytes), digest_size=16)
+                if entry.size > self.partial_bytes:
+                    f.seek(max(self.partial_bytes, entry.size - self.partial_bytes))
+                    digest.update(f.read(self.partial_bytes))
+            entry.partial = digest.digest()
+        return entry.partial
+
+    def _full_digest(self, entry):
+        if entry.full is None:
+            if entry.size <= 2 * self.partial_bytes:
+                # The partial hash already covered the whole file.
+                entry.full = self._partial_digest(entry)
+            else:
+                digest = hashlib.blake2b(digest_size=16)
+                with open(entry.path, 'rb') as f:
+                    for block in iter(lambda: f.read(_READ_CHUNK), b''):
+                        digest.update(block)
+                entry.full = digest.digest()
+        return entry.full
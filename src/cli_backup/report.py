@@ -0,0 +1,144 @@
+import csv
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The formats a report can be written in.
+REPORT_FORMATS = ('jsonl', 'csv')
+
+# Reports are written through a large buffer rather than line by line.
+_BUFFER_BYTES = 1 << 20
+
+CSV_COLUMNS = ('group', 'path', 'role', 'kept', 'hash', 'distance', 'size')
+
+
+def report_format_for(output_path, report_format=None):
+    """
+    Returns:
+        str: The requested report format, or the one implied by the extension
+             of output_path ('csv' for .csv files, 'jsonl' otherwise).
+    """
+    if report_format:
+        return report_format
+    return 'csv' if output_path.lower().endswith('.csv') else 'jsonl'
+
+
+def _hash_distance(hash1, hash2):
+    if hash1 is None or hash2 is None:
+        return None
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count('1')
+
+
+def _member_details(duplicate_groups, group_index, group):
+    """
+    Returns:
+        dict: (hash, size) of every file of a group, keyed by path. Hashes
+              are only known when the groups come from an ImageStore; sizes
+              are read from the filesystem (or archive) when the scan did not record them.
+    """
+    from cli_backup.archives import file_size
+    from cli_backup.store import DuplicateGroups
+
+    details = {}
+    if isinstance(duplicate_groups, DuplicateGroups):
+        store = duplicate_groups.store
+        for file_id in duplicate_groups.file_ids(group_index).tolist():
+            size = store.sizes[file_id]
+            details[store.paths[file_id]] = (store.hash_hex(store.hash_ids[file_id]), size if size >= 0 else None)
+    for file_path in group:
+        if file_path not in details or details[file_path][1] is None:
+            image_hash = details.get(file_path, (None, None))[0]
+            try:
+                details[file_path] = (image_hash, file_size(file_path))
+            except OSError:
+                details[file_path] = (image_hash, None)
+    return details
+
+
+class ReportWriter:
+    """
+    Streams duplicate groups to a JSON lines or CSV report, for other tools
+    to parse and act on.
+
+    In JSON lines, every group is one object: {"group": id, "kept": path,
+    "members": [{"path", "hash", "distance", "size"}, ...]}, the kept file
+    first. In CSV, every file is one row with the columns in CSV_COLUMNS. The
+    distance of a file is the Hamming distance between its hash and the hash
+    of the kept file; hash and distance are empty when the hashes are not
+    known. Orientation-invariant scans compare the hashes of the unrotated
+    images here, so rotated copies show large distances.
+    """
+
+    def __init__(self, output_path, report_format=None):
+        self.output_path = output_path
+        self.report_format = report_format_for(output_path, report_format)
+        self.groups = 0
+        self._file = open(output_path, 'w', encoding='utf-8', newline='', buffering=_BUFFER_BYTES)
+        self._csv = None
+        if self.report_format == 'csv':
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(CSV_COLUMNS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write_group(self, group_id, kept, duplicates, details):
+        """
+        Writes one group.
+
+        Args:
+            group_id (int): The index of the group.
+            kept (str): The file that is kept.
+            duplicates (list): The other files of the group.
+            details (dict): (hash, size) of every file, keyed by path.
+        """
+        kept_hash = details[kept][0]
+        members = []
+        for file_path in [kept] + list(duplicates):
+            image_hash, size = details[file_path]
+            members.append((file_path, image_hash, _hash_distance(image_hash, kept_hash), size))
+
+        if self._csv is not None:
+            self._csv.writerows(
+                (group_id, file_path, 'kept' if file_path == kept else 'duplicate', kept, image_hash, distance, size)
+                for file_path, image_hash, distance, size in members
+            )
+        else:
+            item = {
+                'group': group_id,
+                'kept': kept,
+                'members': [
+                    {'path': file_path, 'hash': image_hash, 'distance': distance, 'size': size}
+                    for file_path, image_hash, distance, size in members
+                ],
+            }
+            self._file.write(json.dumps(item, separators=(',', ':')) + '\n')
+        self.groups += 1
+
+    def close(self):
+        self._file.close()
+
+
+def write_report(var, deletion_plan):
+    """
+    Writes the duplicate groups and the file kept in each one to the report
+    at var.output_path, one group at a time.
+
+    Args:
+        var (Variables): The variables object with the duplicate groups and
+                         the report settings (output_path, output_format).
+        deletion_plan (list): (kept, duplicates) for every group, in order.
+
+    Returns:
+        int: The number of groups written.
+    """
+    with ReportWriter(var.output_path, var.output_format) as report:
+        for group_index, (kept, duplicates) in enumerate(deletion_plan):
+            group = [kept] + list(duplicates)
+            report.write_group(group_index, kept, duplicates, _member_details(var.duplicate_groups, group_index, group))
+    logger.info(f"Wrote {report.groups} groups to the {report.report_format} report {var.output_path}")
+    return report.groups
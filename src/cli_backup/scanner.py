@@ -0,0 +1,66 @@
+import os
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+# A discovered image file, with the stat info the later stages need.
+FileEntry = namedtuple('FileEntry', ['path', 'size', 'mtime_ns'])
+
+
+def iter_image_files(root_directory, extensions=IMAGE_EXTENSIONS, on_directory=None, include_directory=None):
+    """
+    Lazily walks a directory tree with os.scandir and yields every image file
+    as soon as it is found. Symbolic links to files are not yielded.
+
+    Only the stack of directories still to visit is kept in memory, and the
+    stat info comes from the DirEntry, which is cached by scandir (and free on
+    Windows, where it comes with the directory listing).
+
+    Args:
+        root_directory (str): The directory to walk.
+        extensions (tuple): Lower-case file extensions to yield.
+        on_directory (callable): Optional callback invoked with the path of
+                                 every directory before it is listed.
+        include_directory (callable): Optional predicate; subdirectories for
+                                      which it returns False are skipped
+                                      without being listed.
+
+    Yields:
+        FileEntry: One entry per image file.
+    """
+    pending = [root_directory]
+    while pending:
+        directory = pending.pop()
+        if on_directory is not None:
+            on_directory(directory)
+        try:
+            with os.scandir(directory) as it:
+                subdirectories = []
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if include_directory is None or include_directory(entry.path):
+                                subdirectories.append(entry.path)
+                            continue
+
+                        # Check if the file is an image based on its extension.
+                        # Symbolic links are skipped, so that a link is never
+                        # kept in place of the file it points to.
+                        if not entry.name.lower().endswith(extensions) or entry.is_symlink() or not entry.is_file():
+                            continue
+
+                        stat = entry.stat()
+                    except OSError as e:
+                        logger.error(f"Could not process file {entry.path}: {e}")
+                        continue
+
+                    yield FileEntry(entry.path, stat.st_size, stat.st_mtime_ns)
+        except OSError as e:
+            logger.error(f"Could not scan directory {directory}: {e}")
+            continue
+
+        # Visit subdirectories in listing order.
+        pending.extend(reversed(subdirectories))
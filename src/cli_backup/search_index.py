@@ -0,0 +1,763 @@
+import itertools
+from collections import defaultdict
+
+import numpy as np
+
+from cli_backup.packed import find_cross_pairs_bruteforce, find_pairs_bruteforce, pack_hashes, unpack_to_ints
+from cli_backup.store import ImageStore
+
+# A single vectorized all-pairs comparison costs roughly this many times less
+# than one probe of the multi-index search in Python.
+BRUTE_FORCE_COST_RATIO = 150
+
+# Library size assumed when hashes are indexed as they stream in and the final
+# count is not known yet.
+STREAMING_EXPECTED_ITEMS = 100000
+
+# Pairs a ThresholdSweep packs into each array as they are found.
+SWEEP_CHUNK_PAIRS = 1 << 16
+
+try:
+    popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def popcount(value):
+        return bin(value).count('1')
+
+
+def hex_to_int(hex_hash):
+    """
+    Converts a hexadecimal hash string (as produced by imagehash) to an int.
+    """
+    return int(hex_hash, 16)
+
+
+def hamming_distance(hash1, hash2):
+    """
+    Returns the number of differing bits between two integer hashes.
+    """
+    return popcount(hash1 ^ hash2)
+
+
+class UnionFind:
+    """
+    A disjoint-set forest with path compression and union by size, used to
+    merge matching hashes into transitive duplicate groups.
+    """
+
+    def __init__(self, size=0):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def add(self):
+        """
+        Adds a new singleton set and returns its id.
+        """
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, item1, item2):
+        """
+        Merges the sets containing item1 and item2.
+
+        Returns:
+            bool: True if the two items were in different sets.
+        """
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 == root2:
+            return False
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+        return True
+
+    def labels(self):
+        """
+        Returns:
+            list: The root of every item's set, usable as a group label.
+        """
+        return [self.find(item) for item in range(len(self.parent))]
+
+    def components(self):
+        """
+        Returns:
+            list: The sets as lists of ids, ordered by their smallest member.
+        """
+        components = {}
+        for item in range(len(self.parent)):
+            components.setdefault(self.find(item), []).append(item)
+        return list(components.values())
+
+
+def choose_chunk_count(num_bits, radius, expected_items):
+    """
+    Picks the number of substrings to split hashes into. More substrings mean
+    fewer neighbouring keys to probe per substring, but fuller buckets and more
+    candidates to verify; the cheapest combination is chosen.
+
+    Returns:
+        tuple: (chunks, cost), where cost estimates the number of bucket probes
+               and candidate checks performed by a single query.
+    """
+    best_chunks, best_cost = 1, None
+    for chunks in range(1, min(num_bits, radius + 1) + 1):
+        chunk_bits = num_bits // chunks
+        chunk_radius = radius // chunks
+        probes = sum(_binomial(chunk_bits, i) for i in range(chunk_radius + 1))
+        cost = chunks * probes * (1 + expected_items / float(2 ** chunk_bits))
+        if best_cost is None or cost < best_cost:
+            best_chunks, best_cost = chunks, cost
+    return best_chunks, best_cost
+
+
+def _binomial(n, k):
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+
+class MultiIndexHash:
+    """
+    A multi-index hashing structure for Hamming-space range queries.
+
+    Each hash is split into m disjoint bit substrings and every substring is
+    indexed in its own table. By the pigeonhole principle, two hashes within
+    distance `radius` must agree to within floor(radius / m) bits on at least
+    one substring, so a query only needs to probe the buckets near each of its
+    own substrings instead of comparing against every stored hash.
+    """
+
+    def __init__(self, num_bits, radius, expected_items=0):
+        self.num_bits = num_bits
+        self.radius = radius
+
+        chunks, _ = choose_chunk_count(num_bits, radius, expected_items)
+        self.chunk_radius = radius // chunks
+
+        # (shift, mask, flip masks) for every substring.
+        self._chunks = []
+        base_bits, extra = divmod(num_bits, chunks)
+        shift = 0
+        for i in range(chunks):
+            bits = base_bits + (1 if i < extra else 0)
+            flips = [
+                sum(1 << bit for bit in combination)
+                for distance in range(self.chunk_radius + 1)
+                for combination in itertools.combinations(range(bits), distance)
+            ]
+            self._chunks.append((shift, (1 << bits) - 1, flips))
+            shift += bits
+
+        self._tables = [{} for _ in self._chunks]
+        self._hashes = {}
+        # Number of hash comparisons performed by queries so far.
+        self.comparisons = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, key):
+        return key in self._hashes
+
+    def add(self, key, hash_value):
+        """
+        Indexes hash_value under key. Keys must be unique.
+        """
+        self._hashes[key] = hash_value
+        for table, (shift, mask, _) in zip(self._tables, self._chunks):
+            table.setdefault((hash_value >> shift) & mask, []).append(key)
+
+    def remove(self, key):
+        """
+        Removes a previously added key from the index.
+        """
+        hash_value = self._hashes.pop(key)
+        for table, (shift, mask, _) in zip(self._tables, self._chunks):
+            chunk = (hash_value >> shift) & mask
+            bucket = table[chunk]
+            bucket.remove(key)
+            if not bucket:
+                del table[chunk]
+
+    def query(self, hash_value, radius=None):
+        """
+        Finds all indexed keys within `radius` bits of hash_value.
+
+        Args:
+            hash_value (int): The hash to search for.
+            radius (int): The search radius. Must not exceed the radius the
+                          index was built for. Defaults to that radius.
+
+        Returns:
+            list: (key, distance) tuples.
+        """
+        if radius is None:
+            radius = self.radius
+        elif radius > self.radius:
+            raise ValueError(f"Query radius {radius} exceeds index radius {self.radius}")
+
+        hashes = self._hashes
+        matches = {}
+        for table, (shift, mask, flips) in zip(self._tables, self._chunks):
+            chunk = (hash_value >> shift) & mask
+            for flip in flips:
+                bucket = table.get(chunk ^ flip)
+                if bucket is None:
+                    continue
+                self.comparisons += len(bucket)
+                for key in bucket:
+                    distance = popcount(hash_value ^ hashes[key])
+                    if distance <= radius:
+                        matches[key] = distance
+        return list(matches.items())
+
+
+def find_candidate_pairs(hash_values, num_bits, threshold, metrics=None):
+    """
+    Finds every pair of hashes within `threshold` bits of each other.
+
+    Args:
+        hash_values (list): Integer hashes.
+        num_bits (int): The number of bits in each hash.
+        threshold (int): The maximum Hamming distance.
+        metrics (Metrics): Optional metrics that receive the number of hash
+                           comparisons once the search is complete.
+
+    Yields:
+        tuple: (i, j, distance) with i < j indexing into hash_values.
+    """
+    index = MultiIndexHash(num_bits, threshold, expected_items=len(hash_values))
+    for j, hash_value in enumerate(hash_values):
+        for i, distance in index.query(hash_value):
+            yield i, j, distance
+        index.add(j, hash_value)
+    if metrics is not None:
+        metrics.count('comparisons_total', index.comparisons)
+
+
+def use_bruteforce(num_bits, threshold, expected_items):
+    """
+    Decides whether comparing all pairs with the vectorized kernel is cheaper
+    than a multi-index search. The index only pays off when a query probes far
+    fewer entries than there are hashes, i.e. for narrow thresholds.
+    """
+    _, query_cost = choose_chunk_count(num_bits, threshold, expected_items)
+    return expected_items <= query_cost * BRUTE_FORCE_COST_RATIO
+
+
+def _count_bruteforce(metrics, num_hashes):
+    if metrics is not None:
+        metrics.count('comparisons_total', num_hashes * (num_hashes - 1) // 2)
+
+
+def find_similar_pairs(hex_hashes, threshold, metrics=None):
+    """
+    Finds every pair of hexadecimal hashes within `threshold` bits of each
+    other, using whichever of the multi-index search and the vectorized
+    all-pairs kernel is expected to be faster.
+
+    Yields:
+        tuple: (i, j, distance) with i < j indexing into hex_hashes.
+    """
+    if not hex_hashes:
+        return iter(())
+
+    num_bits = max(len(img_hash) for img_hash in hex_hashes) * 4
+    if use_bruteforce(num_bits, threshold, len(hex_hashes)):
+        _count_bruteforce(metrics, len(hex_hashes))
+        return find_pairs_bruteforce(pack_hashes(hex_hashes, num_bits), threshold)
+    return find_candidate_pairs([hex_to_int(h) for h in hex_hashes], num_bits, threshold, metrics)
+
+
+def find_similar_packed_pairs(packed, num_bits, threshold, metrics=None):
+    """
+    Same as find_similar_pairs, for hashes that are already packed into
+    64-bit words.
+
+    Yields:
+        tuple: (i, j, distance) with i < j indexing into the rows of packed.
+    """
+    if use_bruteforce(num_bits, threshold, len(packed)):
+        _count_bruteforce(metrics, len(packed))
+        return find_pairs_bruteforce(packed, threshold)
+    return find_candidate_pairs(unpack_to_ints(packed), num_bits, threshold, metrics)
+
+
+def find_variant_pairs(packed, packed_variants, num_bits, threshold, metrics=None):
+    """
+    Finds every pair of distinct hashes where a dihedral variant of one is
+    within `threshold` bits of the other, i.e. images that match once one of
+    them is rotated or mirrored. Both images are tried in both roles, so the
+    result does not depend on which one was rotated.
+
+    Args:
+        packed (numpy.ndarray): Packed hashes of shape (n, words).
+        packed_variants (numpy.ndarray): Their variants, of shape
+                                         (n, variants, words).
+        num_bits (int): The number of bits in each hash.
+        threshold (int): The maximum Hamming distance.
+        metrics (Metrics): Optional metrics that receive the number of hash
+                           comparisons.
+
+    Yields:
+        tuple: (i, j, distance) with i != j indexing into packed; the same
+               pair may be yielded more than once.
+    """
+    count, num_variants = packed_variants.shape[:2]
+    if not count or not num_variants:
+        return
+
+    if use_bruteforce(num_bits, threshold, count):
+        if metrics is not None:
+            metrics.count('comparisons_total', count * count * num_variants)
+        queries = packed_variants.reshape(count * num_variants, -1)
+        for query, j, distance in find_cross_pairs_bruteforce(queries, packed, threshold):
+            i = query // num_variants
+            if i != j:
+                yield i, j, distance
+        return
+
+    index = MultiIndexHash(num_bits, threshold, expected_items=count)
+    for j, hash_value in enumerate(unpack_to_ints(packed)):
+        index.add(j, hash_value)
+    variant_values = unpack_to_ints(packed_variants.reshape(count * num_variants, -1))
+    for query, hash_value in enumerate(variant_values):
+        i = query // num_variants
+        for j, distance in index.query(hash_value):
+            if i != j:
+                yield i, j, distance
+    if metrics is not None:
+        metrics.count('comparisons_total', index.comparisons)
+
+
+def group_paths(components, hex_hashes, hashes_map):
+    """
+    Expands components of hash ids into sorted groups of file paths, dropping
+    groups that hold a single file.
+
+    Returns:
+        list: Groups of file paths, ordered by their first path.
+    """
+    duplicate_groups = []
+    for component in components:
+        group = sorted(path for i in component for path in hashes_map[hex_hashes[i]])
+        if len(group) > 1:
+            duplicate_groups.append(group)
+
+    duplicate_groups.sort(key=lambda group: group[0])
+    return duplicate_groups
+
+
+class DuplicateIndex:
+    """
+    Groups images incrementally as their hashes arrive.
+
+    Files are recorded in a compact ImageStore. Each new distinct hash is
+    matched against the hashes already indexed and merged into their groups
+    right away, so the duplicate groups are ready as soon as the scan
+    finishes. When the threshold is too wide for the multi-index search to
+    prune much, hashes are only collected and matched with the vectorized
+    all-pairs kernel when the groups are requested.
+
+    If files are added with the dihedral variants of their hash, images also
+    match when a variant of one is within the threshold of the other, so
+    rotated and mirrored copies are grouped with the original.
+
+    Attributes:
+        store (ImageStore): The paths, sizes and hashes of every added file.
+    """
+
+    def __init__(self, threshold, expected_items=STREAMING_EXPECTED_ITEMS):
+        self.threshold = threshold
+        self.expected_items = expected_items
+        self.store = ImageStore()
+
+        self._groups = UnionFind()
+        self._index = None
+        self._variant_index = None
+        self._streaming = None
+
+    @property
+    def hashes_map(self):
+        """
+        The indexed files as a {hash: [paths]} dictionary, built on demand.
+        """
+        return self.store.hashes_map()
+
+    def add(self, image_hash, file_path, size=-1, variants=None):
+        """
+        Adds one hashed file to the index, optionally with the hashes of the
+        other dihedral variants of the image.
+        """
+        hash_id, is_new = self.store.add(image_hash, file_path, size, variants)
+        if not is_new:
+            # Already indexed under this exact hash.
+            return
+
+        if self._streaming is None:
+            num_bits = self.store.num_bits
+            self._streaming = not use_bruteforce(num_bits, self.threshold, self.expected_items)
+            if self._streaming:
+                self._index = MultiIndexHash(num_bits, self.threshold, self.expected_items)
+        if not self._streaming:
+            return
+
+        self._groups.add()
+        hash_value = hex_to_int(image_hash)
+        for match_id, _ in self._index.query(hash_value):
+            self._groups.union(hash_id, match_id)
+
+        if variants:
+            # Matches in both directions: variants of this image against
+            # earlier hashes, and this hash against their variants.
+            if self._variant_index is None:
+                self._variant_index = MultiIndexHash(
+                    self.store.num_bits, self.threshold, self.expected_items * len(variants)
+                )
+            for variant in variants:
+                for match_id, _ in self._index.query(hex_to_int(variant)):
+                    self._groups.union(hash_id, match_id)
+            for (match_id, _), _ in self._variant_index.query(hash_value):
+                self._groups.union(hash_id, match_id)
+            for k, variant in enumerate(variants):
+                self._variant_index.add((hash_id, k), hex_to_int(variant))
+
+        self._index.add(hash_id, hash_value)
+
+    def groups(self, metrics=None):
+        """
+        Args:
+            metrics (Metrics): Optional metrics that receive the number of hash
+                               comparisons performed.
+
+        Returns:
+            DuplicateGroups: The current duplicate groups. They can be used
+                             like the list returned by find_duplicates.
+        """
+        if not self._streaming and self.store.num_hashes:
+            self._groups = UnionFind(self.store.num_hashes)
+            packed = self.store.packed_hashes()
+            for i, j, _ in find_similar_packed_pairs(packed, self.store.num_bits, self.threshold, metrics):
+                self._groups.union(i, j)
+            if self.store.num_variants:
+                packed_variants = self.store.packed_variants()
+                for i, j, _ in find_variant_pairs(packed, packed_variants, self.store.num_bits, self.threshold, metrics):
+                    self._groups.union(i, j)
+        elif self._streaming and metrics is not None:
+            metrics.count('comparisons_total', self._index.comparisons)
+            if self._variant_index is not None:
+                metrics.count('comparisons_total', self._variant_index.comparisons)
+
+        return self.store.build_groups(np.array(self._groups.labels(), dtype=np.int64))
+
+
+def _pair_chunks(pairs):
+    # Packs a stream of (i, j, distance) tuples into arrays of at most
+    # SWEEP_CHUNK_PAIRS rows, so they are never all held as tuples.
+    values = itertools.chain.from_iterable(pairs)
+    while True:
+        chunk = np.fromiter(itertools.islice(values, 3 * SWEEP_CHUNK_PAIRS), dtype=np.int64)
+        if not len(chunk):
+            return
+        yield chunk.reshape(-1, 3)
+
+
+class ThresholdSweep:
+    """
+    Regroups the hashes of a finished scan at any threshold up to
+    max_threshold, without hashing or searching again.
+
+    Every pair of distinct hashes within max_threshold (including pairs that
+    match through a dihedral variant) is found once, and the pairs are
+    sorted by distance. Grouping at a threshold replays the pairs up to it
+    through a union-find: raising the threshold continues from the last
+    replay and lowering it starts over, which takes milliseconds either way.
+
+    The number of pairs grows quickly with max_threshold, so it should stay
+    close to the thresholds of interest. Pairs are packed into NumPy arrays
+    as they are found, at 24 bytes each.
+
+    Attributes:
+        store (ImageStore): The scanned files and their hashes.
+        max_threshold (int): The widest threshold the groups can be made at.
+    """
+
+    def __init__(self, store, max_threshold, metrics=None):
+        self.store = store
+        self.max_threshold = max_threshold
+
+        chunks = [np.empty((0, 3), dtype=np.int64)]
+        if store.num_hashes:
+            packed = store.packed_hashes()
+            chunks.extend(_pair_chunks(find_similar_packed_pairs(packed, store.num_bits, max_threshold, metrics)))
+            if store.num_variants:
+                packed_variants = store.packed_variants()
+                chunks.extend(_pair_chunks(
+                    find_variant_pairs(packed, packed_variants, store.num_bits, max_threshold, metrics)
+                ))
+        pairs = np.concatenate(chunks)
+        del chunks
+        order = np.argsort(pairs[:, 2], kind='stable')
+        self._first = pairs[order, 0]
+        self._second = pairs[order, 1]
+        # The number of pairs within each threshold.
+        self._ends = np.searchsorted(pairs[order, 2], np.arange(max_threshold + 1), side='right').tolist()
+
+        self._hash_ids = np.array(store.hash_ids, dtype=np.int64)
+        self._groups = UnionFind(store.num_hashes)
+        self._replayed = 0
+
+    def __len__(self):
+        return len(self._first)
+
+    def _replay(self, threshold):
+        """
+        Returns:
+            numpy.ndarray: A group label for every hash id at threshold.
+        """
+        if not 0 <= threshold <= self.max_threshold:
+            raise ValueError(f"Threshold {threshold} is outside the sweep range 0 to {self.max_threshold}")
+
+        end = self._ends[threshold]
+        if end < self._replayed:
+            self._groups = UnionFind(self.store.num_hashes)
+            self._replayed = 0
+        union = self._groups.union
+        for i, j in zip(self._first[self._replayed:end].tolist(), self._second[self._replayed:end].tolist()):
+            union(i, j)
+        self._replayed = end
+        return np.array(self._groups.labels(), dtype=np.int64)
+
+    def groups(self, threshold):
+        """
+        Returns:
+            DuplicateGroups: The duplicate groups at threshold, the same as a
+                             DuplicateIndex with that threshold would find.
+        """
+        return self.store.build_groups(self._replay(threshold))
+
+    def counts(self, threshold):
+        """
+        Counts the groups at threshold without building them.
+
+        Returns:
+            tuple: (number of groups, number of duplicates), where the
+                   duplicates are the files that are not the first of their
+                   group.
+        """
+        labels = self._replay(threshold)
+        if not len(self._hash_ids):
+            return 0, 0
+        sizes = np.bincount(labels[self._hash_ids])
+        sizes = sizes[sizes > 1]
+        return len(sizes), int(sizes.sum()) - len(sizes)
+
+
+class LiveDuplicateIndex:
+    """
+    A duplicate index that supports both adding and removing files, for
+    long-running processes that keep their groups up to date as files change.
+
+    Groups are tracked explicitly as connected components of the "within
+    threshold" graph over distinct hashes. Adding a hash merges the
+    components of its matches; removing one re-splits only the component it
+    belonged to.
+
+    Attributes:
+        hashes_map (dict): Image hashes mapped to the file paths sharing them.
+        num_groups (int): The number of duplicate groups, kept up to date
+                          with the number of files in every component, so
+                          it can be read without building the groups.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.hashes_map = defaultdict(list)
+        self.num_groups = 0
+
+        self._ids = {}
+        self._hashes = {}
+        self._values = {}
+        self._component = {}
+        self._members = {}
+        self._files = {}
+        self._next_id = 0
+        self._index = None
+
+    def load(self, hashes_map):
+        """
+        Bulk-loads a complete hash map, e.g. from an initial scan. The groups
+        are computed in one pass, using the vectorized kernel if that is
+        faster, and the hashes are then indexed for later updates.
+        """
+        all_hashes = sorted(hashes_map)
+        if not all_hashes:
+            return
+
+        groups = UnionFind(len(all_hashes))
+        for i, j, _ in find_similar_pairs(all_hashes, self.threshold):
+            groups.union(i, j)
+
+        self._ensure_index(all_hashes[0], len(all_hashes))
+        ids = [self._register(image_hash) for image_hash in all_hashes]
+        for image_hash in all_hashes:
+            self.hashes_map[image_hash].extend(hashes_map[image_hash])
+
+        for component in groups.components():
+            members = {ids[i] for i in component}
+            key = ids[component[0]]
+            self._members[key] = members
+            for hash_id in members:
+                self._component[hash_id] = key
+            self._set_files(key, sum(len(hashes_map[all_hashes[i]]) for i in component))
+
+    def add(self, image_hash, file_path):
+        """
+        Adds one hashed file and merges it into the groups it matches.
+        """
+        paths = self.hashes_map[image_hash]
+        paths.append(file_path)
+        if len(paths) > 1:
+            key = self._component[self._ids[image_hash]]
+            self._set_files(key, self._pop_files(key) + 1)
+            return
+
+        self._ensure_index(image_hash, STREAMING_EXPECTED_ITEMS)
+        matches = self._index.query(hex_to_int(image_hash))
+        hash_id = self._register(image_hash)
+
+        # Merge every matching component into the largest one.
+        components = {self._component[match_id] for match_id, _ in matches}
+        if not components:
+            self._members[hash_id] = {hash_id}
+            self._component[hash_id] = hash_id
+            self._set_files(hash_id, 1)
+            return
+
+        key = max(components, key=lambda c: len(self._members[c]))
+        members = self._members[key]
+        files = sum(self._pop_files(component) for component in components) + 1
+        for other in components - {key}:
+            for member in self._members.pop(other):
+                self._component[member] = key
+                members.add(member)
+        members.add(hash_id)
+        self._component[hash_id] = key
+        self._set_files(key, files)
+
+    def remove(self, image_hash, file_path):
+        """
+        Removes one file. If it was the last file with its hash, the hash is
+        dropped from the index and its former group is split as needed.
+        """
+        paths = self.hashes_map.get(image_hash)
+        if not paths or file_path not in paths:
+            return
+        paths.remove(file_path)
+        if paths:
+            key = self._component[self._ids[image_hash]]
+            self._set_files(key, self._pop_files(key) - 1)
+            return
+
+        del self.hashes_map[image_hash]
+        hash_id = self._ids.pop(image_hash)
+        del self._hashes[hash_id]
+        del self._values[hash_id]
+        self._index.remove(hash_id)
+
+        key = self._component.pop(hash_id)
+        self._pop_files(key)
+        remaining = self._members.pop(key)
+        remaining.discard(hash_id)
+
+        # Rebuild the connected components of what is left of the group.
+        while remaining:
+            start = remaining.pop()
+            members = {start}
+            stack = [start]
+            while stack:
+                current = stack.pop()
+                for match_id, _ in self._index.query(self._values[current]):
+                    if match_id in remaining:
+                        remaining.remove(match_id)
+                        members.add(match_id)
+                        stack.append(match_id)
+            self._members[start] = members
+            for member in members:
+                self._component[member] = start
+            self._set_files(start, sum(len(self.hashes_map[self._hashes[member]]) for member in members))
+
+    def query(self, image_hash, radius=None):
+        """
+        Finds the indexed files whose hash is within `radius` bits (at most
+        the threshold, which is the default) of image_hash, without adding it.
+
+        Returns:
+            list: (file_path, distance) tuples, closest first.
+        """
+        if self._index is None:
+            return []
+        matches = [
+            (file_path, distance)
+            for hash_id, distance in self._index.query(hex_to_int(image_hash), radius)
+            for file_path in self.hashes_map[self._hashes[hash_id]]
+        ]
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+    def group_of(self, image_hash):
+        """
+        Returns:
+            list: The sorted file paths in the same group as image_hash.
+        """
+        hash_id = self._ids.get(image_hash)
+        if hash_id is None:
+            return []
+        members = self._members[self._component[hash_id]]
+        return sorted(path for member in members for path in self.hashes_map[self._hashes[member]])
+
+    def groups(self):
+        """
+        Returns:
+            list: The current duplicate groups, in the same format as
+                  find_duplicates.
+        """
+        return group_paths(self._members.values(), self._hashes, self.hashes_map)
+
+    def _set_files(self, key, count):
+        # Records the number of files in a component, which is a group if it
+        # holds more than one.
+        self._files[key] = count
+        if count > 1:
+            self.num_groups += 1
+
+    def _pop_files(self, key):
+        count = self._files.pop(key)
+        if count > 1:
+            self.num_groups -= 1
+        return count
+
+    def _ensure_index(self, image_hash, expected_items):
+        if self._index is None:
+            self._index = MultiIndexHash(len(image_hash) * 4, self.threshold, expected_items)
+
+    def _register(self, image_hash):
+        hash_id = self._next_id
+        self._next_id += 1
+        hash_value = hex_to_int(image_hash)
+        self._ids[image_hash] = hash_id
+        self._hashes[hash_id] = image_hash
+        self._values[hash_id] = hash_value
+        self._index.add(hash_id, hash_value)
+        return hash_id
@@ -0,0 +1,455 @@
+import os
+import json
+import time
+import queue
+import signal
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from cli_backup.functions import hash_file_entries
+from cli_backup.limits import DeadlinePool, limits_for
+from cli_backup.scanner import FileEntry
+from cli_backup.watch import DirectoryWatcher, PollingBackend
+
+logger = logging.getLogger(__name__)
+
+# Requests that arrive within this many seconds of each other are hashed as
+# one batch, of at most BATCH_SIZE files.
+BATCH_WINDOW = 0.01
+BATCH_SIZE = 256
+
+# Largest request body accepted when no --max_file_mb limit is set.
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# The name uploaded images are reported under.
+UPLOAD_NAME = '<upload>'
+
+
+class _Preloaded:
+    """
+    Stands in for a ReadAhead stage: hands hash_file_entries the content of
+    uploaded images, and None for files the workers should read themselves.
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    def iter_contents(self, entries, metrics=None):
+        return iter(self.items)
+
+
+class HashBatcher:
+    """
+    Collects the files submitted by concurrent requests and hashes them
+    together on one long-lived pool of worker processes.
+
+    A request blocks in hash() until its files are done. A background thread
+    takes the first waiting request, then keeps adding requests that arrive
+    within batch_window seconds, up to batch_size files, and hashes the whole
+    batch in one pass, so many small requests keep every worker busy.
+    """
+
+    def __init__(self, var, hash_size, hash_method, executor=None, batch_size=BATCH_SIZE, batch_window=BATCH_WINDOW):
+        self.var = var
+        self.hash_size = hash_size
+        self.hash_method = hash_method
+        self.executor = executor
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='hash-batcher', daemon=True)
+        self._thread.start()
+
+    def hash(self, items):
+        """
+        Hashes a list of files.
+
+        Args:
+            items (list): (FileEntry, data) pairs, where data is the content
+                          of an uploaded image or None to read the file.
+
+        Returns:
+            list: (entry, image_hash, error) for every item, in order.
+        """
+        if not items:
+            return []
+        future = Future()
+        self._queue.put((items, future))
+        return future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            jobs = [job]
+            count = len(job[0])
+            deadline = time.monotonic() + self.batch_window
+            stop = False
+            while count < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                jobs.append(job)
+                count += len(job[0])
+            self._hash_batch(jobs)
+            if stop:
+                return
+
+    def _hash_batch(self, jobs):
+        items = [item for job_items, _ in jobs for item in job_items]
+        metrics = self.var.metrics
+        metrics.count('service_batches_total')
+        metrics.count('service_batched_files_total', len(items))
+        try:
+            results = list(hash_file_entries(
+                [entry for entry, _ in items], self.hash_size, self.hash_method, self.var.decode_mode,
+                self.var.workers, metrics, _Preloaded(items), self.var.hash_backend, limits=limits_for(self.var),
+                executor=self.executor,
+            ))
+        except Exception as e:
+            for _, future in jobs:
+                future.set_exception(e)
+            return
+
+        start = 0
+        for job_items, future in jobs:
+            future.set_result(results[start:start + len(job_items)])
+            start += len(job_items)
+
+
+class DuplicateService:
+    """
+    Keeps the hashes and duplicate groups of a directory tree resident in
+    memory, for the HTTP service.
+
+    The tree is scanned once at start-up. Afterwards, submitted files are
+    hashed in batches and added to the index, queries are answered from the
+    index without touching the tree, and rescans only re-list the directories
+    whose modification time changed (or every directory, for a full rescan).
+    Index updates and lookups are serialized with a lock. Submitted files are
+    hashed outside of it, but a rescan holds it while it hashes the changes.
+    """
+
+    def __init__(self, var, batch_size=BATCH_SIZE, batch_window=BATCH_WINDOW):
+        self.var = var
+        workers = var.workers or os.cpu_count() or 1
+        # One pool for the life of the service, shared by every request. Its
+        # processes are spawned rather than forked, so that they never inherit
+        # the listening socket and keep the port open after the service exits.
+        # With a decode timeout, files are hashed on a DeadlinePool instead,
+        # which can stop a worker in the middle of a file.
+        self.executor = None
+        if var.decode_timeout:
+            self.executor = DeadlinePool(workers, mp_context=multiprocessing.get_context('spawn'))
+        elif workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.watcher = DirectoryWatcher(
+            var, PollingBackend(var.poll_interval), var.hash_size, var.hash_method, executor=self.executor
+        )
+        self.batcher = HashBatcher(var, var.hash_size, var.hash_method, self.executor, batch_size, batch_window)
+        self.lock = threading.Lock()
+        # Requested paths must resolve to a file in the tree.
+        self._real_target = os.path.realpath(var.target_directory)
+
+    def start(self):
+        """
+        Runs the initial scan.
+        """
+        with self.lock:
+            groups = self.watcher.initial_scan()
+        logger.info(f"Initial scan: {len(self.watcher.files)} files, {len(groups)} groups of duplicates.")
+
+    def close(self):
+        self.batcher.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def status(self):
+        with self.lock:
+            return {
+                'target_directory': self.var.target_directory,
+                'hash_method': self.var.hash_method,
+                'hash_size': self.var.hash_size,
+                'threshold': self.var.threshold,
+                'files': len(self.watcher.files),
+                'groups': self.watcher.index.num_groups,
+            }
+
+    def groups(self):
+        with self.lock:
+            return self.watcher.index.groups()
+
+    def resolve(self, file_path):
+        """
+        Returns:
+            str: The absolute path of a file in the target directory.
+
+        Raises:
+            ValueError: If the file is outside the target directory once
+                        symbolic links are resolved. The file is not opened,
+                        so the error is the same whether it exists or not.
+        """
+        real_path = os.path.realpath(file_path)
+        if os.path.commonpath([real_path, self._real_target]) != self._real_target:
+            raise ValueError(f"{file_path} is not in the served directory")
+        return os.path.abspath(file_path)
+
+    def submit(self, paths=(), uploads=(), add=True):
+        """
+        Hashes files and images, and adds the files to the index if `add`.
+        Files that are already indexed and unchanged are not hashed again.
+
+        Returns:
+            list: A result dictionary for every path, then every upload.
+        """
+        results, hashed = self._hash(paths, uploads)
+        with self.lock:
+            for result, entry in hashed:
+                if add and entry.path != UPLOAD_NAME and result['hash'] is not None:
+                    self.watcher.add_file(entry, result['hash'])
+                    result['group'] = self.watcher.index.group_of(result['hash'])
+        return results
+
+    def query(self, paths=(), uploads=(), threshold=None):
+        """
+        Lists the indexed files near each given file or image, without adding
+        them to the index.
+
+        Returns:
+            list: A result dictionary, with the matches, for every path, then
+                  every upload.
+        """
+        results, hashed = self._hash(paths, uploads)
+        with self.lock:
+            for result, _ in hashed:
+                if result['hash'] is not None:
+                    result['matches'] = [
+                        {'path': file_path, 'distance': distance}
+                        for file_path, distance in self.watcher.index.query(result['hash'], threshold)
+                    ]
+        return results
+
+    def rescan(self, full=False):
+        """
+        Picks up the changes in the tree since the last scan.
+
+        Args:
+            full (bool): Re-list every directory, which also catches files
+                         rewritten in place, instead of only the directories
+                         whose modification time changed.
+
+        Returns:
+            dict: The number of directories re-listed, the new duplicates and
+                  the number of indexed files.
+        """
+        with self.lock:
+            if full:
+                directories = set(self.watcher.subdirectories) | {self.var.target_directory}
+            else:
+                directories = self.watcher.backend.wait(0)
+            new_duplicates = self.watcher.update(directories) if directories else []
+            return {
+                'directories': len(directories),
+                'new_duplicates': [{'path': file_path, 'group': group} for file_path, group in new_duplicates],
+                'files': len(self.watcher.files),
+            }
+
+    def _hash(self, paths, uploads):
+        results = []
+        items = []
+        hashed = []
+        for file_path in paths:
+            result = {'path': file_path, 'hash': None, 'error': None}
+            results.append(result)
+            try:
+                stat = os.stat(file_path)
+            except OSError as e:
+                result['error'] = str(e)
+                continue
+            entry = FileEntry(file_path, stat.st_size, stat.st_mtime_ns)
+            with self.lock:
+                known = self.watcher.known_hash(entry)
+            if known is not None:
+                result['hash'] = known
+                hashed.append((result, entry))
+            else:
+                items.append((result, entry, None))
+        for data in uploads:
+            result = {'path': UPLOAD_NAME, 'hash': None, 'error': None}
+            results.append(result)
+            items.append((result, FileEntry(UPLOAD_NAME, len(data), 0), data))
+
+        batch = self.batcher.hash([(entry, data) for _, entry, data in items])
+        for (result, entry, _), (_, image_hash, error) in zip(items, batch):
+            result['hash'] = image_hash
+            result['error'] = None if error is None else str(error)
+            hashed.append((result, entry))
+        return results, hashed
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP API of the service. Every response is JSON.
+
+        GET  /health   The service status and the size of the index.
+        GET  /groups   The current duplicate groups.
+        POST /submit   Hash files and add them to the index.
+        POST /query    List the indexed files near the given files.
+        POST /rescan   Pick up changes in the tree.
+
+    /submit and /query take either a JSON body {"paths": [...]} (with an
+    optional "threshold" for /query, or "add": false for /submit) or the raw
+    bytes of one image. Paths outside the target directory are rejected with
+    400. /rescan takes an optional JSON body {"full": true}.
+    """
+
+    server_version = 'DuplicateImageDetector'
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send(200, dict(service.status(), status='ok'))
+        elif path == '/groups':
+            self._send(200, {'groups': service.groups()})
+        else:
+            self._send(404, {'error': f"Unknown endpoint {path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        path = urlsplit(self.path).path
+        if path not in ('/submit', '/query', '/rescan'):
+            self._send(404, {'error': f"Unknown endpoint {path}"})
+            return
+
+        try:
+            body, uploads = self._read_body()
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+            return
+        if body is None:
+            return
+
+        paths = body.get('paths', [])
+        if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+            self._send(400, {'error': "'paths' must be a list of strings"})
+            return
+        try:
+            paths = [service.resolve(file_path) for file_path in paths]
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+            return
+
+        if path == '/submit':
+            self._send(200, {'results': service.submit(paths, uploads, add=body.get('add', True))})
+        elif path == '/query':
+            threshold = body.get('threshold')
+            if threshold is not None and not (isinstance(threshold, int) and 0 <= threshold <= service.var.threshold):
+                self._send(400, {'error': f"'threshold' must be an integer from 0 to {service.var.threshold}"})
+                return
+            self._send(200, {'results': service.query(paths, uploads, threshold)})
+        else:
+            self._send(200, service.rescan(full=bool(body.get('full', False))))
+
+    def _read_body(self):
+        """
+        Returns:
+            tuple: (JSON body, uploaded images). The body is None if an error
+                   response was already sent.
+        """
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise ValueError("Content-Length must be a non-negative integer")
+        limit = self.server.service.var.max_file_bytes or MAX_BODY_BYTES
+        if length > limit:
+            self._send(413, {'error': f"The request body is larger than {limit} bytes"})
+            return None, []
+        data = self.rfile.read(length) if length else b''
+
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip()
+        if content_type == 'application/json' or not data:
+            try:
+                body = json.loads(data or b'{}')
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON: {e}")
+            if not isinstance(body, dict):
+                raise ValueError("The JSON body must be an object")
+            return body, []
+        return {}, [data]
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class ServiceServer(ThreadingHTTPServer):
+    """
+    The HTTP server, with one thread per request.
+    """
+
+    daemon_threads = True
+    # Clients send bursts of concurrent requests, which the default backlog
+    # of 5 connections would reset.
+    request_queue_size = 128
+
+    def __init__(self, address, service):
+        super().__init__(address, ServiceHandler)
+        self.service = service
+
+
+def serve(var, host='127.0.0.1', port=8000, batch_size=BATCH_SIZE, batch_window=BATCH_WINDOW):
+    """
+    Scans the target directory once and serves the HTTP API until
+    interrupted.
+    """
+    # Directory paths are compared with the parents of file paths, so strip
+    # any trailing separator.
+    var.target_directory = os.path.normpath(os.path.abspath(var.target_directory))
+
+    # Stop as on Ctrl+C when terminated, e.g. by `docker stop`, so that the
+    # worker processes are shut down too.
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    service = DuplicateService(var, batch_size, batch_window)
+    try:
+        service.start()
+        server = ServiceServer((host, port), service)
+        logger.info(f"Serving on http://{host}:{server.server_address[1]}/. Press Ctrl+C to stop.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Stopped serving.")
+        finally:
+            server.server_close()
+    finally:
+        service.close()
@@ -0,0 +1,195 @@
+import os
+import gzip
+import json
+import time
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+SHARD_FORMAT = 'duplicate-image-detector-shard'
+SHARD_VERSION = 2
+
+# How a tree is split between shards: by the hash of each file's path, or by
+# the hash of the top-level directory each file is in.
+SHARD_MODES = ('path', 'directory')
+
+
+def parse_shard_spec(spec):
+    """
+    Parses a shard specification of the form 'i/N', with 0 <= i < N.
+
+    Returns:
+        tuple: (index, count).
+
+    Raises:
+        ValueError: If the specification is malformed.
+    """
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}', expected i/N (e.g. 0/4)")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{spec}': i must be between 0 and N - 1")
+    return index, count
+
+
+def _shard_of(key, count):
+    # crc32 is stable across processes and platforms, unlike hash().
+    return zlib.crc32(key.encode('utf-8', 'surrogateescape')) % count
+
+
+def _relative_key(path, root_directory):
+    return os.path.relpath(path, root_directory).replace(os.sep, '/')
+
+
+def shard_filters(root_directory, shard, shard_by):
+    """
+    Builds the filters that restrict a scan to one shard. Every shard makes
+    the same decision for a given file, so the shards of a tree never overlap
+    and together cover all of it.
+
+    In 'directory' mode whole top-level directories are skipped without
+    being listed. Files directly in the root belong to the shard of the
+    empty directory name.
+
+    Args:
+        root_directory (str): The scanned directory.
+        shard (tuple): (index, count).
+        shard_by (str): 'path' or 'directory'.
+
+    Returns:
+        tuple: (include_directory, include_file) callables taking a path.
+    """
+    index, count = shard
+
+    if shard_by == 'path':
+        def include_directory(directory):
+            return True
+
+        def include_file(file_path):
+            return _shard_of(_relative_key(file_path, root_directory), count) == index
+
+    elif shard_by == 'directory':
+        def include_directory(directory):
+            key = _relative_key(directory, root_directory)
+            if key == '.' or '/' in key:
+                # The root, or below a top-level directory already accepted.
+                return True
+            return _shard_of(key, count) == index
+
+        def include_file(file_path):
+            key = _relative_key(file_path, root_directory)
+            if '/' in key:
+                return True
+            return _shard_of('', count) == index
+
+    else:
+        raise ValueError(f"Unsupported shard mode: {shard_by}")
+
+    return include_directory, include_file
+
+
+def _open_shard(path, mode, compressed):
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def write_shard_file(shard_path, var, hash_method, hash_size, hashes_map, entries):
+    """
+    Writes the result of a sharded scan. The first line is a header with
+    everything needed to check that shards belong together; each following
+    line is [path, size, hash], where the path is relative to the target
+    directory in the header, so the shards can be merged from any working
+    directory. Files ending in .gz are compressed.
+
+    Args:
+        shard_path (str): The file to write.
+        var (Variables): The variables object of the scan.
+        hash_method (str): The hashing algorithm used.
+        hash_size (int): The hash size used.
+        hashes_map (dict): The hashes found, as returned by get_image_hashes.
+        entries (dict): The FileEntry of every hashed file, keyed by path.
+
+    Returns:
+        int: The number of files written.
+    """
+    index, count = var.shard
+    target_directory = os.path.abspath(var.target_directory)
+    header = {
+        'format': SHARD_FORMAT,
+        'version': SHARD_VERSION,
+        'target_directory': target_directory,
+        'shard_index': index,
+        'shard_count': count,
+        'shard_by': var.shard_by,
+        'hash_method': hash_method,
+        'hash_size': hash_size,
+        'decode_mode': var.decode_mode,
+        'created': time.time(),
+    }
+
+    written = 0
+    temp_path = f"{shard_path}.tmp"
+    with _open_shard(temp_path, 'w', shard_path.endswith('.gz')) as f:
+        f.write(json.dumps(header) + '\n')
+        for image_hash, paths in hashes_map.items():
+            for path in paths:
+                relative_path = os.path.relpath(os.path.abspath(path), target_directory)
+                f.write(json.dumps([relative_path, entries[path].size, image_hash]) + '\n')
+                written += 1
+    # Only complete shard files ever appear under their final name.
+    os.replace(temp_path, shard_path)
+    logger.info(f"Wrote {written} hashes to shard file {shard_path}")
+    return written
+
+
+def read_shard_file(shard_path):
+    """
+    Reads a shard file.
+
+    Returns:
+        tuple: (header dictionary, list of [path, size, hash]), with paths
+               relative to the target directory in the header.
+
+    Raises:
+        ValueError: If the file is not a shard file of a supported version.
+    """
+    with _open_shard(shard_path, 'r', shard_path.endswith('.gz')) as f:
+        header = json.loads(f.readline())
+        if header.get('format') != SHARD_FORMAT or header.get('version') != SHARD_VERSION:
+            raise ValueError(f"{shard_path} is not a supported shard file")
+        rows = [json.loads(line) for line in f]
+    return header, rows
+
+
+def check_shard_headers(headers):
+    """
+    Checks that a set of shard files are the complete set of shards of one
+    scan.
+
+    Args:
+        headers (dict): The header of every shard file, keyed by file path.
+
+    Raises:
+        ValueError: Describing the first inconsistency found.
+    """
+    keys = ('target_directory', 'shard_count', 'shard_by', 'hash_method', 'hash_size', 'decode_mode')
+    first_path, first = next(iter(headers.items()))
+    for shard_path, header in headers.items():
+        for key in keys:
+            if header[key] != first[key]:
+                raise ValueError(f"{shard_path} has {key}={header[key]!r}, but {first_path} has {first[key]!r}")
+
+    seen = {}
+    for shard_path, header in headers.items():
+        index = header['shard_index']
+        if index in seen:
+            raise ValueError(f"{shard_path} and {seen[index]} are both shard {index}")
+        seen[index] = shard_path
+
+    count = first['shard_count']
+    missing = [f"{index}/{count}" for index in range(count) if index not in seen]
+    if missing:
+        raise ValueError(f"Missing shards: {', '.join(missing)}")
@@ -0,0 +1,254 @@
+from array import array
+
+import numpy as np
+
+from cli_backup.packed import words_for_bits
+
+
+def _split_path(path):
+    """
+    Splits a path after its last separator, so that directory + name gives
+    back exactly the original string.
+    """
+    cut = max(path.rfind('/'), path.rfind('\\')) + 1
+    return path[:cut], path[cut:]
+
+
+class PathTable:
+    """
+    A compact table of file paths.
+
+    Directory prefixes are interned, so each directory string is stored once,
+    and basenames are packed into a single UTF-8 buffer indexed by offsets.
+    A path costs a few bytes of bookkeeping plus its basename, instead of a
+    full Python string.
+    """
+
+    def __init__(self):
+        self.directories = []
+        self._directory_ids = {}
+        self._dir_ids = array('I')
+        self._name_offsets = array('Q', [0])
+        self._names = bytearray()
+
+    def __len__(self):
+        return len(self._dir_ids)
+
+    def add(self, path):
+        """
+        Appends a path and returns its id.
+        """
+        directory, name = _split_path(path)
+        dir_id = self._directory_ids.get(directory)
+        if dir_id is None:
+            dir_id = len(self.directories)
+            self._directory_ids[directory] = dir_id
+            self.directories.append(directory)
+
+        self._dir_ids.append(dir_id)
+        self._names += name.encode('utf-8', 'surrogateescape')
+        self._name_offsets.append(len(self._names))
+        return len(self._dir_ids) - 1
+
+    def __getitem__(self, path_id):
+        start, stop = self._name_offsets[path_id], self._name_offsets[path_id + 1]
+        name = self._names[start:stop].decode('utf-8', 'surrogateescape')
+        return self.directories[self._dir_ids[path_id]] + name
+
+
+class DuplicateGroups:
+    """
+    Duplicate groups stored CSR-style: the members of group i are the file ids
+    members[offsets[i]:offsets[i + 1]] of an ImageStore.
+
+    The object behaves like the list of lists of paths used elsewhere:
+    len(groups) is the number of groups and groups[i] (or iterating) gives
+    the sorted paths of a group. Paths are only materialized on access.
+    """
+
+    def __init__(self, store, offsets, members):
+        self.store = store
+        self.offsets = offsets
+        self.members = members
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("group index out of range")
+        return [self.store.paths[file_id] for file_id in self.file_ids(index).tolist()]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def file_ids(self, index):
+        """
+        Returns:
+            numpy.ndarray: The file ids of group `index`, ordered by path.
+        """
+        return self.members[self.offsets[index]:self.offsets[index + 1]]
+
+    def total_duplicates(self):
+        """
+        Returns:
+            int: The number of files that are not the first of their group.
+        """
+        return len(self.members) - len(self)
+
+
+class ImageStore:
+    """
+    Array-backed storage for the results of a scan.
+
+    Each file gets an integer id. Its path lives in a PathTable, and its size
+    and the id of its hash live in flat arrays. Distinct hashes are stored
+    once, packed into 64-bit words (most significant word first), and are
+    exposed as a NumPy array. For orientation-invariant scans, the dihedral
+    variants of every distinct hash are packed side by side in a second
+    array.
+    """
+
+    def __init__(self):
+        self.paths = PathTable()
+        self.hash_ids = array('I')
+        self.sizes = array('q')
+
+        self.num_bits = None
+        self._words = 1
+        self._hash_words = array('Q')
+        self._hash_lookup = {}
+        self._variant_words = array('Q')
+        self.num_variants = 0
+
+    def __len__(self):
+        return len(self.hash_ids)
+
+    @property
+    def num_hashes(self):
+        return len(self._hash_lookup)
+
+    def add(self, image_hash, file_path, size=-1, variants=None):
+        """
+        Stores one hashed file.
+
+        Args:
+            image_hash (str): The hexadecimal image hash.
+            file_path (str): The file path.
+            size (int): The file size in bytes, or -1 if unknown.
+            variants (tuple): The hexadecimal hashes of the other dihedral
+                              variants of the image, for orientation-invariant
+                              scans. Either every file has them or none does.
+
+        Returns:
+            tuple: (hash_id, is_new_hash).
+        """
+        value = int(image_hash, 16)
+        hash_id = self._hash_lookup.get(value)
+        is_new = hash_id is None
+        if is_new:
+            if self.num_bits is None:
+                self.num_bits = len(image_hash) * 4
+                self._words = words_for_bits(self.num_bits)
+            hash_id = len(self._hash_lookup)
+            self._hash_lookup[value] = hash_id
+            self._append_words(self._hash_words, value)
+            if variants:
+                self.num_variants = len(variants)
+                for variant in variants:
+                    self._append_words(self._variant_words, int(variant, 16))
+
+        self.paths.add(file_path)
+        self.hash_ids.append(hash_id)
+        self.sizes.append(size)
+        return hash_id, is_new
+
+    def packed_hashes(self):
+        """
+        Returns:
+            numpy.ndarray: The distinct hashes as a (num_hashes, words) uint64
+                           array, indexed by hash id.
+        """
+        # Copied, so the store can keep growing while the array is in use.
+        return np.array(self._hash_words, dtype=np.uint64).reshape(-1, self._words)
+
+    def packed_variants(self):
+        """
+        Returns:
+            numpy.ndarray: The dihedral variants of the distinct hashes as a
+                           (num_hashes, num_variants, words) uint64 array.
+        """
+        return np.array(self._variant_words, dtype=np.uint64).reshape(-1, self.num_variants, self._words)
+
+    def _append_words(self, words, value):
+        for word in reversed(range(self._words)):
+            words.append((value >> (64 * word)) & 0xFFFFFFFFFFFFFFFF)
+
+    def hash_hex(self, hash_id):
+        """
+        Returns:
+            str: The hexadecimal form of a stored hash.
+        """
+        value = 0
+        for word in self._hash_words[hash_id * self._words:(hash_id + 1) * self._words]:
+            value = (value << 64) | word
+        return format(value, f"0{self.num_bits // 4}x")
+
+    def hashes_map(self):
+        """
+        Builds the classic {hash: [paths]} dictionary from the store.
+        """
+        hex_hashes = [self.hash_hex(hash_id) for hash_id in range(self.num_hashes)]
+        hashes_map = {}
+        for file_id, hash_id in enumerate(self.hash_ids):
+            hashes_map.setdefault(hex_hashes[hash_id], []).append(self.paths[file_id])
+        return hashes_map
+
+    def build_groups(self, hash_labels):
+        """
+        Turns a group label per distinct hash into duplicate groups of files.
+
+        Args:
+            hash_labels (numpy.ndarray): A label for every hash id. Hashes with
+                                         the same label belong to one group.
+
+        Returns:
+            DuplicateGroups: Groups of more than one file, each ordered by path,
+                             ordered by their first path.
+        """
+        if not len(self):
+            return DuplicateGroups(self, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+        file_labels = np.asarray(hash_labels)[np.array(self.hash_ids, dtype=np.int64)]
+        _, inverse, counts = np.unique(file_labels, return_inverse=True, return_counts=True)
+        grouped = np.flatnonzero(counts[inverse] > 1)
+
+        groups = {}
+        for file_id, label in zip(grouped.tolist(), file_labels[grouped].tolist()):
+            groups.setdefault(label, []).append(file_id)
+        return self.group_files(groups.values())
+
+    def group_files(self, file_groups):
+        """
+        Builds duplicate groups from lists of file ids.
+
+        Args:
+            file_groups (iterable): Lists of file ids, one per group. Lists
+                                    with fewer than two files are dropped.
+
+        Returns:
+            DuplicateGroups: The groups, each ordered by path, ordered by their
+                             first path.
+        """
+        ordered = sorted(
+            sorted((self.paths[file_id], file_id) for file_id in group) for group in file_groups if len(group) > 1
+        )
+        offsets = np.zeros(len(ordered) + 1, dtype=np.int64)
+        np.cumsum([len(members) for members in ordered], out=offsets[1:])
+        members = np.fromiter(
+            (file_id for group in ordered for _, file_id in group), dtype=np.int64, count=int(offsets[-1])
+        )
+        return DuplicateGroups(self, offsets, members)
@@ -1,3 +1,6 @@
+from cli_backup.metrics import Metrics
+
+
 class Variables:
 
     def __init__(self):
@@ -5,7 +8,79 @@ class Variables:
         self.threshold=None
         self.strategy=None
         self.dry_run=None
+        self.workers=1
+        self.decode_mode='full'
+        self.exact_prefilter=True
+        self.hash_method='dhash'
+        self.hash_size=8
+        self.hash_backend='auto'
+        # Also match rotated and mirrored copies
+        self.orientation_invariant=False
+        # Also hash the images inside zip and tar archives
+        self.scan_archives=False
+        # Thresholds to report group counts for, instead of grouping
+        self.sweep_thresholds=None
+
+        # Read-ahead of file contents on I/O threads, for slow storage.
+        # read_file replaces the function that reads a whole file, e.g. with
+        # a ThrottledReader to simulate a network mount.
+        self.read_ahead_threads=0
+        self.read_ahead_bytes=64 * 1024 * 1024
+        self.read_file=None
+
+        # Per-file limits (None for no limit); files over a limit are
+        # skipped and listed in the skip list
+        self.max_image_pixels=None
+        self.max_file_bytes=None
+        self.decode_timeout=None
+        self.skip_list_path=None
+
+        # Hash cascade: candidate groups are confirmed with a stronger hash
+        self.verify_method=None
+        self.verify_size=16
+        self.verify_threshold=None
+
+        # Machine-readable report of the duplicate groups
+        self.output_path=None
+        self.output_format=None
+
+        # What is done with duplicates
+        self.action='delete'
+        self.quarantine_dir=None
+        self.journal_path=None
+        self.io_workers=16
+        self.undo_journal_path=None
+
+        # Sharded scans: (index, count), or None to scan the whole tree
+        self.shard=None
+        self.shard_by='path'
+        self.shard_output=None
+
+        # Persistent index, built and queried with the index command
+        self.index_path=None
+
+        # Watch mode
+        self.watch=False
+        self.watch_backend='auto'
+        self.poll_interval=5.0
+
+        # Persistent hash cache
+        self.cache_path=None
+        self.invalidate_cache=False
+
+        # Instrumentation
+        self.metrics=Metrics()
+        self.metrics_json_path=None
+        self.metrics_prometheus_path=None
+        self.profile_path=None
+
+        # Progress reporting and cancellation, used by the GUI
+        self.progress_callback=None
+        self.cancel_event=None
 
-        self.image_hashes={}
+        # The hashes of the last scan (an ImageStore), and the candidate pairs
+        # to regroup them at another threshold (a ThresholdSweep, if requested)
+        self.image_hashes=None
+        self.threshold_sweep=None
         self.duplicate_groups=[]
-        
\ No newline at end of file
+        
@@ -0,0 +1,413 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+from collections import defaultdict
+
+from cli_backup.functions import get_image_hashes, hash_file_entries
+from cli_backup.limits import limits_for
+from cli_backup.prefetch import read_ahead_for
+from cli_backup.scanner import IMAGE_EXTENSIONS, FileEntry, iter_image_files
+from cli_backup.search_index import LiveDuplicateIndex
+
+logger = logging.getLogger(__name__)
+
+# Changes are collected for this many seconds after the first event, so that
+# a burst of writes (e.g. a folder being copied in) is processed in one batch.
+SETTLE_SECONDS = 1.0
+
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_ATTRIB | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+               | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyBackend:
+    """
+    Reports changed directories using the Linux inotify API, with one watch
+    per directory.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or libc_name is None:
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._directories = {}
+        self._watches = {}
+
+    def add_directory(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached (see fs.inotify.max_user_watches)")
+            # The directory vanished before it could be watched; the parent's
+            # rescan will notice.
+            logger.debug(f"Could not watch {directory}: {os.strerror(err)}")
+            return
+        self._directories[wd] = directory
+        self._watches[directory] = wd
+
+    def remove_directory(self, directory):
+        wd = self._watches.pop(directory, None)
+        if wd is not None:
+            self._directories.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def wait(self, timeout):
+        """
+        Blocks until something changes (or the timeout expires) and returns
+        the set of directories whose contents changed.
+        """
+        changed = set()
+        deadline = None
+        while True:
+            remaining = timeout if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                break
+            changed.update(self._read_events())
+            if deadline is None and changed:
+                deadline = time.monotonic() + SETTLE_SECONDS
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size + length
+
+            if mask & _IN_Q_OVERFLOW:
+                # Events were lost, so every directory has to be rechecked.
+                changed.update(self._watches)
+                continue
+
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            if mask & _IN_IGNORED:
+                self._directories.pop(wd, None)
+                self._watches.pop(directory, None)
+                continue
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                changed.add(os.path.dirname(directory))
+            else:
+                changed.add(directory)
+        return changed
+
+
+class PollingBackend:
+    """
+    Reports changed directories by polling their modification times. Adding,
+    removing or renaming an entry updates the mtime of its directory, so only
+    directories, not individual files, need to be checked. Files rewritten in
+    place are only picked up once something else changes in their directory.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._mtimes = {}
+
+    def add_directory(self, directory):
+        try:
+            self._mtimes[directory] = os.stat(directory).st_mtime_ns
+        except OSError:
+            self._mtimes[directory] = None
+
+    def remove_directory(self, directory):
+        self._mtimes.pop(directory, None)
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval) if timeout is not None else self.interval)
+
+        changed = set()
+        for directory, mtime_ns in list(self._mtimes.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime_ns:
+                self._mtimes[directory] = current
+                changed.add(directory if current is not None else os.path.dirname(directory))
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_backend(name, interval):
+    """
+    Creates the change-detection backend. 'auto' prefers inotify and falls
+    back to polling directory mtimes where it is not available.
+    """
+    if name in ('auto', 'inotify'):
+        try:
+            return InotifyBackend()
+        except OSError as e:
+            if name == 'inotify':
+                raise
+            logger.info(f"inotify is not available ({e}); polling directories every {interval}s instead.")
+    return PollingBackend(interval)
+
+
+class DirectoryWatcher:
+    """
+    Keeps the hashes and duplicate groups of a directory tree resident in
+    memory and updates them as files are added, changed or removed.
+
+    Only the directories reported as changed are re-listed, and only new or
+    modified files in them are re-hashed, on `executor` if one is given.
+    """
+
+    def __init__(self, var, backend, hash_size=8, hash_method='dhash', executor=None):
+        self.var = var
+        self.backend = backend
+        self.hash_size = hash_size
+        self.hash_method = hash_method
+        self.executor = executor
+
+        self.index = LiveDuplicateIndex(var.threshold)
+        # path -> (FileEntry, image hash or None if it could not be hashed)
+        self.files = {}
+        self.dir_files = defaultdict(set)
+        self.subdirectories = defaultdict(set)
+
+    def initial_scan(self):
+        """
+        Runs a full scan of the target directory, registering every directory
+        with the backend before it is listed so no change can be missed.
+        """
+        entries = {}
+        failed = {}
+        hashes_map = get_image_hashes(
+            self.var, self.hash_size, self.hash_method, entries=entries, on_directory=self._register_directory,
+            failed=failed
+        )
+        self.index.load(hashes_map)
+        for image_hash, paths in hashes_map.items():
+            for path in paths:
+                self._remember(entries[path], image_hash)
+        # Files that could not be hashed are remembered too, so that they are
+        # only retried once their size or modification time changes.
+        for entry in failed.values():
+            self._remember(entry, None)
+        return self.index.groups()
+
+    def update(self, directories):
+        """
+        Re-lists the given directories and applies the changes found.
+
+        Returns:
+            list: (file_path, group) tuples for changed files that are now part
+                  of a duplicate group.
+        """
+        to_hash = []
+        for directory in sorted(directories):
+            if directory not in self.subdirectories and directory != self.var.target_directory:
+                # Not (or no longer) part of the watched tree.
+                continue
+            to_hash.extend(self._rescan_directory(directory))
+
+        new_duplicates = []
+        for entry, image_hash, error in hash_file_entries(
+            to_hash, self.hash_size, self.hash_method, self.var.decode_mode, self.var.workers,
+            read_ahead=read_ahead_for(self.var), backend=self.var.hash_backend, limits=limits_for(self.var),
+            executor=self.executor
+        ):
+            if error is not None:
+                logger.error(f"Could not process file {entry.path}: {error}")
+                self.files[entry.path] = (entry, None)
+                continue
+            self.index.add(image_hash, entry.path)
+            self.files[entry.path] = (entry, image_hash)
+
+            group = self.index.group_of(image_hash)
+            if len(group) > 1:
+                new_duplicates.append((entry.path, group))
+        return new_duplicates
+
+    def add_file(self, entry, image_hash):
+        """
+        Records a file hashed outside of a rescan (e.g. submitted to the
+        service), replacing what was known about it.
+        """
+        if self.files.get(entry.path) == (entry, image_hash):
+            return
+        if entry.path in self.files:
+            self._forget(entry.path)
+        self._remember(entry, image_hash)
+        if image_hash is not None:
+            self.index.add(image_hash, entry.path)
+
+    def known_hash(self, entry):
+        """
+        Returns:
+            str or None: The hash of a file that is already indexed and has
+                         not changed since, or None.
+        """
+        known = self.files.get(entry.path)
+        if known is None or (known[0].size, known[0].mtime_ns) != (entry.size, entry.mtime_ns):
+            return None
+        return known[1]
+
+    def run(self, poll_timeout=None):
+        """
+        Processes changes until interrupted, logging new duplicates as they
+        appear.
+        """
+        logger.info(f"Watching '{self.var.target_directory}' for changes. Press Ctrl+C to stop.")
+        try:
+            while True:
+                changed = self.backend.wait(poll_timeout)
+                if not changed:
+                    continue
+                for file_path, group in self.update(changed):
+                    others = [path for path in group if path != file_path]
+                    logger.info(f"New duplicate: {file_path}")
+                    for path in others:
+                        logger.info(f"  - matches: {path}")
+        except KeyboardInterrupt:
+            logger.info("Stopped watching.")
+        finally:
+            self.backend.close()
+
+    def _register_directory(self, directory):
+        try:
+            self.backend.add_directory(directory)
+        except OSError as e:
+            logger.warning(f"{e}; polling directories every {self.var.poll_interval}s instead.")
+            self.backend.close()
+            self.backend = PollingBackend(self.var.poll_interval)
+            for known in list(self.subdirectories) + [directory]:
+                self.backend.add_directory(known)
+        parent = os.path.dirname(directory)
+        if directory != self.var.target_directory:
+            self.subdirectories[parent].add(directory)
+        self.subdirectories.setdefault(directory, set())
+
+    def _remember(self, entry, image_hash):
+        self.files[entry.path] = (entry, image_hash)
+        self.dir_files[os.path.dirname(entry.path)].add(entry.path)
+
+    def _forget(self, file_path):
+        entry, image_hash = self.files.pop(file_path)
+        self.dir_files[os.path.dirname(file_path)].discard(file_path)
+        if image_hash is not None:
+            self.index.remove(image_hash, file_path)
+
+    def _forget_tree(self, directory):
+        for subdirectory in self.subdirectories.pop(directory, set()):
+            self._forget_tree(subdirectory)
+        for file_path in list(self.dir_files.pop(directory, set())):
+            self._forget(file_path)
+        self.subdirectories[os.path.dirname(directory)].discard(directory)
+        self.backend.remove_directory(directory)
+
+    def _rescan_directory(self, directory):
+        """
+        Compares a directory listing with the known state.
+
+        Returns:
+            list: FileEntry objects for new or modified files that need hashing.
+        """
+        current_files = {}
+        current_subdirectories = set()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            current_subdirectories.add(entry.path)
+                        elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and not entry.is_symlink() and entry.is_file():
+                            stat = entry.stat()
+                            current_files[entry.path] = FileEntry(entry.path, stat.st_size, stat.st_mtime_ns)
+                    except OSError as e:
+                        logger.error(f"Could not process file {entry.path}: {e}")
+        except FileNotFoundError:
+            self._forget_tree(directory)
+            return []
+        except OSError as e:
+            logger.error(f"Could not scan directory {directory}: {e}")
+            return []
+
+        to_hash = []
+
+        # Removed files and files that changed since they were hashed.
+        for file_path in list(self.dir_files.get(directory, ())):
+            entry = current_files.get(file_path)
+            known, _ = self.files[file_path]
+            if entry is None or (entry.size, entry.mtime_ns) != (known.size, known.mtime_ns):
+                self._forget(file_path)
+
+        for file_path, entry in current_files.items():
+            if file_path not in self.files:
+                self.dir_files[directory].add(file_path)
+                to_hash.append(entry)
+
+        # Subdirectories that were removed, or added (with everything in them).
+        known_subdirectories = self.subdirectories.get(directory, set())
+        for subdirectory in known_subdirectories - current_subdirectories:
+            self._forget_tree(subdirectory)
+        for subdirectory in sorted(current_subdirectories - known_subdirectories):
+            for entry in iter_image_files(subdirectory, on_directory=self._register_directory):
+                self.dir_files[os.path.dirname(entry.path)].add(entry.path)
+                to_hash.append(entry)
+
+        return to_hash
+
+
+def watch_directory(var, hash_size=8, hash_method='dhash'):
+    """
+    Scans the target directory once, reports the duplicate groups found, and
+    then keeps watching the tree, reporting new duplicates as files change.
+    """
+    # Directory paths are compared with the parents of file paths, so strip
+    # any trailing separator.
+    var.target_directory = os.path.normpath(var.target_directory)
+
+    backend = create_backend(var.watch_backend, var.poll_interval)
+    watcher = DirectoryWatcher(var, backend, hash_size, hash_method)
+
+    var.duplicate_groups = watcher.initial_scan()
+    logger.info(f"Initial scan found {len(var.duplicate_groups)} groups of duplicates.")
+    for group in var.duplicate_groups:
+        logger.info(f"Duplicate group: {', '.join(group)}")
+
+    watcher.run()
+    return watcher
@@ -1,13 +1,24 @@
 from tkinter import filedialog, messagebox
 from cli_backup.variables import Variables
-from cli_backup.functions import delete_duplicates
 from gui_backup.helper import setup_gui, setup_logging, browse_directory, clear_log
 
 import _cli
 import logging
+import multiprocessing
+import queue
+import threading
+import time
 import tkinter as tk
 import traceback
 
+# How often the worker thread's progress is polled, in milliseconds.
+PROGRESS_POLL_MS = 100
+
+# The live threshold slider goes up to this many bits past the threshold of
+# the last scan. The pairs to regroup by are only found once it is moved, and
+# their number grows quickly with the range.
+SWEEP_MARGIN = 4
+
 class MyTinkerApp:
     def __init__(self, root):
         self.root = root
@@ -20,6 +31,14 @@ class MyTinkerApp:
         self.dry_run = tk.BooleanVar()
         self.show_full_logs=tk.BooleanVar(value=False)
         self.var.threshold = 10
+        self.var.workers = 0
+
+        # State of the background analysis
+        self.worker = None
+        self.cancel_event = None
+        self.progress_queue = queue.Queue()
+        # The slider position to count the groups at once the sweep is ready
+        self.pending_threshold = None
 
         # 2. Setup the GUI layout and logging using helper functions
         setup_gui(self)
@@ -27,11 +46,16 @@ class MyTinkerApp:
 
     def analyze_and_run(self):
         """
-        This function orchestrates the analysis and deletion process for the GUI.
+        Reads the settings and starts the analysis and deletion process in a
+        background thread, so the window stays responsive. Progress and
+        results come back through self.progress_queue.
         """
-        total_files_to_delete = 0
+        if self.worker is not None and self.worker.is_alive():
+            return
+
         input_directory = self.directory_entry.get()
         threshold_value = self.threshold_entry.get()
+        workers_value = self.workers_entry.get()
         strategy_value = self.strategy_var.get()
         
         self.var.dry_run = self.dry_run.get()
@@ -40,55 +64,177 @@ class MyTinkerApp:
             self.status_label.config(text="Please select a directory first!")
             return
 
-        self.status_label.config(text="Analysis started...")
-        self.root.update_idletasks()
-        
         logger = logging.getLogger(__name__)
 
         try:
+            self.var.threshold = int(threshold_value) if threshold_value else 10
+        except ValueError as e:
+            logger.error(f"Invalid threshold value. Using default of 10. Error: {e}")
+            self.var.threshold = 10
+
+        try:
+            self.var.workers = int(workers_value) if workers_value else 0
+        except ValueError as e:
+            logger.error(f"Invalid workers value. Using one worker per CPU core. Error: {e}")
+            self.var.workers = 0
             
-            try:
-                self.var.threshold = int(threshold_value) if threshold_value else 10
-            except ValueError as e:
-                logger.error(f"Invalid threshold value. Using default of 10. Error: {e}")
-                self.var.threshold = 10
-                
-            self.var.strategy = strategy_value
-            self.var.target_directory = input_directory
+        # The files of the last scan are regrouped without rescanning when
+        # only the threshold changed, within the range of the slider.
+        sweep = self.var.threshold_sweep
+        regroup = sweep is not None and input_directory == self.var.target_directory and self.var.threshold <= sweep.max_threshold
+
+        self.var.strategy = strategy_value
+        self.var.target_directory = input_directory
+
+        self.cancel_event = threading.Event()
+        self.var.cancel_event = self.cancel_event
+        self.var.progress_callback = self._report_progress
+        self.scan_started = time.monotonic()
+        self._last_progress = 0.0
+
+        self.status_label.config(text="Analysis started...")
+        self.progress_bar.config(value=0, maximum=1)
+        self.analyze_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.threshold_scale.config(state=tk.DISABLED)
+
+        self.worker = threading.Thread(target=self._run_analysis, args=(self.show_full_logs.get(), regroup), daemon=True)
+        self.worker.start()
+        self.root.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def cancel_analysis(self):
+        """
+        Asks the running analysis to stop. Files already being hashed are
+        finished first, and nothing is deleted.
+        """
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status_label.config(text="Cancelling...")
+
+    def regroup_at(self, value):
+        """
+        Called as the live threshold slider moves. Counts the groups of the
+        last scan at the new threshold, which takes milliseconds; "Analyze
+        and Run" then regroups the files at it without rescanning them.
+
+        The first move finds the pairs to regroup by (see
+        _cli.prepare_threshold_sweep) on the worker thread, and the groups
+        are counted once they are ready.
+        """
+        threshold = int(float(value))
+        if self.var.image_hashes is None or threshold == self.var.threshold or (self.worker is not None and self.worker.is_alive()):
+            return
+
+        sweep = self.var.threshold_sweep
+        if sweep is None:
+            self.pending_threshold = threshold
+            self.status_label.config(text="Finding the pairs of the last scan...")
+            self.analyze_button.config(state=tk.DISABLED)
+            self.threshold_scale.config(state=tk.DISABLED)
+            max_threshold = int(self.threshold_scale.cget('to'))
+            self.worker = threading.Thread(target=self._run_sweep, args=(max_threshold,), daemon=True)
+            self.worker.start()
+            self.root.after(PROGRESS_POLL_MS, self._poll_progress)
+            return
+
+        started = time.perf_counter()
+        groups, duplicates = sweep.counts(threshold)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        self.var.threshold = threshold
+        self.threshold_entry.delete(0, tk.END)
+        self.threshold_entry.insert(0, str(threshold))
+        self.status_label.config(
+            text=f"Threshold {threshold}: {groups} groups, {duplicates} duplicates ({elapsed_ms:.0f} ms). Press Analyze and Run to use it."
+        )
+
+    def _report_progress(self, files_found, files_done, discovery_done):
+        # Runs on the worker thread, once per file; only a few updates per
+        # second are passed on to the UI.
+        now = time.monotonic()
+        if now - self._last_progress >= PROGRESS_POLL_MS / 1000.0 or (discovery_done and files_done == files_found):
+            self._last_progress = now
+            self.progress_queue.put(('progress', (files_found, files_done, discovery_done)))
 
+    def _set_status(self, text):
+        # Safe to call from the worker thread.
+        self.progress_queue.put(('status', text))
+
+    def _run_sweep(self, max_threshold):
+        """
+        Finds the pairs of the last scan up to max_threshold. Runs on the
+        worker thread and must not touch any widget.
+        """
+        logger = logging.getLogger(__name__)
+        try:
+            _cli.prepare_threshold_sweep(self.var, max_threshold)
+        except Exception as e:
+            self.pending_threshold = None
+            error_message = f"An error occurred: {e}"
+            self._set_status(error_message)
+            logger.error(error_message)
+            traceback.print_exc()
+        finally:
+            self.progress_queue.put(('done', None))
+
+    def _run_analysis(self, show_full_logs, regroup=False):
+        """
+        This function orchestrates the analysis and deletion process for the
+        GUI. It runs on the worker thread and must not touch any widget.
+
+        With regroup, the files of the last scan are regrouped at the new
+        threshold instead of being scanned again.
+        """
+        # Imported here, on the worker thread, so the window does not wait
+        # for NumPy and Pillow to load.
+        from cli_backup.functions import delete_duplicates
+
+        logger = logging.getLogger(__name__)
+
+        try:
             logger.info("\n***************")
             logger.info("Starting Script")
             logger.info("***************\n")
 
-            duplicate_groups = _cli.find_and_group_duplicates(self.var)
+            if regroup:
+                duplicate_groups = _cli.regroup_duplicates(self.var)
+            else:
+                duplicate_groups = _cli.find_and_group_duplicates(self.var)
             self.var.duplicate_groups = duplicate_groups
 
+            if self.cancel_event.is_set():
+                self._set_status("Analysis cancelled. No files were deleted.")
+                return
+
             if not duplicate_groups:
-                self.status_label.config(text="No duplicates or an error occurred.")
+                self._set_status("No duplicates or an error occurred.")
                 return
 
-            total_files_to_delete = sum(len(group) - 1 for group in duplicate_groups)
+            total_files_to_delete = duplicate_groups.total_duplicates()
             
             if total_files_to_delete > 0:
                 if self.var.dry_run == False :
                     logger.info("Dry Run is NOT checked. Proceeding with deletion.")
+                    # The last scan no longer matches the files on disk.
+                    self.var.image_hashes = self.var.threshold_sweep = None
                     delete_duplicates(self.var, deletion_strategy=self.var.strategy)
-                    self.status_label.config(text="Analysis finished. Duplicates deleted.")
+                    self._set_status("Analysis finished. Duplicates deleted.")
                 
-                elif self.var.dry_run == True and self.show_full_logs.get() == True:
+                elif self.var.dry_run == True and show_full_logs == True:
                     
                     logger.info("Dry Run is checked. Showing Full Logs.")
                     delete_duplicates(self.var, deletion_strategy=self.var.strategy)
-                    self.status_label.config(text="Analysis finished. Duplicates deleted.")
+                    self._set_status("Analysis finished. Duplicates deleted.")
                 
-                elif self.var.dry_run == True and self.show_full_logs.get() == False:
+                elif self.var.dry_run == True and show_full_logs == False:
                     logger.info("Dry Run is checked & not showing Full logs")
-                    self.status_label.config(text=f"Analysis finished. Found {total_files_to_delete} duplicates. Deletion not requested.")
+                    self._set_status(f"Analysis finished. Found {total_files_to_delete} duplicates. Deletion not requested.")
 
                 else:
                     logger.error("Some error in catching the conditions")
             else:
-                self.status_label.config(text="Analysis finished. No duplicates found.")
+                self._set_status("Analysis finished. No duplicates found.")
 
             logger.info("\n************")
             logger.info("Script Ended")
@@ -96,11 +242,67 @@ class MyTinkerApp:
 
         except Exception as e:
             error_message = f"An error occurred: {e}"
-            self.status_label.config(text=error_message)
+            self._set_status(error_message)
             logger.error(error_message)
             traceback.print_exc()
+        finally:
+            self.progress_queue.put(('done', None))
+
+    def _poll_progress(self):
+        """
+        Applies the updates queued by the worker thread. Reschedules itself
+        with root.after until the worker is done.
+        """
+        finished = False
+        while True:
+            try:
+                kind, payload = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == 'progress':
+                self._show_progress(*payload)
+            elif kind == 'status':
+                self.status_label.config(text=payload)
+            elif kind == 'done':
+                finished = True
+
+        if finished:
+            # The thread may still be exiting.
+            self.worker = None
+            self.analyze_button.config(state=tk.NORMAL)
+            self.cancel_button.config(state=tk.DISABLED)
+            sweep = self.var.threshold_sweep
+            if sweep is not None:
+                self.threshold_scale.config(state=tk.NORMAL, to=sweep.max_threshold)
+                if self.pending_threshold is not None:
+                    self.regroup_at(self.pending_threshold)
+            elif self.var.image_hashes is not None:
+                self.threshold_scale.config(state=tk.NORMAL, to=self.var.threshold + SWEEP_MARGIN)
+            self.pending_threshold = None
+            self.threshold_scale.set(self.var.threshold)
+            self.var.progress_callback = None
+            self.var.cancel_event = None
+        else:
+            self.root.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def _show_progress(self, files_found, files_done, discovery_done):
+        if self.cancel_event.is_set():
+            return
+        self.progress_bar.config(maximum=max(files_found, 1), value=files_done)
+
+        elapsed = time.monotonic() - self.scan_started
+        if not discovery_done:
+            text = f"Hashed {files_done} files, {files_found} found so far..."
+        elif files_done < files_found and files_done > 0:
+            remaining = (files_found - files_done) * elapsed / files_done
+            text = f"Hashed {files_done} of {files_found} files, about {remaining:.0f}s left..."
+        else:
+            text = f"Hashed {files_done} of {files_found} files. Grouping duplicates..."
+        self.status_label.config(text=text)
 
 def main():
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = MyTinkerApp(root)
     root.mainloop()
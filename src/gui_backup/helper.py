@@ -3,7 +3,8 @@
 import os
 import logging
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from collections import deque
+from tkinter import filedialog, messagebox, ttk
 
 # Get a logger instance. This logger will use the handlers configured in app.py
 # The name `__name__` ensures that the logger is unique to this module.
@@ -12,28 +13,65 @@ logger = logging.getLogger(__name__)
 class TkinterTextHandler(logging.Handler):
     """
     A custom logging handler that redirects log messages to a Tkinter Text widget.
+
+    Records can be emitted from any thread. They are queued and written to the
+    widget in batches from the Tk main loop, with a single insert and scroll
+    per batch, and the oldest lines are dropped once the widget holds more
+    than max_lines lines.
     """
-    def __init__(self, text_widget):
+
+    # How often queued records are written to the widget, in milliseconds.
+    FLUSH_INTERVAL_MS = 100
+    # Most records written per flush, so a flood of records cannot stall the UI.
+    MAX_RECORDS_PER_FLUSH = 2000
+
+    def __init__(self, text_widget, max_lines=5000):
         super().__init__()
         self.text_widget = text_widget
+        self.max_lines = max_lines
         self.text_widget.config(state=tk.DISABLED) # Make the widget read-only
         self.setFormatter(logging.Formatter('%(message)s'))
+        self._pending = deque()
+        self.text_widget.after(self.FLUSH_INTERVAL_MS, self._poll)
 
     def emit(self, record):
         """
-        Emits a log record to the Tkinter Text widget.
+        Queues a log record for the Tkinter Text widget.
         """
-        # Format the log message
-        msg = self.format(record)
-        
+        try:
+            self._pending.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def drain(self):
+        """
+        Writes queued records to the widget. Must run on the Tk main thread.
+        """
+        if not self._pending:
+            return
+        messages = []
+        while self._pending and len(messages) < self.MAX_RECORDS_PER_FLUSH:
+            messages.append(self._pending.popleft())
+
         # Enable the widget to insert text, then disable it again
         self.text_widget.config(state=tk.NORMAL)
-        self.text_widget.insert(tk.END, msg + '\n')
+        self.text_widget.insert(tk.END, '\n'.join(messages) + '\n')
+        line_count = int(self.text_widget.index('end-1c').split('.')[0])
+        if line_count > self.max_lines:
+            self.text_widget.delete('1.0', f'{line_count - self.max_lines + 1}.0')
         self.text_widget.config(state=tk.DISABLED)
-        
+
         # Scroll to the bottom to show the newest log message
         self.text_widget.see(tk.END)
 
+    def _poll(self):
+        try:
+            self.drain()
+        except tk.TclError:
+            # The widget was destroyed.
+            return
+        self.text_widget.after(self.FLUSH_INTERVAL_MS, self._poll)
+
 def setup_gui(app):
     """
     Configures all the GUI widgets and their layout,
@@ -76,16 +114,38 @@ def setup_gui(app):
     app.show_full_logs_btn = tk.Checkbutton(input_frame, text="Show Full Logs", variable=app.show_full_logs)
     app.show_full_logs_btn.grid(row=7, column=0, sticky=tk.W, columnspan=2)
 
+    # Worker Processes Input (0 means one per CPU core)
+    app.workers_label = tk.Label(input_frame, text="Worker Processes (0 = all cores):")
+    app.workers_label.grid(row=8, column=0, padx=5, pady=5, sticky="e")
+    app.workers_entry = tk.Entry(input_frame, width=10)
+    app.workers_entry.insert(0, str(app.var.workers))
+    app.workers_entry.grid(row=8, column=1, padx=5, pady=5)
+
+    # Live threshold, enabled once a scan has finished: moving it regroups the
+    # files of that scan without rescanning them.
+    app.threshold_scale_label = tk.Label(input_frame, text="Live Threshold:")
+    app.threshold_scale_label.grid(row=9, column=0, padx=5, pady=5, sticky="e")
+    app.threshold_scale = tk.Scale(input_frame, from_=0, to=app.var.threshold, orient=tk.HORIZONTAL, command=app.regroup_at)
+    app.threshold_scale.set(app.var.threshold)
+    app.threshold_scale.config(state=tk.DISABLED)
+    app.threshold_scale.grid(row=9, column=1, padx=5, pady=5, sticky="ew")
+
     button_frame = tk.Frame(app.root)
     button_frame.pack(pady=0)
     app.analyze_button = tk.Button(button_frame, text="Analyze and Run", command=app.analyze_and_run)
     app.analyze_button.pack(side=tk.LEFT, padx=5)
+    app.cancel_button = tk.Button(button_frame, text="Cancel", command=app.cancel_analysis, state=tk.DISABLED)
+    app.cancel_button.pack(side=tk.LEFT, padx=5)
     app.clear_button = tk.Button(button_frame, text="Clear Log", command=lambda: [clear_log(app.log_text), app.status_label.config(text="All Logs Cleared")])
     app.clear_button.pack(side=tk.LEFT, padx=5)
         
     app.status_label = tk.Label(app.root, text="")
     app.status_label.pack(pady=5)
 
+    # Progress of the running scan
+    app.progress_bar = ttk.Progressbar(app.root, orient=tk.HORIZONTAL, length=400, mode='determinate')
+    app.progress_bar.pack(pady=(0, 5))
+
     # --- FRAME FOR LOGS ---
     log_frame = tk.Frame(app.root)
     log_frame.pack(pady=(0, 10), fill=tk.BOTH, expand=True)
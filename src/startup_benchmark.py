@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+
+from cli_backup.logger import loggerSetup
+
+logger = logging.getLogger(__name__)
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must not be imported just to start up, per entry point.
+HEAVY_MODULES = ('numpy', 'PIL', 'imagehash', 'scipy', 'pywt')
+FORBIDDEN_MODULES = {
+    '_cli': HEAVY_MODULES + ('tkinter',),
+    'gui': HEAVY_MODULES,
+}
+
+# Computes a dhash with the default backend, then reports what was imported.
+_HASH_SNIPPET = """
+import sys, json
+from PIL import Image
+from cli_backup.functions import compute_image_hash
+compute_image_hash(Image.new('RGB', (64, 64)), 'dhash', 8)
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def _run_python(args):
+    return subprocess.run(
+        [sys.executable] + args, cwd=SRC_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True,
+    )
+
+
+def import_time_us(module):
+    """
+    Returns:
+        int: The cumulative import time of a module in a fresh interpreter,
+             as reported by -X importtime, in microseconds.
+    """
+    result = _run_python(['-X', 'importtime', '-c', f"import {module}"])
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def imported_modules(code):
+    """
+    Returns:
+        set: The top-level packages imported after running code in a fresh
+             interpreter. The code must print sorted(sys.modules) as JSON.
+    """
+    result = _run_python(['-c', code])
+    return {name.split('.')[0] for name in json.loads(result.stdout.splitlines()[-1])}
+
+
+def help_seconds(runs):
+    """
+    Returns:
+        list: The wall time of every run of '_cli.py --help', interpreter
+              start-up included.
+    """
+    times = []
+    for _ in range(runs):
+        result = _run_python(['-c', (
+            "import time, subprocess, sys; start = time.perf_counter(); "
+            "subprocess.run([sys.executable, '_cli.py', '--help'], stdout=subprocess.DEVNULL, check=True); "
+            "print(time.perf_counter() - start)"
+        )])
+        times.append(float(result.stdout))
+    return times
+
+
+def run_benchmarks(runs):
+    """
+    Measures the start-up cost of the entry points and checks that none of
+    them imports a heavy module it does not need.
+
+    Returns:
+        dict: The JSON-serializable report, with a list of 'regressions'.
+    """
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'entry_points': {},
+        'regressions': [],
+    }
+
+    for module, forbidden in FORBIDDEN_MODULES.items():
+        code = f"import sys, json, {module}; print(json.dumps(sorted(sys.modules)))"
+        try:
+            loaded = imported_modules(code)
+        except subprocess.CalledProcessError as e:
+            # tkinter is not installed everywhere (e.g. slim Docker images).
+            logger.warning(f"Could not import {module}: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        heavy = sorted(set(forbidden) & loaded)
+        report['entry_points'][module] = {
+            'import_us': [import_time_us(module) for _ in range(runs)],
+            'heavy_modules': heavy,
+        }
+        if heavy:
+            report['regressions'].append(f"Importing {module} imports {', '.join(heavy)}")
+
+    loaded = imported_modules(_HASH_SNIPPET)
+    heavy = sorted({'imagehash', 'scipy', 'pywt'} & loaded)
+    report['default_dhash_heavy_modules'] = heavy
+    if heavy:
+        report['regressions'].append(f"Computing a dhash imports {', '.join(heavy)}")
+
+    report['help_seconds'] = help_seconds(runs)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the import and start-up time of the entry points, to guard against import-time regressions."
+    )
+
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="Number of fresh interpreters started per measurement. (default: 5)"
+    )
+
+    parser.add_argument(
+        "--budget_ms",
+        type=float,
+        default=None,
+        help="Fail if the median time of '_cli.py --help' exceeds this many milliseconds. (default: no budget)"
+    )
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default='startup_results.json',
+        help="Path of the JSON report. (default: 'startup_results.json')"
+    )
+
+    args = parser.parse_args()
+
+    loggerSetup()
+
+    report = run_benchmarks(args.runs)
+
+    for module, results in report['entry_points'].items():
+        logger.info(f"import {module}: {statistics.median(results['import_us']) / 1000:.1f} ms (median)")
+    help_ms = statistics.median(report['help_seconds']) * 1000
+    logger.info(f"_cli.py --help: {help_ms:.1f} ms (median, interpreter start-up included)")
+    if args.budget_ms is not None and help_ms > args.budget_ms:
+        report['regressions'].append(f"_cli.py --help took {help_ms:.1f} ms, over the {args.budget_ms:.1f} ms budget")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+    for regression in report['regressions']:
+        logger.error(regression)
+    sys.exit(1 if report['regressions'] else 0)
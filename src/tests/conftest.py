@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The modules are imported as `cli_backup.<module>` and `_cli`, as when the
+# tools are run from src.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def corpus_dir(tmp_path_factory):
+    """
+    A small synthetic corpus of originals and near-duplicate variants, split
+    over two directories.
+    """
+    from cli_backup.corpus import generate_corpus
+
+    root = tmp_path_factory.mktemp('corpus')
+    for seed, name in enumerate(('a', 'b')):
+        generate_corpus(str(root / name), 15, seed=seed)
+    return str(root)
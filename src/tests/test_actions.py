@@ -0,0 +1,82 @@
+import os
+
+from PIL import Image
+
+from cli_backup.actions import apply_plan, read_journal, undo_journal
+from cli_backup.functions import delete_duplicates, get_image_hashes
+from cli_backup.search_index import DuplicateIndex
+from cli_backup.variables import Variables
+
+
+def test_quarantine_with_relative_paths_undoes_from_anywhere(tmp_path, monkeypatch):
+    images = tmp_path / 'images'
+    images.mkdir()
+    (tmp_path / 'elsewhere').mkdir()
+    for name in ('kept.jpg', 'copy.jpg'):
+        (images / name).write_bytes(b'image')
+
+    monkeypatch.chdir(str(tmp_path))
+    var = Variables()
+    var.target_directory = 'images'
+    var.action = 'quarantine'
+    var.quarantine_dir = 'quarantine'
+    var.journal_path = 'journal.jsonl'
+    assert apply_plan(var, [('images/kept.jpg', ['images/copy.jpg'])]) == 1
+    assert not (images / 'copy.jpg').exists()
+
+    _, entries = read_journal('journal.jsonl')
+    assert entries == [[
+        str(images / 'copy.jpg'), str(images / 'kept.jpg'), str(tmp_path / 'quarantine' / 'copy.jpg')
+    ]]
+
+    # A resumed run recognizes the file, whatever form its path is given in.
+    assert apply_plan(var, [('images/kept.jpg', [str(images / 'copy.jpg')])]) == 0
+
+    monkeypatch.chdir(str(tmp_path / 'elsewhere'))
+    assert undo_journal(os.path.join('..', 'journal.jsonl')) == 1
+    assert (images / 'copy.jpg').read_bytes() == b'image'
+
+
+def _run(directory, action, strategy):
+    var = Variables()
+    var.target_directory = str(directory)
+    var.threshold = 10
+    var.strategy = strategy
+    var.dry_run = False
+    var.action = action
+    index = DuplicateIndex(var.threshold)
+    get_image_hashes(var, var.hash_size, var.hash_method, index=index)
+    var.duplicate_groups = index.groups()
+    delete_duplicates(var, strategy)
+
+
+def test_a_link_left_by_an_earlier_run_never_replaces_its_target(tmp_path):
+    image = Image.effect_mandelbrot((128, 128), (-2, -1.5, 1, 1.5), 50).convert('RGB')
+    image.save(tmp_path / 'a.jpg', quality=95)
+    image.save(tmp_path / 'z.jpg', quality=60)
+    z_content = (tmp_path / 'z.jpg').read_bytes()
+
+    _run(tmp_path, 'symlink', 'keep_smallest')
+    assert os.path.islink(tmp_path / 'a.jpg')
+    assert os.path.realpath(tmp_path / 'a.jpg') == str(tmp_path / 'z.jpg')
+
+    # The link is not scanned, so the second run finds nothing to delete.
+    _run(tmp_path, 'delete', 'keep_first')
+    assert (tmp_path / 'z.jpg').read_bytes() == z_content
+    assert (tmp_path / 'a.jpg').read_bytes() == z_content
+
+
+def test_a_plan_that_keeps_a_link_keeps_its_target(tmp_path):
+    (tmp_path / 'z.jpg').write_bytes(b'image')
+    os.symlink(tmp_path / 'z.jpg', tmp_path / 'a.jpg')
+    (tmp_path / 'b.jpg').write_bytes(b'image')
+
+    var = Variables()
+    var.target_directory = str(tmp_path)
+    plan = [(str(tmp_path / 'a.jpg'), [str(tmp_path / 'b.jpg'), str(tmp_path / 'z.jpg')])]
+    # b.jpg is deleted; z.jpg is kept, and a.jpg, which resolves to it, is
+    # left alone.
+    assert apply_plan(var, plan) == 1
+    assert not (tmp_path / 'b.jpg').exists()
+    assert (tmp_path / 'z.jpg').read_bytes() == b'image'
+    assert os.path.islink(tmp_path / 'a.jpg')
@@ -0,0 +1,106 @@
+import os
+import shutil
+import tarfile
+import zipfile
+
+from cli_backup.actions import apply_plan
+from cli_backup.archives import file_size, is_archive_member, member_path, split_member_path
+from cli_backup.functions import get_image_hashes
+from cli_backup.scanner import iter_image_files
+from cli_backup.variables import Variables
+
+
+def _scan(target_directory, cache_path=None):
+    var = Variables()
+    var.target_directory = target_directory
+    var.scan_archives = True
+    var.cache_path = cache_path
+    hashes_map = get_image_hashes(var, 8, 'dhash')
+    hashes = {path: image_hash for image_hash, paths in hashes_map.items() for path in paths}
+    return hashes, var.metrics.counters
+
+
+def _archived_tree(corpus_dir, tmp_path):
+    # Loose images, and the same images again in a zip and a tar.gz archive.
+    target = tmp_path / 'tree'
+    shutil.copytree(os.path.join(corpus_dir, 'a', '0000'), str(target / 'loose'))
+    names = sorted(os.listdir(target / 'loose'))[:6]
+    with zipfile.ZipFile(target / 'photos.zip', 'w') as archive:
+        for name in names[:3]:
+            archive.write(target / 'loose' / name, f"inner/{name}")
+        archive.writestr('notes.txt', 'not an image')
+    with tarfile.open(target / 'photos.tar.gz', 'w:gz') as archive:
+        for name in names[3:]:
+            archive.add(str(target / 'loose' / name), name)
+    return target, names
+
+
+def test_member_paths_split_at_the_archive():
+    path = member_path('/photos/a!/b.zip', 'inner/c.jpg')
+    assert path == '/photos/a!/b.zip!/inner/c.jpg'
+    assert split_member_path(path) == ('/photos/a!/b.zip', 'inner/c.jpg')
+    assert split_member_path('/photos/a!/b.jpg') is None
+    assert is_archive_member('x.tar.gz!/y.png') and not is_archive_member('x.tar.gz')
+
+
+def test_members_are_hashed_like_the_loose_files(corpus_dir, tmp_path):
+    target, names = _archived_tree(corpus_dir, tmp_path)
+    hashes, counters = _scan(str(target))
+
+    zip_path, tar_path = str(target / 'photos.zip'), str(target / 'photos.tar.gz')
+    members = {member_path(zip_path, f"inner/{name}"): name for name in names[:3]}
+    members.update({member_path(tar_path, name): name for name in names[3:]})
+    assert set(members) == {path for path in hashes if is_archive_member(path)}
+    for path, name in members.items():
+        assert hashes[path] == hashes[str(target / 'loose' / name)]
+        assert file_size(path) == os.path.getsize(target / 'loose' / name)
+    assert counters['archives_found_total'] == 2
+    assert counters['files_found_total'] == len(list(iter_image_files(str(target)))) + 6
+
+
+def test_members_are_cached_until_they_change(corpus_dir, tmp_path):
+    target, names = _archived_tree(corpus_dir, tmp_path)
+    cache_path = str(tmp_path / 'cache.db')
+    hashes, counters = _scan(str(target), cache_path)
+    assert counters['cache_hits_total'] == 0
+
+    rescanned, counters = _scan(str(target), cache_path)
+    assert rescanned == hashes
+    assert counters['cache_hits_total'] == counters['files_found_total']
+
+    # Replacing one zip member changes its CRC, so only it is hashed again.
+    # Tar members carry no checksum, so they follow the archive's mtime.
+    zip_path = str(target / 'photos.zip')
+    with zipfile.ZipFile(zip_path, 'w') as archive:
+        archive.write(target / 'loose' / names[5], f"inner/{names[0]}")
+        for name in names[1:3]:
+            archive.write(target / 'loose' / name, f"inner/{name}")
+    os.utime(target / 'photos.tar.gz', ns=(1, 1))
+    rescanned, counters = _scan(str(target), cache_path)
+    assert counters['cache_hits_total'] == counters['files_found_total'] - 4
+    assert rescanned[member_path(zip_path, f"inner/{names[0]}")] == hashes[str(target / 'loose' / names[5])]
+
+
+def test_members_are_never_changed(corpus_dir, tmp_path):
+    target, names = _archived_tree(corpus_dir, tmp_path)
+    zip_path = str(target / 'photos.zip')
+    with open(zip_path, 'rb') as f:
+        content = f.read()
+
+    var = Variables()
+    var.target_directory = str(target)
+    loose = str(target / 'loose' / names[0])
+    plan = [(loose, [member_path(zip_path, f"inner/{names[0]}")])]
+    assert apply_plan(var, plan) == 0
+    with open(zip_path, 'rb') as f:
+        assert f.read() == content
+    assert os.path.exists(loose)
+
+
+def test_corrupt_archives_are_logged_and_skipped(corpus_dir, tmp_path, caplog):
+    target, _ = _archived_tree(corpus_dir, tmp_path)
+    (target / 'broken.zip').write_bytes(b'PK\x03\x04 not really a zip')
+    hashes, _ = _scan(str(target))
+    assert not any(path.startswith(str(target / 'broken.zip')) for path in hashes)
+    assert sum(map(is_archive_member, hashes)) == 6
+    assert 'Could not read archive' in caplog.text
@@ -0,0 +1,68 @@
+import json
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+from cli_backup.backends import HASH_BACKENDS, get_hash_function, register_backend
+from cli_backup.corpus import generate_image
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _images():
+    rng = random.Random(0)
+    images = [generate_image(random.Random(seed)) for seed in range(4)]
+    noise = Image.frombytes('L', (97, 61), bytes(rng.getrandbits(8) for _ in range(97 * 61)))
+    images += [noise, noise.convert('RGBA'), Image.new('RGB', (40, 40), (7, 7, 7)), images[0].convert('P')]
+    return images
+
+
+@pytest.mark.parametrize('hash_method', ['ahash', 'dhash'])
+def test_numpy_backend_matches_imagehash(hash_method):
+    numpy_hash = get_hash_function(hash_method, 'numpy')
+    imagehash_hash = get_hash_function(hash_method, 'imagehash')
+    for img in _images():
+        for hash_size in (2, 7, 8, 16):
+            assert numpy_hash(img, hash_size) == imagehash_hash(img, hash_size)
+
+
+def test_backends_are_looked_up_by_method():
+    assert get_hash_function('dhash') is HASH_BACKENDS['numpy']['dhash']
+    # The numpy backend has no phash, so auto falls back to imagehash.
+    assert get_hash_function('phash') is HASH_BACKENDS['imagehash']['phash']
+    with pytest.raises(ValueError):
+        get_hash_function('phash', 'numpy')
+    with pytest.raises(ValueError):
+        get_hash_function('md5')
+
+    register_backend('constant', {'dhash': lambda img, hash_size: '0' * (hash_size * hash_size // 4)})
+    try:
+        assert get_hash_function('dhash', 'constant')(Image.new('L', (8, 8)), 8) == '0' * 16
+    finally:
+        del HASH_BACKENDS['constant']
+
+
+def _imported_modules(code):
+    result = subprocess.run(
+        [sys.executable, '-c', code + "\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))"],
+        cwd=SRC_DIR, stdout=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def test_starting_up_does_not_import_heavy_modules():
+    heavy = {'numpy', 'PIL', 'imagehash', 'scipy', 'pywt'}
+    assert not _imported_modules("import _cli") & (heavy | {'tkinter'})
+    assert not _imported_modules("import gui") & heavy
+
+    # They are imported once an image is hashed.
+    hashed = _imported_modules(
+        "from PIL import Image\n"
+        "from cli_backup.functions import compute_image_hash\n"
+        "compute_image_hash(Image.new('RGB', (64, 64)), 'dhash', 8)"
+    )
+    assert {'numpy', 'PIL'} <= hashed
@@ -0,0 +1,99 @@
+import os
+
+from PIL import Image
+
+from cli_backup.cache import HashCache
+from cli_backup.functions import get_image_hashes
+from cli_backup.variables import Variables
+
+
+def _write_image(path, shade):
+    img = Image.new('RGB', (64, 64), (shade, shade, shade))
+    for x in range(0, 64, 8):
+        for y in range(64):
+            img.putpixel((x, y), (255 - shade, 0, shade))
+    img.save(path)
+
+
+def _scan(directory, cache_path):
+    var = Variables()
+    var.target_directory = str(directory)
+    var.cache_path = str(cache_path)
+    hashes_map = get_image_hashes(var, 8, 'dhash')
+    hashes = {path: image_hash for image_hash, paths in hashes_map.items() for path in paths}
+    return hashes, var.metrics.counters['cache_hits_total']
+
+
+def test_lookup_requires_matching_size_mtime_method_and_size(tmp_path):
+    cache = HashCache(str(tmp_path / 'cache.db'))
+    cache.store('a.jpg', 10, 100, 'dhash', 8, 'ff00ff00ff00ff00')
+    cache.flush()
+
+    assert cache.lookup('a.jpg', 10, 100, 'dhash', 8) == 'ff00ff00ff00ff00'
+    assert cache.lookup('a.jpg', 11, 100, 'dhash', 8) is None
+    assert cache.lookup('a.jpg', 10, 101, 'dhash', 8) is None
+    assert cache.lookup('a.jpg', 10, 100, 'phash', 8) is None
+    assert cache.lookup('a.jpg', 10, 100, 'dhash', 16) is None
+    assert (cache.hits, cache.misses) == (1, 4)
+    cache.close()
+
+
+def test_entries_persist_until_invalidated(tmp_path):
+    cache_path = str(tmp_path / 'cache.db')
+    cache = HashCache(cache_path)
+    cache.store('a.jpg', 10, 100, 'dhash', 8, 'ff00ff00ff00ff00')
+    cache.close()
+
+    cache = HashCache(cache_path)
+    assert cache.lookup('a.jpg', 10, 100, 'dhash', 8) == 'ff00ff00ff00ff00'
+    cache.invalidate()
+    assert cache.lookup('a.jpg', 10, 100, 'dhash', 8) is None
+    cache.close()
+
+    cache = HashCache(cache_path)
+    assert cache.lookup('a.jpg', 10, 100, 'dhash', 8) is None
+    cache.close()
+
+
+def test_evict_missing_drops_files_not_seen(tmp_path):
+    cache = HashCache(str(tmp_path / 'cache.db'))
+    kept, deleted = str(tmp_path / 'kept.jpg'), str(tmp_path / 'deleted.jpg')
+    cache.store(kept, 10, 100, 'dhash', 8, '00')
+    cache.store(deleted, 10, 100, 'dhash', 8, '11')
+    cache.flush()
+
+    cache.lookup(kept, 10, 100, 'dhash', 8)
+    assert cache.evict_missing(str(tmp_path)) == 1
+    assert cache.lookup(kept, 10, 100, 'dhash', 8) == '00'
+    assert cache.lookup(deleted, 10, 100, 'dhash', 8) is None
+    cache.close()
+
+
+def test_rescan_hits_the_cache_until_a_file_changes(tmp_path):
+    images = tmp_path / 'images'
+    images.mkdir()
+    for shade in range(4):
+        _write_image(str(images / f"{shade}.png"), shade * 60)
+    cache_path = tmp_path / 'cache.db'
+
+    first, hits = _scan(images, cache_path)
+    assert len(first) == 4 and hits == 0
+
+    second, hits = _scan(images, cache_path)
+    assert second == first and hits == 4
+
+    # A touched file is hashed again; a rewritten one gets its new hash.
+    changed = str(images / '0.png')
+    stat = os.stat(changed)
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    third, hits = _scan(images, cache_path)
+    assert third == first and hits == 3
+
+    Image.new('RGB', (64, 64), (255, 255, 255)).save(changed)
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    fourth, hits = _scan(images, cache_path)
+    assert hits == 3
+    assert fourth[changed] != first[changed]
+    assert {path: h for path, h in fourth.items() if path != changed} == {
+        path: h for path, h in first.items() if path != changed
+    }
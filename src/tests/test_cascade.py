@@ -0,0 +1,65 @@
+import json
+import os
+
+from cli_backup.cascade import default_verify_threshold, verify_groups
+from cli_backup.functions import get_image_hashes, hash_image_file
+from cli_backup.search_index import DuplicateIndex, popcount
+from cli_backup.variables import Variables
+
+
+def _originals(corpus_dir):
+    # The original every file of the corpus was made from.
+    originals = {}
+    for name in ('a', 'b'):
+        with open(os.path.join(corpus_dir, name, 'ground_truth.json')) as f:
+            for path, original in json.load(f)['files'].items():
+                originals[os.path.join(corpus_dir, name, *path.split('/'))] = (name, original)
+    return originals
+
+
+def _reference_verification(candidate_groups, hash_size, threshold):
+    # Regroups the files of every candidate group by comparing all pairs of
+    # their phashes, merging matches transitively.
+    confirmed = []
+    for group in candidate_groups:
+        values = [int(hash_image_file(path, hash_size, 'phash')[1], 16) for path in group]
+        labels = list(range(len(group)))
+        for j in range(len(group)):
+            for i in range(j):
+                if popcount(values[i] ^ values[j]) <= threshold:
+                    old, new = labels[i], labels[j]
+                    labels = [new if label == old else label for label in labels]
+        for label in set(labels):
+            members = sorted(path for path, other in zip(group, labels) if other == label)
+            if len(members) > 1:
+                confirmed.append(members)
+    return sorted(confirmed)
+
+
+def test_default_verify_threshold_scales_with_the_number_of_bits():
+    assert default_verify_threshold(10, 8, 16) == 40
+    assert default_verify_threshold(10, 8, 8) == 10
+    assert default_verify_threshold(5, 16, 8) == 1
+
+
+def test_verification_removes_false_candidates(corpus_dir):
+    var = Variables()
+    var.target_directory = corpus_dir
+    # Loose enough for the cheap hash to merge unrelated images.
+    var.threshold = 20
+    var.verify_method = 'phash'
+    var.verify_size = 16
+    index = DuplicateIndex(var.threshold)
+    get_image_hashes(var, 8, 'dhash', index=index)
+    candidates = index.groups()
+    confirmed = verify_groups(var, candidates)
+
+    originals = _originals(corpus_dir)
+    assert any(len({originals[path] for path in group}) > 1 for group in candidates)
+    assert all(len({originals[path] for path in group}) == 1 for group in confirmed)
+    assert confirmed.total_duplicates() < candidates.total_duplicates()
+
+    # Groups only ever shrink or split.
+    candidate_of = {path: number for number, group in enumerate(candidates) for path in group}
+    assert all(len({candidate_of[path] for path in group}) == 1 for group in confirmed)
+    assert sorted(confirmed) == _reference_verification(candidates, 16, default_verify_threshold(20, 8, 16))
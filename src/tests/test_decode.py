@@ -0,0 +1,76 @@
+import random
+
+import pytest
+from PIL import Image
+
+from cli_backup.corpus import generate_image
+from cli_backup.functions import FAST_DECODE_MIN_SIDE, get_image_hashes, hash_image_file, load_image
+from cli_backup.variables import Variables
+
+
+def _distance(hash1, hash2):
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count('1')
+
+
+@pytest.fixture(scope='module')
+def large_images(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('large')
+    paths = []
+    for seed, extension in enumerate(('jpg', 'png', 'jpg')):
+        path = str(directory / f"image{seed}.{extension}")
+        generate_image(random.Random(seed)).resize((2048, 1536)).save(path)
+        paths.append(path)
+    return str(directory), paths
+
+
+def test_fast_decode_is_small_and_grayscale(large_images):
+    _, paths = large_images
+    for path in paths:
+        img = load_image(path, 'fast', 8)
+        assert img.mode == 'L'
+        assert FAST_DECODE_MIN_SIDE <= min(img.size) < 2 * FAST_DECODE_MIN_SIDE
+        # The aspect ratio is kept.
+        assert abs(img.size[0] / img.size[1] - 4 / 3) < 0.05
+
+        # Larger hashes get a larger decode.
+        assert min(load_image(path, 'fast', 16).size) >= 16 * 16
+
+        full = load_image(path, 'full', 8)
+        assert (full.mode, full.size) == ('RGB', (2048, 1536))
+
+
+@pytest.mark.parametrize('hash_method', ['dhash', 'ahash', 'phash'])
+def test_fast_hashes_are_close_to_full_hashes(large_images, hash_method):
+    _, paths = large_images
+    for path in paths:
+        _, full_hash, error, _ = hash_image_file(path, 8, hash_method, 'full')
+        _, fast_hash, fast_error, _ = hash_image_file(path, 8, hash_method, 'fast')
+        assert error is None and fast_error is None
+        assert _distance(full_hash, fast_hash) <= 4
+
+
+def test_only_the_first_frame_is_decoded(tmp_path):
+    frames = [Image.new('RGB', (200, 200), color) for color in ((0, 0, 0), (255, 255, 255))]
+    frames[0].paste((255, 255, 255), (0, 0, 100, 200))
+    frames[0].save(tmp_path / 'animated.gif', save_all=True, append_images=frames[1:])
+    frames[0].save(tmp_path / 'first.gif')
+    for decode_mode in ('full', 'fast'):
+        assert (hash_image_file(str(tmp_path / 'animated.gif'), decode_mode=decode_mode)[1]
+                == hash_image_file(str(tmp_path / 'first.gif'), decode_mode=decode_mode)[1])
+
+
+def test_fast_hashes_are_cached_apart_from_full_hashes(large_images, tmp_path):
+    directory, paths = large_images
+
+    def scan(decode_mode):
+        var = Variables()
+        var.target_directory = directory
+        var.cache_path = str(tmp_path / 'cache.db')
+        var.decode_mode = decode_mode
+        get_image_hashes(var, 8, 'dhash')
+        return var.metrics.counters['cache_hits_total']
+
+    assert scan('fast') == 0
+    assert scan('full') == 0
+    assert scan('fast') == len(paths)
+    assert scan('full') == len(paths)
@@ -0,0 +1,108 @@
+import logging
+import queue
+import shutil
+import threading
+
+import pytest
+
+from cli_backup.functions import ScanCancelled, get_image_hashes
+from cli_backup.scanner import iter_image_files
+from cli_backup.variables import Variables
+
+gui = pytest.importorskip('gui')
+from gui_backup.helper import TkinterTextHandler
+
+
+def _worker_app(target_directory, dry_run):
+    # The parts of the app the worker thread uses; it never touches widgets.
+    app = gui.MyTinkerApp.__new__(gui.MyTinkerApp)
+    app.var = Variables()
+    app.var.target_directory = target_directory
+    app.var.threshold = 10
+    app.var.strategy = 'keep_first'
+    app.var.dry_run = dry_run
+    app.progress_queue = queue.Queue()
+    app.cancel_event = threading.Event()
+    app.var.cancel_event = app.cancel_event
+    app.var.progress_callback = app._report_progress
+    app._last_progress = 0.0
+    return app
+
+
+def _messages(app):
+    messages = []
+    while not app.progress_queue.empty():
+        messages.append(app.progress_queue.get_nowait())
+    return messages
+
+
+def test_progress_is_reported_up_to_the_last_file(corpus_dir):
+    updates = []
+    var = Variables()
+    var.target_directory = corpus_dir
+    var.progress_callback = lambda *update: updates.append(update)
+    get_image_hashes(var, 8, 'dhash')
+
+    num_files = len(list(iter_image_files(corpus_dir)))
+    assert updates[-1] == (num_files, num_files, True)
+    assert all(done <= found for found, done, _ in updates)
+    assert [found for found, _, _ in updates] == sorted(found for found, _, _ in updates)
+
+
+def test_cancelling_stops_the_scan_and_deletes_nothing(corpus_dir, tmp_path):
+    target = str(tmp_path / 'corpus')
+    shutil.copytree(corpus_dir, target)
+    num_files = len(list(iter_image_files(target)))
+
+    app = _worker_app(target, dry_run=False)
+
+    def report_progress(files_found, files_done, discovery_done):
+        if files_done >= 3:
+            app.cancel_event.set()
+
+    app.var.progress_callback = report_progress
+    with pytest.raises(ScanCancelled):
+        get_image_hashes(app.var, 8, 'dhash')
+
+    app.cancel_event.clear()
+    app.var.progress_callback = report_progress
+    app._run_analysis(show_full_logs=False)
+    assert _messages(app)[-2:] == [('status', "Analysis cancelled. No files were deleted."), ('done', None)]
+    assert len(list(iter_image_files(target))) == num_files
+
+
+def test_the_worker_reports_its_results_through_the_queue(corpus_dir):
+    app = _worker_app(corpus_dir, dry_run=True)
+    worker = threading.Thread(target=app._run_analysis, args=(False,))
+    worker.start()
+    worker.join()
+
+    messages = _messages(app)
+    num_files = len(list(iter_image_files(corpus_dir)))
+    assert ('progress', (num_files, num_files, True)) in messages
+    kind, status = messages[-2]
+    assert kind == 'status' and status.startswith("Analysis finished. Found ")
+    assert messages[-1] == ('done', None)
+    assert app.var.image_hashes is not None and len(app.var.image_hashes) == num_files
+
+
+def test_log_records_are_written_in_batches():
+    tk = pytest.importorskip('tkinter')
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip("no display")
+    try:
+        text = tk.Text(root)
+        handler = TkinterTextHandler(text, max_lines=100)
+        emitter = threading.Thread(
+            target=lambda: [handler.emit(logging.makeLogRecord({'msg': f"line {number}"})) for number in range(250)]
+        )
+        emitter.start()
+        emitter.join()
+        # Records are only written once the main loop drains them.
+        assert text.get('1.0', 'end-1c') == ''
+        handler.drain()
+        assert text.get('1.0', 'end-1c').splitlines() == [f"line {number}" for number in range(151, 250)]
+    finally:
+        root.destroy()
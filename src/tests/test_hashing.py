@@ -0,0 +1,42 @@
+from cli_backup.functions import get_image_hashes, hash_file_entries
+from cli_backup.scanner import FileEntry, iter_image_files
+from cli_backup.variables import Variables
+
+
+def _entries(corpus_dir, tmp_path):
+    entries = list(iter_image_files(corpus_dir))
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not an image')
+    # A file that fails in the middle of the stream, and one that is gone.
+    middle = len(entries) // 2
+    return entries[:middle] + [FileEntry(str(broken), 12, 0), FileEntry(str(tmp_path / 'gone.jpg'), 0, 0)] + entries[middle:]
+
+
+def test_parallel_hashing_matches_serial_hashing_in_order(corpus_dir, tmp_path):
+    entries = _entries(corpus_dir, tmp_path)
+    # More files than the workers take in one round of chunks.
+    assert len(entries) > 4 * 16
+
+    def results(workers):
+        return [
+            (entry.path, image_hash, error is not None)
+            for entry, image_hash, error in hash_file_entries(entries, 8, 'dhash', 'full', workers)
+        ]
+
+    serial = results(1)
+    assert [path for path, _, _ in serial] == [entry.path for entry in entries]
+    assert [failed for _, _, failed in serial].count(True) == 2
+    assert results(3) == serial
+
+
+def test_scan_with_workers_matches_serial_scan(corpus_dir):
+    num_files = len(list(iter_image_files(corpus_dir)))
+    hashes_maps = []
+    for workers in (1, 2):
+        var = Variables()
+        var.target_directory = corpus_dir
+        var.workers = workers
+        hashes_map = get_image_hashes(var, 8, 'dhash')
+        hashes_maps.append({image_hash: sorted(paths) for image_hash, paths in hashes_map.items()})
+        assert sum(map(len, hashes_map.values())) == num_files
+    assert hashes_maps[0] == hashes_maps[1]
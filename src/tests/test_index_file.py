@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from cli_backup.index_file import IndexFile, write_index_file
+from cli_backup.store import ImageStore
+
+
+def _store(count, num_bits, seed):
+    # Hashes clustered around a few centers, with some shared by several
+    # files, so that queries match at every threshold.
+    rng = random.Random(seed)
+    centers = [rng.getrandbits(num_bits) for _ in range(count // 20)]
+    store = ImageStore()
+    values = []
+    for number in range(count):
+        value = rng.choice(centers)
+        for _ in range(rng.randint(0, 10)):
+            value ^= 1 << rng.randrange(num_bits)
+        values.append(value)
+        store.add(f"{value:0{num_bits // 4}x}", f"/images/{number:05d}.jpg", number)
+    return store, values
+
+
+def _brute_force(values, query, threshold):
+    matches = []
+    for number, value in enumerate(values):
+        distance = bin(value ^ query).count('1')
+        if distance <= threshold:
+            matches.append((f"/images/{number:05d}.jpg", distance, number))
+    return sorted(matches, key=lambda match: (match[1], match[0]))
+
+
+@pytest.mark.parametrize('num_bits, thresholds', [(64, [0, 4, 8, 12, 24]), (256, [0, 16, 40])])
+def test_queries_match_brute_force(tmp_path, num_bits, thresholds):
+    store, values = _store(3000, num_bits, seed=num_bits)
+    index_path = str(tmp_path / 'index.bin')
+    write_index_file(index_path, store, '/images', 'dhash', int(num_bits ** 0.5), 'full')
+
+    rng = random.Random(0)
+    queries = values[:20] + [rng.getrandbits(num_bits) for _ in range(5)]
+    with IndexFile(index_path) as index_file:
+        assert len(index_file) == 3000
+        assert index_file.header['hash_method'] == 'dhash'
+        for threshold in thresholds:
+            for query in queries:
+                expected = _brute_force(values, query, threshold)
+                assert index_file.query(f"{query:0{num_bits // 4}x}", threshold) == expected
+        with pytest.raises(ValueError):
+            index_file.query('ff', 4)
+
+
+def test_small_thresholds_probe_the_neighbor_tables(tmp_path, monkeypatch):
+    store, values = _store(3000, 64, seed=1)
+    index_path = str(tmp_path / 'index.bin')
+    write_index_file(index_path, store, '/images', 'dhash', 8, 'full')
+
+    def scan(*args):
+        raise AssertionError("the query compared every hash")
+
+    monkeypatch.setattr(IndexFile, '_scan', staticmethod(scan))
+    with IndexFile(index_path) as index_file:
+        assert index_file.query(f"{values[0]:016x}", 8) == _brute_force(values, values[0], 8)
+
+
+def test_other_files_are_rejected(tmp_path):
+    (tmp_path / 'other.bin').write_bytes(b'not an index file at all')
+    with pytest.raises(ValueError):
+        IndexFile(str(tmp_path / 'other.bin'))
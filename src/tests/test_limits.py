@@ -0,0 +1,78 @@
+import os
+
+from cli_backup.functions import hash_file_entries
+from cli_backup.limits import FileLimits, DeadlinePool, LimitExceeded, _Worker
+from cli_backup.scanner import IMAGE_EXTENSIONS, iter_image_files
+
+
+def _task(kind, number):
+    if kind == 'stuck':
+        # A single call into C, which SIGALRM cannot interrupt.
+        sum(range(10 ** 12))
+    elif kind == 'crash':
+        os._exit(1)
+    return number
+
+
+def _failed(args, error, seconds):
+    return error
+
+
+def test_deadline_pool_stops_stuck_and_crashed_tasks():
+    tasks = [('ok', 0), ('stuck', 1), ('ok', 2), ('crash', 3)] + [('ok', number) for number in range(4, 20)]
+    pool = DeadlinePool(2)
+    try:
+        results = list(pool.map(_task, tasks, 0.2, _failed))
+    finally:
+        pool.shutdown()
+
+    assert isinstance(results[1], LimitExceeded) and results[1].limit == 'decode_timeout'
+    assert isinstance(results[3], str)
+    assert [result for number, result in enumerate(results) if number not in (1, 3)] == [
+        number for number in range(20) if number not in (1, 3)
+    ]
+
+
+class _SeemsAlive:
+    # A dead worker process that still reports itself alive, as one that
+    # dies between the check and the first task would.
+    def __init__(self, process):
+        self.process = process
+
+    def is_alive(self):
+        return True
+
+    def kill(self):
+        self.process.kill()
+
+    def join(self):
+        self.process.join()
+
+
+def test_deadline_pool_replaces_workers_that_died_while_idle():
+    pool = DeadlinePool(2)
+    try:
+        assert list(pool.map(_task, [('ok', 0), ('ok', 1)], 5, _failed)) == [0, 1]
+        assert len(pool._idle) == 2
+        for worker in pool._idle:
+            worker.process.kill()
+            worker.process.join()
+        pool._idle[0] = _Worker(_SeemsAlive(pool._idle[0].process), pool._idle[0].connection)
+
+        assert list(pool.map(_task, [('ok', number) for number in range(6)], 5, _failed)) == list(range(6))
+    finally:
+        pool.shutdown()
+
+
+def test_hashing_with_a_timeout_matches_hashing_without(corpus_dir):
+    entries = list(iter_image_files(corpus_dir, IMAGE_EXTENSIONS))
+    limits = FileLimits(None, None, 30)
+
+    def hashes(workers, limits=FileLimits(None, None, None)):
+        return [(entry.path, image_hash) for entry, image_hash, _ in hash_file_entries(
+            entries, 8, 'dhash', 'full', workers, limits=limits
+        )]
+
+    expected = hashes(1)
+    assert hashes(1, limits) == expected
+    assert hashes(2, limits) == expected
@@ -0,0 +1,65 @@
+import json
+import time
+
+import pytest
+
+from cli_backup.functions import get_image_hashes
+from cli_backup.metrics import Histogram, Metrics
+from cli_backup.scanner import iter_image_files
+from cli_backup.variables import Variables
+
+
+def test_histogram_counts_are_cumulative():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [(0.1, 2), (1.0, 3), (float('inf'), 4)]
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(2.65)
+
+
+def test_stages_add_up_and_are_written_as_json_and_prometheus(tmp_path):
+    metrics = Metrics()
+    for _ in range(2):
+        with metrics.stage('scan'):
+            time.sleep(0.01)
+    assert list(metrics.timed_iter('walk', iter([1, 2, 3]))) == [1, 2, 3]
+    metrics.count('files_found_total', 3)
+    metrics.count('files_found_total')
+    metrics.observe('decode_seconds', 0.002)
+
+    assert metrics.stages['scan']['calls'] == 2
+    assert metrics.stages['scan']['wall_seconds'] >= 0.02
+    # One call per item, and one for the end of the iterator.
+    assert metrics.stages['walk']['calls'] == 4
+
+    metrics.write_json(str(tmp_path / 'metrics.json'))
+    with open(tmp_path / 'metrics.json') as f:
+        written = json.load(f)
+    assert written['counters'] == {'files_found_total': 4}
+    assert written['stages']['scan']['calls'] == 2
+    assert written['histograms']['decode_seconds']['count'] == 1
+    assert written['histograms']['decode_seconds']['buckets'][-1] == ['+Inf', 1]
+
+    metrics.write_prometheus(str(tmp_path / 'metrics.prom'), prefix='test')
+    lines = (tmp_path / 'metrics.prom').read_text().splitlines()
+    assert 'test_files_found_total 4' in lines
+    assert '# TYPE test_files_found_total counter' in lines
+    assert any(line.startswith('test_stage_wall_seconds{stage="scan"} ') for line in lines)
+    assert 'test_decode_seconds_bucket{le="0.0025"} 1' in lines
+    assert 'test_decode_seconds_bucket{le="0.001"} 0' in lines
+    assert 'test_decode_seconds_count 1' in lines
+    # The temporary file was renamed into place.
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['metrics.json', 'metrics.prom']
+
+
+def test_a_scan_records_its_counters(corpus_dir):
+    var = Variables()
+    var.target_directory = corpus_dir
+    get_image_hashes(var, 8, 'dhash')
+    counters = var.metrics.counters
+    num_files = len(list(iter_image_files(corpus_dir)))
+    assert counters['files_found_total'] == num_files
+    assert counters['files_decoded_total'] + counters['exact_copies_total'] == num_files
+    assert var.metrics.histograms['decode_seconds'].count == counters['files_decoded_total']
+    assert 'walk' in var.metrics.stages
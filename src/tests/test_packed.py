@@ -0,0 +1,65 @@
+import random
+
+import numpy as np
+import pytest
+
+from cli_backup import packed as packed_module
+from cli_backup.packed import (
+    find_cross_pairs_bruteforce, find_pairs_bruteforce, hamming_distances, pack_hashes, unpack_to_ints,
+)
+
+
+def _random_hashes(count, num_bits, seed):
+    rng = random.Random(seed)
+    return [rng.getrandbits(num_bits) for _ in range(count)]
+
+
+def _hex(values, num_bits):
+    return [f"{value:0{(num_bits + 3) // 4}x}" for value in values]
+
+
+@pytest.mark.parametrize('num_bits', [64, 100, 256])
+def test_pack_round_trips(num_bits):
+    values = _random_hashes(50, num_bits, seed=num_bits)
+    packed = pack_hashes(_hex(values, num_bits), num_bits)
+    assert packed.dtype == np.uint64 and packed.flags['C_CONTIGUOUS']
+    assert packed.shape == (50, (num_bits + 63) // 64)
+    assert unpack_to_ints(packed) == values
+
+
+@pytest.mark.parametrize('num_bits', [64, 256])
+def test_kernels_match_python_popcount(num_bits):
+    values = _random_hashes(120, num_bits, seed=1)
+    # Near copies, so that small thresholds match something.
+    values += [value ^ (1 << (index % num_bits)) for index, value in enumerate(values[:40])]
+    packed = pack_hashes(_hex(values, num_bits), num_bits)
+
+    def distance(a, b):
+        return bin(a ^ b).count('1')
+
+    assert hamming_distances(packed, packed[3]).tolist() == [distance(values[3], value) for value in values]
+    assert hamming_distances(packed, packed[:5]).tolist() == [
+        [distance(query, value) for value in values] for query in values[:5]
+    ]
+
+    threshold = num_bits // 2 - 4
+    assert sorted(find_pairs_bruteforce(packed, threshold)) == [
+        (i, j, distance(values[i], values[j]))
+        for i in range(len(values)) for j in range(i + 1, len(values))
+        if distance(values[i], values[j]) <= threshold
+    ]
+    assert sorted(find_cross_pairs_bruteforce(packed[:30], packed[30:], threshold)) == [
+        (i, j, distance(values[i], values[30 + j]))
+        for i in range(30) for j in range(len(values) - 30)
+        if distance(values[i], values[30 + j]) <= threshold
+    ]
+
+
+def test_pairs_are_found_across_blocks(monkeypatch):
+    values = _random_hashes(40, 64, seed=2)
+    packed = pack_hashes(_hex(values, 64), 64)
+    expected = sorted(find_pairs_bruteforce(packed, 30))
+    # Blocks of one row each.
+    monkeypatch.setattr(packed_module, '_BLOCK_WORDS', 1)
+    assert sorted(find_pairs_bruteforce(packed, 30)) == expected
+    assert expected
@@ -0,0 +1,76 @@
+import threading
+import time
+
+from cli_backup.functions import get_image_hashes
+from cli_backup.prefetch import ReadAhead, ThrottledReader
+from cli_backup.scanner import FileEntry
+from cli_backup.variables import Variables
+
+
+def _files(tmp_path, count, size=1000):
+    entries = []
+    for number in range(count):
+        path = tmp_path / f"{number:03d}.bin"
+        path.write_bytes(bytes([number]) * size)
+        entries.append(FileEntry(str(path), size, 0))
+    return entries
+
+
+def test_contents_come_back_in_order(tmp_path):
+    entries = _files(tmp_path, 20)
+    entries.insert(5, FileEntry(str(tmp_path / 'missing.bin'), 10, 0))
+    contents = list(ReadAhead(threads=4).iter_contents(entries))
+    assert [entry for entry, _ in contents] == entries
+    assert contents[5][1] is None
+    assert [data for _, data in contents[:5] + contents[6:]] == [bytes([number]) * 1000 for number in range(20)]
+
+
+def test_reads_stay_within_the_byte_budget(tmp_path):
+    entries = _files(tmp_path, 30)
+    lock = threading.Lock()
+    started = []
+
+    def read_file(file_path):
+        with lock:
+            started.append(file_path)
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    read_ahead = ReadAhead(threads=8, byte_budget=3000, read_file=read_file)
+    for received, (entry, data) in enumerate(read_ahead.iter_contents(entries), 1):
+        time.sleep(0.002)
+        with lock:
+            assert len(started) - received <= 2
+    assert len(started) == 30
+
+
+def test_slow_reads_overlap(tmp_path):
+    entries = _files(tmp_path, 16)
+    read_ahead = ReadAhead(threads=8, read_file=ThrottledReader(latency=0.05))
+    start = time.perf_counter()
+    assert len(list(read_ahead.iter_contents(entries))) == 16
+    # 0.8 seconds if the reads were made one after the other.
+    assert time.perf_counter() - start < 0.5
+
+
+def test_stopping_early_drops_the_remaining_reads(tmp_path):
+    entries = _files(tmp_path, 50)
+    calls = []
+    read_ahead = ReadAhead(threads=2, byte_budget=2000, read_file=lambda path: calls.append(path) or b'')
+    contents = read_ahead.iter_contents(entries)
+    next(contents)
+    contents.close()
+    assert len(calls) < 10
+
+
+def test_a_scan_with_read_ahead_matches_a_plain_scan(corpus_dir):
+    hashes_maps = []
+    for threads in (0, 4):
+        var = Variables()
+        var.target_directory = corpus_dir
+        var.read_ahead_threads = threads
+        var.read_file = ThrottledReader(latency=0)
+        hashes_maps.append({image_hash: sorted(paths) for image_hash, paths in get_image_hashes(var).items()})
+        if threads:
+            assert var.metrics.counters['bytes_read_ahead_total'] > 0
+    assert hashes_maps[0] == hashes_maps[1]
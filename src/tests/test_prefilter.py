@@ -0,0 +1,50 @@
+import os
+
+from cli_backup.prefilter import ExactDuplicateFilter
+
+
+def _write(directory, name, data):
+    path = os.path.join(str(directory), name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _add(exact_filter, path):
+    return exact_filter.add(path, os.path.getsize(path)).path
+
+
+def test_byte_identical_files_share_a_group(tmp_path):
+    content = os.urandom(20000)
+    # Same size and same first and last KB, but a different middle.
+    changed = content[:10000] + bytes([content[10000] ^ 1]) + content[10001:]
+
+    exact_filter = ExactDuplicateFilter(partial_bytes=1024)
+    original = _write(tmp_path, 'original', content)
+    assert _add(exact_filter, original) == original
+    assert _add(exact_filter, _write(tmp_path, 'other', changed)) == os.path.join(str(tmp_path), 'other')
+    assert _add(exact_filter, _write(tmp_path, 'copy', content)) == original
+    assert _add(exact_filter, _write(tmp_path, 'small', b'abc')) == os.path.join(str(tmp_path), 'small')
+    assert _add(exact_filter, _write(tmp_path, 'small copy', b'abc')) == os.path.join(str(tmp_path), 'small')
+    assert _add(exact_filter, _write(tmp_path, 'small other', b'abd')) == os.path.join(str(tmp_path), 'small other')
+    assert exact_filter.duplicates_found == 2
+
+
+def test_files_with_a_unique_size_are_never_read(tmp_path):
+    exact_filter = ExactDuplicateFilter()
+    # Neither file exists, so reading either would fail.
+    first = exact_filter.add(str(tmp_path / 'missing'), 123)
+    second = exact_filter.add(str(tmp_path / 'also missing'), 456)
+    assert (first.partial, second.partial) == (None, None)
+    assert exact_filter.duplicates_found == 0
+
+
+def test_unreadable_earlier_file_is_replaced(tmp_path):
+    exact_filter = ExactDuplicateFilter()
+    gone = _write(tmp_path, 'gone', b'12345')
+    exact_filter.add(gone, 5)
+    os.remove(gone)
+
+    first = _write(tmp_path, 'first', b'12345')
+    assert _add(exact_filter, first) == first
+    assert _add(exact_filter, _write(tmp_path, 'second', b'12345')) == first
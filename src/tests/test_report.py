@@ -0,0 +1,74 @@
+import csv
+import json
+
+from cli_backup.functions import plan_deletions
+from cli_backup.report import CSV_COLUMNS, report_format_for, write_report
+from cli_backup.search_index import DuplicateIndex
+from cli_backup.variables import Variables
+
+
+def _var(tmp_path, output_name, output_format=None):
+    var = Variables()
+    var.output_path = str(tmp_path / output_name)
+    var.output_format = output_format
+    index = DuplicateIndex(4)
+    rows = [
+        ('00000000000000ff', 'b/kept.jpg', 300), ('00000000000000fe', 'b/kept - Copy.jpg', 200),
+        ('ffffffffffffffff', 'c/one.jpg', 10), ('ffffffffffffffff', 'a/two.jpg', 20), ('0f0f0f0f0f0f0f0f', 'd.jpg', 1),
+    ]
+    for image_hash, path, size in rows:
+        index.add(image_hash, path, size)
+    var.duplicate_groups = index.groups()
+    return var
+
+
+def test_format_follows_the_extension_unless_given():
+    assert report_format_for('out.CSV') == 'csv'
+    assert report_format_for('out.jsonl') == 'jsonl'
+    assert report_format_for('out.txt') == 'jsonl'
+    assert report_format_for('out.csv', 'jsonl') == 'jsonl'
+
+
+def test_jsonl_report_lists_every_group(tmp_path):
+    var = _var(tmp_path, 'report.jsonl')
+    assert write_report(var, plan_deletions(var, 'keep_smallest')) == 2
+    with open(var.output_path) as f:
+        groups = [json.loads(line) for line in f]
+    assert groups == [
+        {'group': 0, 'kept': 'c/one.jpg', 'members': [
+            {'path': 'c/one.jpg', 'hash': 'ffffffffffffffff', 'distance': 0, 'size': 10},
+            {'path': 'a/two.jpg', 'hash': 'ffffffffffffffff', 'distance': 0, 'size': 20},
+        ]},
+        {'group': 1, 'kept': 'b/kept - Copy.jpg', 'members': [
+            {'path': 'b/kept - Copy.jpg', 'hash': '00000000000000fe', 'distance': 0, 'size': 200},
+            {'path': 'b/kept.jpg', 'hash': '00000000000000ff', 'distance': 1, 'size': 300},
+        ]},
+    ]
+
+
+def test_csv_report_has_a_row_per_file(tmp_path):
+    var = _var(tmp_path, 'report.csv')
+    assert write_report(var, plan_deletions(var, 'keep_first')) == 2
+    with open(var.output_path, newline='') as f:
+        rows = list(csv.reader(f))
+    assert tuple(rows[0]) == CSV_COLUMNS
+    assert rows[1:] == [
+        ['0', 'a/two.jpg', 'kept', 'a/two.jpg', 'ffffffffffffffff', '0', '20'],
+        ['0', 'c/one.jpg', 'duplicate', 'a/two.jpg', 'ffffffffffffffff', '0', '10'],
+        ['1', 'b/kept.jpg', 'kept', 'b/kept.jpg', '00000000000000ff', '0', '300'],
+        ['1', 'b/kept - Copy.jpg', 'duplicate', 'b/kept.jpg', '00000000000000fe', '1', '200'],
+    ]
+
+
+def test_groups_without_hashes_get_sizes_from_disk(tmp_path):
+    (tmp_path / 'x.jpg').write_bytes(b'12345')
+    var = Variables()
+    var.output_path = str(tmp_path / 'report.jsonl')
+    # Plain lists of paths, as the watch mode and older callers use.
+    var.duplicate_groups = [[str(tmp_path / 'x.jpg'), str(tmp_path / 'gone.jpg')]]
+    write_report(var, plan_deletions(var))
+    with open(var.output_path) as f:
+        members = json.loads(f.readline())['members']
+    assert [(member['hash'], member['distance'], member['size']) for member in members] == [
+        (None, None, 5), (None, None, None)
+    ]
@@ -0,0 +1,185 @@
+import random
+from collections import defaultdict
+
+import pytest
+
+from cli_backup.functions import find_duplicates
+from cli_backup.packed import find_pairs_bruteforce, pack_hashes
+from cli_backup import search_index
+from cli_backup.store import ImageStore
+from cli_backup.search_index import (
+    DuplicateIndex, LiveDuplicateIndex, MultiIndexHash, ThresholdSweep, find_candidate_pairs, find_similar_pairs, find_variant_pairs, popcount,
+)
+
+
+def clustered_hashes(count, num_bits, seed, spread=12):
+    """
+    Returns:
+        list: Integer hashes scattered around a few centers, so that many
+              pairs fall within small thresholds, with some exact repeats.
+    """
+    rng = random.Random(seed)
+    centers = [rng.getrandbits(num_bits) for _ in range(max(1, count // 8))]
+    values = []
+    for _ in range(count):
+        value = rng.choice(centers)
+        for _ in range(rng.randint(0, spread)):
+            value ^= 1 << rng.randrange(num_bits)
+        values.append(value)
+    return values
+
+
+def to_hex(values, num_bits):
+    return [f"{value:0{num_bits // 4}x}" for value in values]
+
+
+def make_hashes_map(count, seed):
+    """
+    Returns:
+        dict: Hexadecimal hashes mapped to the paths of the files sharing
+              them, as built by get_image_hashes.
+    """
+    hashes_map = defaultdict(list)
+    for number, image_hash in enumerate(to_hex(clustered_hashes(count, 64, seed), 64)):
+        hashes_map[image_hash].append(f"/images/{number:04d}.jpg")
+    return dict(hashes_map)
+
+
+def reference_groups(hashes_map, threshold):
+    """
+    Groups the files of a hash map by comparing every pair of hashes and
+    merging matches transitively.
+    """
+    hashes = sorted(hashes_map)
+    values = [int(image_hash, 16) for image_hash in hashes]
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for j in range(len(hashes)):
+        for i in range(j):
+            if popcount(values[i] ^ values[j]) <= threshold:
+                parent[find(i)] = find(j)
+
+    groups = defaultdict(list)
+    for i, image_hash in enumerate(hashes):
+        groups[find(i)].extend(hashes_map[image_hash])
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+
+def as_lists(groups):
+    return sorted(sorted(group) for group in groups)
+
+
+@pytest.mark.parametrize('num_bits, threshold', [(64, 0), (64, 3), (64, 8), (64, 12), (256, 10), (256, 24)])
+def test_multi_index_pairs_match_brute_force(num_bits, threshold):
+    values = clustered_hashes(600, num_bits, seed=threshold)
+    packed = pack_hashes(to_hex(values, num_bits), num_bits)
+
+    expected = set(find_pairs_bruteforce(packed, threshold))
+    assert set(find_candidate_pairs(values, num_bits, threshold)) == expected
+    assert set(find_similar_pairs(to_hex(values, num_bits), threshold)) == expected
+    assert expected == {
+        (i, j, popcount(values[i] ^ values[j]))
+        for j in range(len(values)) for i in range(j)
+        if popcount(values[i] ^ values[j]) <= threshold
+    }
+
+
+def test_multi_index_query_after_removals():
+    values = clustered_hashes(300, 64, seed=7)
+    index = MultiIndexHash(64, 10, expected_items=len(values))
+    for key, value in enumerate(values):
+        index.add(key, value)
+    removed = set(range(0, len(values), 3))
+    for key in removed:
+        index.remove(key)
+
+    for radius in (0, 4, 10):
+        for query in values[:50]:
+            expected = {
+                (key, popcount(query ^ value)) for key, value in enumerate(values)
+                if key not in removed and popcount(query ^ value) <= radius
+            }
+            assert set(index.query(query, radius)) == expected
+
+
+@pytest.mark.parametrize('threshold', [0, 4, 10, 16])
+def test_duplicate_index_matches_reference(threshold):
+    hashes_map = make_hashes_map(500, seed=threshold)
+    expected = reference_groups(hashes_map, threshold)
+
+    assert as_lists(find_duplicates(hashes_map, threshold)) == expected
+
+    index = DuplicateIndex(threshold)
+    for image_hash, paths in hashes_map.items():
+        for path in paths:
+            index.add(image_hash, path, 1)
+    assert as_lists(index.groups()) == expected
+
+
+def test_live_index_tracks_groups_through_updates():
+    rng = random.Random(5)
+    hashes = to_hex(clustered_hashes(150, 64, seed=5, spread=6), 64)
+    initial = {}
+    for number, image_hash in enumerate(hashes[:60]):
+        initial.setdefault(image_hash, []).append(f"/images/{number:04d}.jpg")
+    index = LiveDuplicateIndex(5)
+    index.load(initial)
+    files = {path: image_hash for image_hash, paths in initial.items() for path in paths}
+
+    for step in range(600):
+        if files and rng.random() < 0.45:
+            path = rng.choice(sorted(files))
+            index.remove(files.pop(path), path)
+        else:
+            path = f"/images/new{step:04d}.jpg"
+            files[path] = rng.choice(hashes)
+            index.add(files[path], path)
+        if step % 50 == 0:
+            hashes_map = {}
+            for path, image_hash in files.items():
+                hashes_map.setdefault(image_hash, []).append(path)
+            assert as_lists(index.groups()) == reference_groups(hashes_map, 5)
+        assert index.num_groups == len(index.groups())
+
+
+def test_threshold_sweep_matches_reference():
+    hashes_map = make_hashes_map(400, seed=3)
+    store = ImageStore()
+    for image_hash, paths in hashes_map.items():
+        for path in paths:
+            store.add(image_hash, path, 1)
+    sweep = ThresholdSweep(store, 16)
+
+    # Raising the threshold continues from the last replay, lowering it
+    # starts over; both must give the same groups.
+    for threshold in (4, 10, 16, 0, 12, 12, 6):
+        expected = reference_groups(hashes_map, threshold)
+        assert as_lists(sweep.groups(threshold)) == expected
+        assert sweep.counts(threshold) == (len(expected), sum(len(group) - 1 for group in expected))
+    with pytest.raises(ValueError):
+        sweep.groups(17)
+
+
+@pytest.mark.parametrize('threshold', [0, 6, 12])
+def test_variant_pairs_match_brute_force(monkeypatch, threshold):
+    count, num_variants = 200, 7
+    values = clustered_hashes(count * (num_variants + 1), 64, seed=threshold)
+    packed = pack_hashes(to_hex(values[:count], 64), 64)
+    packed_variants = pack_hashes(to_hex(values[count:], 64), 64).reshape(count, num_variants, -1)
+
+    found = {}
+    for bruteforce in (False, True):
+        monkeypatch.setattr(search_index, 'use_bruteforce', lambda *args, bruteforce=bruteforce: bruteforce)
+        found[bruteforce] = set(find_variant_pairs(packed, packed_variants, 64, threshold))
+
+    expected = {
+        (i, j, popcount(values[count + i * num_variants + v] ^ values[j]))
+        for i in range(count) for v in range(num_variants) for j in range(count)
+        if i != j and popcount(values[count + i * num_variants + v] ^ values[j]) <= threshold
+    }
+    assert found[False] == found[True] == expected
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from cli_backup.service import DuplicateService
+from cli_backup.variables import Variables
+
+
+def test_resolve_confines_paths_to_the_tree(tmp_path):
+    tree = tmp_path / 'tree'
+    (tree / 'sub').mkdir(parents=True)
+    (tree / 'sub' / 'inside.jpg').write_bytes(b'')
+    (tmp_path / 'outside.jpg').write_bytes(b'')
+    os.symlink(tmp_path / 'outside.jpg', tree / 'link.jpg')
+    os.symlink(tmp_path, tree / 'escape')
+
+    var = Variables()
+    var.target_directory = str(tree)
+    var.workers = 1
+    service = DuplicateService(var)
+    try:
+        assert service.resolve(str(tree / 'sub' / 'inside.jpg')) == str(tree / 'sub' / 'inside.jpg')
+        assert service.resolve(str(tree / 'missing.jpg')) == str(tree / 'missing.jpg')
+        for path in (
+            tmp_path / 'outside.jpg',
+            tree / '..' / 'outside.jpg',
+            tree / 'link.jpg',
+            tree / 'escape' / 'outside.jpg',
+            str(tree) + '-sibling/a.jpg',
+        ):
+            with pytest.raises(ValueError):
+                service.resolve(str(path))
+    finally:
+        service.close()
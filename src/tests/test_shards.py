@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from cli_backup.functions import find_duplicates, get_image_hashes
+from cli_backup.search_index import DuplicateIndex
+from cli_backup.shards import check_shard_headers, read_shard_file, write_shard_file
+from cli_backup.variables import Variables
+
+THRESHOLD = 10
+
+
+def _scan_var(corpus_dir, shard=None, shard_by='path'):
+    var = Variables()
+    var.target_directory = corpus_dir
+    var.shard = shard
+    var.shard_by = shard_by
+    return var
+
+
+@pytest.mark.parametrize('shard_by', ['path', 'directory'])
+def test_merged_shards_match_a_full_scan(corpus_dir, tmp_path, monkeypatch, shard_by):
+    full_map = get_image_hashes(_scan_var(corpus_dir), 8, 'dhash')
+    full_groups = find_duplicates(full_map, THRESHOLD)
+    assert full_groups
+
+    # The shards are scanned with a relative directory, and merged from
+    # another working directory.
+    monkeypatch.chdir(os.path.dirname(corpus_dir))
+    shard_paths = []
+    for index in range(3):
+        var = _scan_var(os.path.basename(corpus_dir), (index, 3), shard_by)
+        entries = {}
+        hashes_map = get_image_hashes(var, 8, 'dhash', entries=entries)
+        shard_paths.append(str(tmp_path / f"shard-{index}-of-3.jsonl.gz"))
+        write_shard_file(shard_paths[-1], var, 'dhash', 8, hashes_map, entries)
+    monkeypatch.chdir(str(tmp_path))
+    shards = {shard_path: read_shard_file(shard_path) for shard_path in shard_paths}
+    check_shard_headers({shard_path: header for shard_path, (header, _) in shards.items()})
+
+    rows = [
+        (os.path.join(header['target_directory'], file_path), size, image_hash)
+        for header, shard_rows in shards.values() for file_path, size, image_hash in shard_rows
+    ]
+    # Every file is in exactly one shard.
+    assert sorted(file_path for file_path, _, _ in rows) == sorted(
+        file_path for paths in full_map.values() for file_path in paths
+    )
+
+    index = DuplicateIndex(THRESHOLD)
+    for file_path, size, image_hash in rows:
+        index.add(image_hash, file_path, size)
+    assert sorted(map(list, index.groups())) == sorted(map(sorted, full_groups))
+
+    with pytest.raises(ValueError, match='Missing shards'):
+        check_shard_headers({shard_path: header for shard_path, (header, _) in list(shards.items())[1:]})
@@ -0,0 +1,62 @@
+import numpy as np
+
+from cli_backup.store import ImageStore, PathTable
+
+
+def test_path_table_gives_back_every_path():
+    paths = [
+        '/photos/2020/a.jpg', '/photos/2020/b.jpg', 'relative/c.png', 'd.gif', 'C:\\Pictures\\e.jpg',
+        '/photos/2020/caf\u00e9.jpg', '/photos/2020/bad\udcff.jpg', 'archive.zip!/inner/f.jpg', '/photos/2020/',
+    ]
+    table = PathTable()
+    assert [table.add(path) for path in paths] == list(range(len(paths)))
+    assert len(table) == len(paths)
+    assert [table[path_id] for path_id in range(len(paths))] == paths
+    # Directories are stored once.
+    assert table.directories.count('/photos/2020/') == 1
+
+
+def test_store_keeps_hashes_sizes_and_groups():
+    store = ImageStore()
+    rows = [
+        ('00000000000000ff', '/b/2.jpg', 20), ('00000000000000ff', '/a/1.jpg', 10),
+        ('ffffffffffffffff', '/c/3.jpg', 30), ('00000000000000fe', '/a/0.jpg', 5), ('0f0f0f0f0f0f0f0f', '/d/4.jpg', -1),
+    ]
+    assert [store.add(*row) for row in rows] == [(0, True), (0, False), (1, True), (2, True), (3, True)]
+    assert (len(store), store.num_hashes, store.num_bits) == (5, 4, 64)
+    assert list(store.sizes) == [20, 10, 30, 5, -1]
+    assert [store.hash_hex(hash_id) for hash_id in range(4)] == [
+        '00000000000000ff', 'ffffffffffffffff', '00000000000000fe', '0f0f0f0f0f0f0f0f'
+    ]
+    assert store.packed_hashes()[:, 0].tolist() == [0xff, 0xffffffffffffffff, 0xfe, 0x0f0f0f0f0f0f0f0f]
+    assert store.hashes_map() == {
+        '00000000000000ff': ['/b/2.jpg', '/a/1.jpg'], 'ffffffffffffffff': ['/c/3.jpg'],
+        '00000000000000fe': ['/a/0.jpg'], '0f0f0f0f0f0f0f0f': ['/d/4.jpg'],
+    }
+
+    # Hashes 0 and 2 in one group, 1 and 3 alone.
+    groups = store.build_groups(np.array([7, 1, 7, 2]))
+    assert len(groups) == 1
+    assert list(groups) == [['/a/0.jpg', '/a/1.jpg', '/b/2.jpg']]
+    assert groups[-1] == groups[0]
+    assert groups.file_ids(0).tolist() == [3, 1, 0]
+    assert groups.total_duplicates() == 2
+
+    groups = store.group_files([[2, 4], [0], [1, 3]])
+    assert list(groups) == [['/a/0.jpg', '/a/1.jpg'], ['/c/3.jpg', '/d/4.jpg']]
+
+
+def test_store_packs_long_hashes_and_variants():
+    store = ImageStore()
+    long_hash = 'f' * 16 + '0' * 15 + '1'
+    variants = ('1' + '0' * 31, '0' * 31 + '2')
+    store.add(long_hash, 'a.jpg', variants=variants)
+    assert store.num_bits == 128
+    assert store.packed_hashes().tolist() == [[0xffffffffffffffff, 1]]
+    assert store.hash_hex(0) == long_hash
+    assert store.packed_variants().tolist() == [[[1 << 60, 0], [0, 2]]]
+
+
+def test_empty_store_has_no_groups():
+    store = ImageStore()
+    assert len(store.build_groups(np.zeros(0))) == 0
@@ -0,0 +1,87 @@
+import os
+import shutil
+
+from PIL import Image
+
+from cli_backup import watch
+from cli_backup.functions import find_duplicates, get_image_hashes
+from cli_backup.scanner import iter_image_files
+from cli_backup.variables import Variables
+from cli_backup.watch import DirectoryWatcher, PollingBackend
+
+
+def _save_image(path, seed):
+    Image.effect_mandelbrot((64, 64), (-2 + seed / 10, -1.5, 1, 1.5), 40).convert('RGB').save(path)
+
+
+def _watcher(directory):
+    var = Variables()
+    var.target_directory = str(directory)
+    var.threshold = 6
+    return DirectoryWatcher(var, PollingBackend(1.0))
+
+
+def _full_scan_groups(watcher):
+    hashes_map = get_image_hashes(watcher.var, watcher.hash_size, watcher.hash_method)
+    return sorted(map(sorted, find_duplicates(hashes_map, watcher.var.threshold)))
+
+
+def test_updates_match_a_full_rescan(corpus_dir, tmp_path):
+    target = tmp_path / 'tree'
+    shutil.copytree(os.path.join(corpus_dir, 'a'), str(target))
+    shutil.copytree(os.path.join(corpus_dir, 'b'), str(target / 'b'))
+    watcher = _watcher(target)
+    assert sorted(map(sorted, watcher.initial_scan())) == _full_scan_groups(watcher)
+
+    files = sorted(entry.path for entry in iter_image_files(str(target / '0000')))
+    # Removed, added, and rewritten files, and a new and a removed directory.
+    os.remove(files[0])
+    shutil.copy(files[1], str(target / 'added.jpg'))
+    _save_image(files[2], 3)
+    os.mkdir(target / 'new')
+    shutil.copy(files[3], str(target / 'new' / 'nested_copy.jpg'))
+    removed_directory = str(target / 'b' / '0000')
+    shutil.rmtree(removed_directory)
+
+    changed = watcher.backend.wait(0)
+    assert str(target) in changed
+    # Rewriting a file in place does not change its directory.
+    changed.add(os.path.dirname(files[2]))
+    new_duplicates = watcher.update(changed)
+
+    assert sorted(map(sorted, watcher.index.groups())) == _full_scan_groups(watcher)
+    assert watcher.index.num_groups == len(watcher.index.groups())
+    reported = [path for path, _ in new_duplicates]
+    assert str(target / 'added.jpg') in reported and str(target / 'new' / 'nested_copy.jpg') in reported
+    assert not any(path.startswith(removed_directory + os.sep) for path in watcher.files)
+
+
+def test_files_that_failed_are_only_retried_once_they_change(tmp_path, monkeypatch):
+    _save_image(tmp_path / 'a.jpg', 0)
+    (tmp_path / 'broken.jpg').write_bytes(b'not an image')
+    watcher = _watcher(tmp_path)
+    watcher.initial_scan()
+    assert watcher.files[str(tmp_path / 'broken.jpg')][1] is None
+
+    hashed = []
+    hash_file_entries = watch.hash_file_entries
+
+    def recording_hash_file_entries(entries, *args, **kwargs):
+        entries = list(entries)
+        hashed.extend(entry.path for entry in entries)
+        return hash_file_entries(entries, *args, **kwargs)
+
+    monkeypatch.setattr(watch, 'hash_file_entries', recording_hash_file_entries)
+
+    _save_image(tmp_path / 'b.jpg', 0)
+    watcher.update({str(tmp_path)})
+    assert hashed == [str(tmp_path / 'b.jpg')]
+
+    del hashed[:]
+    _save_image(tmp_path / 'broken.jpg', 0)
+    os.utime(tmp_path / 'broken.jpg', ns=(1, 1))
+    watcher.update({str(tmp_path)})
+    assert hashed == [str(tmp_path / 'broken.jpg')]
+    assert sorted(map(sorted, watcher.index.groups())) == [
+        [str(tmp_path / name) for name in ('a.jpg', 'b.jpg', 'broken.jpg')]
+    ]